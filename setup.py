@@ -49,7 +49,7 @@ setup(
     install_requires=list_reqs(),
     extras_require={
         'dev': ['pytest', 'black', 'flake8'],
-        'api': ['fastapi', 'uvicorn'],
+        'api': ['fastapi', 'uvicorn', 'orjson'],
         'ui': ['streamlit'],
     },
     include_package_data=True,
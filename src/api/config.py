@@ -4,9 +4,75 @@ from pathlib import Path
 
 class Settings(BaseModel):
     MODEL_PATH: str = os.getenv("MODEL_PATH", 'mikhaelkrns/invoice-ner-v1')
+    MODEL_BACKEND: str = os.getenv("MODEL_BACKEND", "auto")
     AGGREGATION_STRATEGY: str = os.getenv("AGGREGATION_STRATEGY", "max")
     CONF_THRESH: float = float(os.getenv("CONF_THRESH", "0.60"))
+    # "full" always runs NER on the whole text; "windowed" runs it on header + summary windows;
+    # "tiered" runs regex first and NER only for unsettled fields
+    EXTRACTION_MODE: str = os.getenv("EXTRACTION_MODE", "full").lower()
+    TIER_POLICY: str = os.getenv("TIER_POLICY", "")
+    NER_HEADER_CHARS: int = int(os.getenv("NER_HEADER_CHARS", "0"))
+    NER_SUMMARY_CHARS: int = int(os.getenv("NER_SUMMARY_CHARS", "300"))
+    # supplier / template extraction profiles built by src/build_profiles.py ("" = off); a matched
+    # profile runs the tiered path with its own rules, NER window and thresholds
+    PROFILE_STORE: str = os.getenv("PROFILE_STORE", "")
+    PROFILE_CACHE_SIZE: int = int(os.getenv("PROFILE_CACHE_SIZE", "1024"))
+    # NER pipelines (each with its own tokenizer, one shared model) for requests running in parallel threads
+    NER_SESSIONS: int = int(os.getenv("NER_SESSIONS", os.getenv("MAX_CONCURRENT_JOBS", "1")))
+    # texts per NER forward pass and per streamed chunk for bulk text extraction
+    NER_BATCH_SIZE: int = int(os.getenv("NER_BATCH_SIZE", "8"))
+    TEXT_CHUNK_SIZE: int = int(os.getenv("TEXT_CHUNK_SIZE", "64"))
     ENABLE_OCR: bool = os.getenv("ENABLE_OCR", "true").lower() == "true"
     OCR_LANG: str = os.getenv("OCR_LANG", "en")
+    # text crops per recogniser forward pass, and at most this many queued images share one bulk OCR call
+    OCR_BATCH_SIZE: int = int(os.getenv("OCR_BATCH_SIZE", "64"))
+    OCR_BULK_IMAGES: int = int(os.getenv("OCR_BULK_IMAGES", "8"))
+    # /predict-images runs decode -> OCR -> NER -> post-process as overlapping stages over bounded queues
+    PIPELINE_QUEUE_SIZE: int = int(os.getenv("PIPELINE_QUEUE_SIZE", "2"))
+    PIPELINE_DECODE_WORKERS: int = int(os.getenv("PIPELINE_DECODE_WORKERS", "1"))
+    PIPELINE_OCR_WORKERS: int = int(os.getenv("PIPELINE_OCR_WORKERS", "1"))
+    PIPELINE_NER_WORKERS: int = int(os.getenv("PIPELINE_NER_WORKERS", "1"))
+    # fields whose source OCR boxes fall below OCR_LOW_CONF are flagged and, with OCR_REFINE, re-read at OCR_REFINE_SCALE
+    OCR_LOW_CONF: float = float(os.getenv("OCR_LOW_CONF", "0.5"))
+    OCR_REFINE: bool = os.getenv("OCR_REFINE", "true").lower() == "true"
+    OCR_REFINE_SCALE: float = float(os.getenv("OCR_REFINE_SCALE", "2.0"))
+    OCR_RETURN_TOKENS: bool = os.getenv("OCR_RETURN_TOKENS", "false").lower() == "true"
+    MAX_UPLOAD_BYTES: int = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+    MAX_REQUEST_BYTES: int = int(os.getenv("MAX_REQUEST_BYTES", str(200 * 1024 * 1024)))
+    MAX_IMAGE_PIXELS: int = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+
+    # byte-identical re-uploads reuse the cached result of the earlier one; with DEDUP_NEAR, a similar-looking
+    # upload (re-scan, re-compression) is still OCR'd and only skips NER when its text matches the cached one
+    DEDUP_ENABLED: bool = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+    DEDUP_NEAR: bool = os.getenv("DEDUP_NEAR", "false").lower() == "true"
+    DEDUP_MAX_DISTANCE: int = int(os.getenv("DEDUP_MAX_DISTANCE", "6"))
+    DEDUP_BLOCK_TOL: float = float(os.getenv("DEDUP_BLOCK_TOL", "12"))
+    DEDUP_CAPACITY: int = int(os.getenv("DEDUP_CAPACITY", "2000"))
+
+    # request deadline in seconds (0 = none); clients may ask for a shorter one via DEADLINE_HEADER
+    REQUEST_TIMEOUT_S: float = float(os.getenv("REQUEST_TIMEOUT_S", "120"))
+    DEADLINE_HEADER: str = os.getenv("DEADLINE_HEADER", "X-Request-Timeout")
+    DISCONNECT_POLL_S: float = float(os.getenv("DISCONNECT_POLL_S", "0.5"))
+    MAX_CONCURRENT_JOBS: int = int(os.getenv("MAX_CONCURRENT_JOBS", "1"))
+
+    # /admin/models hot-loads model versions (disabled while ADMIN_TOKEN is empty); new versions are warmed
+    # on MODEL_WARMUP_SAMPLES texts of MODEL_WARMUP_DATA (JSONL, built-in sample invoice if unset).
+    # Routing state lives in the worker process, so the admin endpoints refuse to run with WEB_CONCURRENCY > 1
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+    MODEL_WARMUP_DATA: str = os.getenv("MODEL_WARMUP_DATA", "")
+    MODEL_WARMUP_SAMPLES: int = int(os.getenv("MODEL_WARMUP_SAMPLES", "8"))
+    # clients may pin a loaded version (e.g. the candidate) by its label
+    MODEL_VERSION_HEADER: str = os.getenv("MODEL_VERSION_HEADER", "X-Model-Version")
+
+    # CPU resource plan: "auto" sizes threads from detected cores / cgroup quota, "manual" uses the values below, "off" leaves library defaults.
+    # Torch has one process-wide intra-op pool, shared by the EasyOCR models and NER, so there is no OCR/NER core split;
+    # TORCH_THREADS sizes it and CV2_THREADS the OpenCV pool used for image preprocessing
+    CPU_PLAN: str = os.getenv("CPU_PLAN", "auto").lower()
+    WORKERS: int = int(os.getenv("WEB_CONCURRENCY", "1"))
+    WORKER_INDEX: int = int(os.getenv("WORKER_INDEX", "-1"))
+    TORCH_THREADS: int = int(os.getenv("TORCH_THREADS", "0"))
+    CV2_THREADS: int = int(os.getenv("CV2_THREADS", "0"))
+    INTEROP_THREADS: int = int(os.getenv("INTEROP_THREADS", "1"))
+    CPU_AFFINITY: bool = os.getenv("CPU_AFFINITY", "false").lower() == "true"
 
 settings = Settings()
@@ -0,0 +1,139 @@
+from pydantic import BaseModel
+from typing import List, Optional, Tuple
+import math
+import os
+
+from .config import settings, Settings
+from src.utils.logger import default_logger as Logger
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+class CPUPlan(BaseModel):
+    mode: str
+    detected_cores: int
+    cgroup_quota: Optional[float] = None
+    available_cores: int
+    workers: int
+    worker_index: Optional[int] = None
+    cores_per_worker: int
+    torch_threads: int
+    cv2_threads: int
+    interop_threads: int
+    affinity: Optional[List[int]] = None
+
+def _read_cgroup_quota() -> Optional[float]:
+    """CPU quota in cores from cgroup v2 (cpu.max) or v1 (cfs_quota_us), None if unlimited"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read().strip())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read().strip())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+def detect_available_cores() -> Tuple[List[int], Optional[float], int]:
+    """Return (usable core ids, cgroup quota, effective core count)"""
+    try:
+        cores = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = list(range(os.cpu_count() or 1))
+    quota = _read_cgroup_quota()
+    available = len(cores)
+    if quota is not None:
+        available = max(1, min(available, math.floor(quota)))
+    return cores, quota, available
+
+def build_cpu_plan(cfg: Settings = settings) -> CPUPlan:
+    cores, quota, available = detect_available_cores()
+    workers = max(1, cfg.WORKERS)
+    # uvicorn doesn't tell a worker its index, so with several workers it is only known from WORKER_INDEX
+    if cfg.WORKER_INDEX >= 0:
+        worker_index = cfg.WORKER_INDEX % workers
+    else:
+        worker_index = 0 if workers == 1 else None
+    cores_per_worker = max(1, available // workers)
+
+    if cfg.CPU_PLAN == "manual":
+        torch_threads = cfg.TORCH_THREADS or cores_per_worker
+        cv2_threads = cfg.CV2_THREADS or cores_per_worker
+    else:
+        # OCR and NER both run on torch's single pool, so it gets the whole worker budget
+        torch_threads = cv2_threads = cores_per_worker
+
+    affinity = None
+    if cfg.CPU_AFFINITY and worker_index is None:
+        Logger.warning(f"CPU_AFFINITY with {workers} workers needs WORKER_INDEX set per worker, not pinning")
+    elif cfg.CPU_AFFINITY and len(cores) >= workers * cores_per_worker:
+        start = worker_index * cores_per_worker
+        affinity = cores[start:start + cores_per_worker]
+
+    return CPUPlan(
+        mode=cfg.CPU_PLAN,
+        detected_cores=len(cores),
+        cgroup_quota=quota,
+        available_cores=available,
+        workers=workers,
+        worker_index=worker_index,
+        cores_per_worker=cores_per_worker,
+        torch_threads=torch_threads,
+        cv2_threads=cv2_threads,
+        interop_threads=max(1, cfg.INTEROP_THREADS),
+        affinity=affinity,
+    )
+
+class CPUResourceManager:
+    """Partitions cores between workers and sizes each worker's torch and cv2 thread pools"""
+
+    def __init__(self, cfg: Settings = settings):
+        self.enabled = cfg.CPU_PLAN != "off"
+        self.plan = build_cpu_plan(cfg)
+        self._torch_applied = False
+
+    def apply_env(self):
+        """Must run before torch / cv2 are imported so their thread pools are sized correctly"""
+        if not self.enabled:
+            return
+        threads = str(max(self.plan.torch_threads, self.plan.cv2_threads))
+        for var in THREAD_ENV_VARS:
+            os.environ[var] = threads
+        if self.plan.affinity:
+            try:
+                os.sched_setaffinity(0, self.plan.affinity)
+            except (AttributeError, OSError) as e:
+                Logger.warning(f"Could not set CPU affinity {self.plan.affinity}: {e}")
+
+    def apply_torch(self):
+        """Size torch's and cv2's pools once per process.
+
+        Both are process-wide and requests run concurrently, so they are never resized per
+        stage. Torch's one intra-op pool serves the EasyOCR models and NER alike.
+        """
+        if not self.enabled or self._torch_applied:
+            return
+        import torch
+        torch.set_num_threads(self.plan.torch_threads)
+        try:
+            torch.set_num_interop_threads(self.plan.interop_threads)
+        except RuntimeError as e:
+            # interop pool can only be sized before the first parallel op
+            Logger.warning(f"Could not set torch interop threads: {e}")
+        try:
+            import cv2
+            cv2.setNumThreads(self.plan.cv2_threads)
+        except ImportError:
+            pass
+        self._torch_applied = True
+        Logger.info(f"CPU plan applied: {self.plan.model_dump()}")
+
+cpu_manager = CPUResourceManager()
@@ -0,0 +1,119 @@
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Optional
+import asyncio
+import time
+
+from .config import settings
+from src.utils.logger import default_logger as Logger
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time before a stage could start"""
+
+class RequestCancelled(Exception):
+    """The client disconnected, nobody is waiting for the result"""
+
+# limits how many OCR / NER stages run at once per process; waiters past their deadline never start
+_slots: Optional[asyncio.Semaphore] = None
+deadline_stats = Counter()
+
+def _get_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(settings.MAX_CONCURRENT_JOBS)
+    return _slots
+
+class Deadline:
+    def __init__(self, timeout_s: Optional[float] = None):
+        self.timeout_s = timeout_s
+        self.expires_at = time.monotonic() + timeout_s if timeout_s else None
+        self.cancelled = False
+
+    @classmethod
+    def from_request(cls, request: Request) -> "Deadline":
+        """Timeout from the deadline header (seconds), capped by and defaulting to REQUEST_TIMEOUT_S"""
+        timeout_s = settings.REQUEST_TIMEOUT_S or None
+        header = request.headers.get(settings.DEADLINE_HEADER)
+        if header:
+            try:
+                requested = float(header)
+                if requested > 0:
+                    timeout_s = min(requested, timeout_s) if timeout_s else requested
+            except ValueError:
+                Logger.warning(f"Ignoring invalid {settings.DEADLINE_HEADER} header: {header!r}")
+        return cls(timeout_s)
+
+    def remaining(self) -> Optional[float]:
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.cancelled or (self.expires_at is not None and time.monotonic() >= self.expires_at)
+
+    def check(self, stage: str = ""):
+        if self.cancelled:
+            raise RequestCancelled(f"Client disconnected before {stage}")
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            raise DeadlineExceeded(f"Deadline of {self.timeout_s}s exceeded before {stage}")
+
+class RequestGuard:
+    """Deadline plus client-disconnect watcher for one request.
+
+    Blocking stages go through run(), which checks the deadline, waits for a free slot
+    while the request is still alive, and runs the stage in the threadpool.
+    """
+
+    def __init__(self, request: Request):
+        self.request = request
+        self.deadline = Deadline.from_request(request)
+        self._watcher = None
+
+    async def __aenter__(self):
+        self._watcher = asyncio.create_task(self._watch_disconnect())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._watcher.cancel()
+        if exc_type is DeadlineExceeded:
+            deadline_stats["timed_out"] += 1
+        elif exc_type is RequestCancelled:
+            deadline_stats["cancelled"] += 1
+        return False
+
+    async def _watch_disconnect(self):
+        while not self.deadline.cancelled:
+            await asyncio.sleep(settings.DISCONNECT_POLL_S)
+            if await self.request.is_disconnected():
+                Logger.info(f"Client disconnected from {self.request.url.path}, dropping remaining work")
+                self.deadline.cancelled = True
+
+    @asynccontextmanager
+    async def slot(self, stage: str):
+        """Hold one of the MAX_CONCURRENT_JOBS slots, waiting only while the request is still alive"""
+        self.deadline.check(stage)
+        slots = _get_slots()
+        while True:
+            remaining = self.deadline.remaining()
+            wait = settings.DISCONNECT_POLL_S if remaining is None else min(remaining, settings.DISCONNECT_POLL_S)
+            try:
+                await asyncio.wait_for(slots.acquire(), timeout=max(wait, 0.01))
+                break
+            except asyncio.TimeoutError:
+                self.deadline.check(stage)
+        try:
+            yield
+        finally:
+            slots.release()
+
+    async def run(self, stage: str, fn, *args, **kwargs):
+        async with self.slot(stage):
+            return await self.run_now(stage, fn, *args, **kwargs)
+
+    async def run_now(self, stage: str, fn, *args, **kwargs):
+        """run() for a caller already holding a slot"""
+        self.deadline.check(stage)
+        return await run_in_threadpool(fn, *args, **kwargs)
@@ -1,82 +1,370 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request 
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
-from .schemas import HealthResponse, PredictTextRequest, BulkResponse, BulkResult
-from .services.ocr import ocr_image_to_text
+from fastapi.responses import JSONResponse, StreamingResponse
 from .config import settings
+from .cpu import cpu_manager
+cpu_manager.apply_env()
+
+from .schemas import HealthResponse, PredictTextRequest, BulkResponse, LoadModelRequest
+from .responses import FastJSONResponse, ResponseOptions
+from .deadline import RequestGuard, DeadlineExceeded, RequestCancelled, deadline_stats
+from .pipeline import Stage, StagedPipeline, pipeline_stats
+from .services.bulk_text import FORMATS, MEDIA_TYPES, detect_format, iter_texts, extract_records, serialize
+from .services.dedup import duplicate_index, image_fingerprint
+from .services.ocr import ocr_image_to_text, ocr_images_to_text, decode_image, check_upload_size, upload_size, ImageTooLargeError
 from src.utils.logger import default_logger as Logger
-from typing import List
+from typing import List, Optional
+import time
 
 from contextlib import asynccontextmanager
-from .services.extractor import init_extractor, ExtractorService, extractor_service
+from .services.extractor import ExtractorService
+from .services.models import ModelRouter, load_warmup_texts
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    cpu_manager.apply_torch()
     app.state.extractor_service = ExtractorService()
+    app.state.models = ModelRouter(app.state)
+    app.state.models.warm_up(app.state.extractor_service,
+                             load_warmup_texts(settings.MODEL_WARMUP_DATA, settings.MODEL_WARMUP_SAMPLES))
+    if settings.ADMIN_TOKEN and settings.WORKERS > 1:
+        Logger.warning(f"/admin/models is disabled with {settings.WORKERS} workers: each worker routes on its own")
     yield
 
-app = FastAPI(title="Invoice NER API", version="1.0.0", lifespan=lifespan)
+app = FastAPI(title="Invoice NER API", version="1.0.0", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    # reject oversized bodies from the header, before multipart parsing spools them
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.MAX_REQUEST_BYTES:
+        return JSONResponse(status_code=413, content={"detail": f"Request body exceeds {settings.MAX_REQUEST_BYTES} bytes"})
+    return await call_next(request)
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc), "timed_out": True})
+
+@app.exception_handler(RequestCancelled)
+async def request_cancelled_handler(request: Request, exc: RequestCancelled):
+    # nginx's "client closed request"; nobody reads it, but it keeps the access log honest
+    return JSONResponse(status_code=499, content={"detail": str(exc)})
+
+def _extractor(request: Request) -> ExtractorService:
+    """The model version serving this request: the one named in MODEL_VERSION_HEADER if loaded,
+    otherwise the active one or, for its traffic share, the candidate"""
+    models: ModelRouter = getattr(request.app.state, "models", None)
+    service = models.pick(request.headers.get(settings.MODEL_VERSION_HEADER)) if models else None
+    if service is None:
+        raise HTTPException(503, "Model not loaded")
+    return service
+
+def _check_upload(file: UploadFile):
+    check_upload_size(file.size if file.size is not None else upload_size(file.file))
+
+def _find_duplicate(fileobj):
+    """(fingerprint, cached result of a byte-identical upload, (distance, cached result) of a
+    similar-looking one) for an upload, all None with dedup off"""
+    if not settings.DEDUP_ENABLED:
+        return None, None, None
+    fingerprint = image_fingerprint(fileobj, near=settings.DEDUP_NEAR)
+    cached = duplicate_index.lookup(fingerprint)
+    similar = duplicate_index.lookup_similar(fingerprint) if cached is None else None
+    return fingerprint, cached, similar
+
+def _cached_result(cached):
+    """(structured, ocr_meta, quality, raw_entities, boxes, model_version) of a byte-identical
+    earlier upload; model_version is the version that produced it, not this request's"""
+    ocr_meta = {**cached["ocr_meta"], "cached": True, "duplicate_of": cached["filename"]}
+    return (cached["structured"], ocr_meta, cached["quality"], cached["raw_entities"], cached["boxes"],
+            cached["model_version"])
+
+def _reuse_similar(similar, text, ocr_meta):
+    """(structured, ocr_meta, quality, raw_entities, model_version) of a similar-looking earlier
+    upload whose OCR text is identical, or None when NER has to run"""
+    cached = duplicate_index.confirm(similar, text) if similar is not None else None
+    if cached is None:
+        return None
+    ocr_meta = {**ocr_meta, "duplicate_of": cached["filename"], "hash_distance": similar[0]}
+    return cached["structured"], ocr_meta, cached["quality"], cached["raw_entities"], cached["model_version"]
+
+def _remember(fingerprint, filename, text, structured, ocr_meta, quality, raw_entities, boxes, model_version):
+    if fingerprint is not None and structured:
+        duplicate_index.add(fingerprint, {"filename": filename, "text": text, "structured": structured,
+                                          "ocr_meta": ocr_meta, "quality": quality, "raw_entities": raw_entities,
+                                          "boxes": boxes, "model_version": model_version})
+
 @app.get("/health", response_model=HealthResponse)
 def health():
-    
+    extractor_service = getattr(app.state, "extractor_service", None)
     return HealthResponse(
-        model_loaded= app.state.extractor_service is not None,
-        ocr_enabled=settings.ENABLE_OCR
+        model_loaded= extractor_service is not None,
+        model_version=getattr(extractor_service, "model_version", None),
+        model_backend=getattr(extractor_service, "backend", None),
+        ocr_enabled=settings.ENABLE_OCR,
+        cpu_plan=cpu_manager.plan.model_dump() if cpu_manager.enabled else None,
+        extraction_stats=extractor_service.stats() if extractor_service is not None else None,
+        request_stats={**deadline_stats, **{f"dedup_{k}": v for k, v in duplicate_index.stats.items()},
+                       "pipeline": pipeline_stats()},
+        # the router status is one process's; with several workers it would not describe the fleet
+        models=app.state.models.status() if getattr(app.state, "models", None) and settings.WORKERS == 1 else None
     )
 
 @app.post("/predict-text")
-def predict_text(payload: PredictTextRequest):
-    if extractor_service is None:
-        raise HTTPException(503, "Model not loaded")
-    structured = extractor_service.extract(payload.text)
-  
-    return {
-        "structured": structured,
-        "meta": {"source": "text"}
+def predict_text(payload: PredictTextRequest, request: Request, options: ResponseOptions = Depends()):
+    extractor_service = _extractor(request)
+    models: ModelRouter = request.app.state.models
+    start = time.perf_counter()
+    try:
+        structured, raw_entities = extractor_service.extract(payload.text, return_entities=True)
+    except Exception:
+        models.record(extractor_service, time.perf_counter() - start, None)
+        raise
+    models.record(extractor_service, time.perf_counter() - start, structured)
+
+    body = {
+        "structured": options.select(structured),
+        "meta": {"source": "text", "model_version": extractor_service.label}
     }
+    if options.wants("raw_entities"):
+        body["raw_entities"] = raw_entities
+    return FastJSONResponse(body)
+
+@app.post("/predict-texts")
+def predict_texts(file: UploadFile = File(...), input_format: Optional[str] = None, output_format: Optional[str] = None,
+                  text_field: Optional[str] = None, request: Request = None, options: ResponseOptions = Depends()):
+    """Bulk extraction over a JSONL or CSV upload, streamed back as JSONL or CSV in input order"""
+    extractor_service = _extractor(request)
+    models: ModelRouter = request.app.state.models
+    input_format = input_format or detect_format(file.filename)
+    output_format = output_format or input_format
+    if input_format not in FORMATS or output_format not in FORMATS:
+        raise HTTPException(400, f"Formats must be one of {FORMATS}")
+
+    def extract_batch(texts):
+        start = time.perf_counter()
+        try:
+            outputs = extractor_service.extract_batch(texts)
+        except Exception:
+            per_doc = (time.perf_counter() - start) / len(texts)
+            for _ in texts:
+                models.record(extractor_service, per_doc, None)
+            raise
+        per_doc = (time.perf_counter() - start) / len(texts)
+        for structured in outputs:
+            models.record(extractor_service, per_doc, structured)
+        return outputs
+
+    records = iter_texts(file.file, input_format, text_field)
+    results = extract_records(extract_batch, records, settings.TEXT_CHUNK_SIZE)
+    return StreamingResponse(
+        serialize(results, output_format, fields=options.fields),
+        media_type=MEDIA_TYPES[output_format],
+        headers={"Content-Disposition": f'attachment; filename="predictions.{output_format}"',
+                 settings.MODEL_VERSION_HEADER: extractor_service.label}
+    )
 
 @app.post("/predict-image")
-async def predict_image(file: UploadFile = File(...), request: Request = None):
-    extractor_service = getattr(request.app.state, "extractor_service", None)
-    if extractor_service is None:
-        raise HTTPException(503, "Model not loaded")
+async def predict_image(file: UploadFile = File(...), request: Request = None, options: ResponseOptions = Depends()):
+    extractor_service = _extractor(request)
+    models: ModelRouter = request.app.state.models
     if not settings.ENABLE_OCR:
         raise HTTPException(400, "OCR disabled")
 
-    text, ocr_meta = ocr_image_to_text(await file.read())
-    if not text.strip():
-        raise HTTPException(422, "OCR produced empty text")
+    async with RequestGuard(request) as guard:
+        try:
+            _check_upload(file)
+            # hashing reads the whole upload and DEDUP_NEAR decodes it, so it stays off the event loop
+            fingerprint, cached, similar = await guard.run("decode", _find_duplicate, file.file)
+            if cached is None:
+                # starlette already spooled the upload to a temp file; decode straight from it
+                text, ocr_meta, layout = await guard.run("ocr", ocr_image_to_text, file.file, return_layout=True)
+        except ImageTooLargeError as e:
+            raise HTTPException(413, str(e))
+        finally:
+            await file.close()
 
-    structured = extractor_service.extract(text)
+        model_version = extractor_service.label
+        if cached is not None:
+            structured, ocr_meta, quality, raw_entities, boxes, model_version = _cached_result(cached)
+        else:
+            if not text.strip():
+                raise HTTPException(422, "OCR produced empty text")
+            reused = _reuse_similar(similar, text, ocr_meta)
+            if reused is not None:
+                structured, ocr_meta, quality, raw_entities, model_version = reused
+            else:
+                start = time.perf_counter()
+                try:
+                    structured, quality, raw_entities = await guard.run(
+                        "ner", extractor_service.extract_ocr, layout, deadline=guard.deadline, return_entities=True)
+                except (DeadlineExceeded, RequestCancelled):
+                    raise
+                except Exception:
+                    models.record(extractor_service, time.perf_counter() - start, None)
+                    raise
+                models.record(extractor_service, time.perf_counter() - start, structured, quality)
+            boxes = layout.box_list()
+            # only the active version's results are reused for later duplicates
+            if models.is_active(extractor_service):
+                _remember(fingerprint, file.filename, text, structured, ocr_meta, quality, raw_entities, boxes,
+                          model_version)
     Logger.info(f"Hasil ekstraksi: {structured}")
-    return {
-        "structured": structured,
-        "meta": {"source": "image", "ocr": ocr_meta}
+
+    body = {
+        "structured": options.select(structured),
+        "meta": {"source": "image", "model_version": model_version}
     }
+    if options.wants("ocr_meta"):
+        body["meta"]["ocr"] = ocr_meta
+    if options.wants("quality"):
+        body["meta"]["quality"] = quality
+    if options.wants("raw_entities"):
+        body["raw_entities"] = raw_entities
+    if options.wants("boxes"):
+        body["boxes"] = boxes
+    return FastJSONResponse(body)
 
-@app.post("/predict-images", response_model=BulkResponse)
-async def predict_images(files: List[UploadFile] = File(...), request: Request = None):
-    extractor_service: ExtractorService = getattr(request.app.state, "extractor_service", None)
-    if extractor_service is None:
-        raise HTTPException(503, "Model not loaded")
+@app.post("/predict-images", responses={200: {"model": BulkResponse}})
+async def predict_images(files: List[UploadFile] = File(...), request: Request = None,
+                         options: ResponseOptions = Depends()):
+    extractor_service = _extractor(request)
+    models: ModelRouter = request.app.state.models
+    remember = models.is_active(extractor_service)
     if not settings.ENABLE_OCR:
         raise HTTPException(400, "OCR disabled")
 
-    results: List[BulkResult] = []
-    for f in files:
-        try:
-            content = await f.read()
-            text, ocr_meta = ocr_image_to_text(content)
+    def decode(jobs):
+        for job in jobs:
+            f = job["file"]
+            _check_upload(f)
+            job["fingerprint"], cached, job["similar"] = _find_duplicate(f.file)
+            if cached is not None:
+                *result, model_version = _cached_result(cached)
+                job["result"] = options.bulk_result(f.filename, *result, model_version=model_version)
+                job["done"] = True
+            else:
+                job["image"] = decode_image(f.file)
+
+    def ocr(jobs):
+        # whatever decoded images are queued share one call, pooling their crops into recogniser batches
+        outputs = ocr_images_to_text([job.pop("image") for job in jobs], return_layout=True)
+        for job, (text, ocr_meta, layout) in zip(jobs, outputs):
             if not text.strip():
-                raise ValueError("OCR produced empty text")
-            structured = extractor_service.extract(text)
-            results.append(BulkResult(filename=f.filename, structured=structured, ocr_meta=ocr_meta))
-        except Exception as e:
-            results.append(BulkResult(filename=f.filename, error=str(e)))
+                job["error"] = "OCR produced empty text"
+            job.update(text=text, ocr_meta=ocr_meta, layout=layout)
+
+    def ner(jobs):
+        for job in jobs:
+            reused = _reuse_similar(job["similar"], job["text"], job["ocr_meta"])
+            if reused is not None:
+                job["structured"], job["ocr_meta"], job["quality"], job["raw_entities"], job["model_version"] = reused
+                continue
+            job["model_version"] = extractor_service.label
+            start = time.perf_counter()
+            try:
+                job["structured"], job["quality"], job["raw_entities"] = extractor_service.extract_ocr(
+                    job["layout"], deadline=guard.deadline, return_entities=True)
+            except Exception:
+                models.record(extractor_service, time.perf_counter() - start, None)
+                raise
+            models.record(extractor_service, time.perf_counter() - start, job["structured"], job["quality"])
+
+    def post(jobs):
+        for job in jobs:
+            filename, boxes = job["file"].filename, job.pop("layout").box_list()
+            if remember:
+                _remember(job["fingerprint"], filename, job["text"], job["structured"], job["ocr_meta"],
+                          job["quality"], job["raw_entities"], boxes, job["model_version"])
+            job["result"] = options.bulk_result(filename, job["structured"], job["ocr_meta"], job["quality"],
+                                                job["raw_entities"], boxes, model_version=job["model_version"])
+
+    def on_done(job):
+        results[job["index"]] = job.get("result") or options.bulk_result(job["file"].filename, error=job["error"])
+
+    # plain dicts rendered once by orjson instead of building and re-validating BulkResult models
+    results: List[Optional[dict]] = [None] * len(files)
+    timed_out = False
+    try:
+        async with RequestGuard(request) as guard:
+            pipeline = StagedPipeline([
+                Stage("decode", decode, settings.PIPELINE_DECODE_WORKERS),
+                Stage("ocr", ocr, settings.PIPELINE_OCR_WORKERS, batch_size=settings.OCR_BULK_IMAGES),
+                Stage("ner", ner, settings.PIPELINE_NER_WORKERS),
+                Stage("post", post),
+            ], runner=guard.run_now, queue_size=settings.PIPELINE_QUEUE_SIZE)
+            try:
+                # one slot for the request; its stages overlap inside it
+                async with guard.slot("predict-images"):
+                    await pipeline.run([{"index": i, "file": f} for i, f in enumerate(files)], on_done)
+            except DeadlineExceeded as e:
+                # return what finished; the rest is marked instead of failing the whole batch
+                Logger.warning(f"/predict-images: {e}")
+                deadline_stats["partial"] += 1
+                timed_out = True
+            Logger.info(f"/predict-images stages: {pipeline.utilisation()}")
+    finally:
+        for f in files:
+            await f.close()
+
+    results = [r or options.bulk_result(f.filename, error="Deadline exceeded", timed_out=True)
+               for r, f in zip(results, files)]
+    return FastJSONResponse({"results": results, "timed_out": timed_out, "model_version": extractor_service.label})
+
+
+def _admin(request: Request, x_admin_token: Optional[str] = Header(None)) -> ModelRouter:
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(403, "Admin endpoints are disabled, set ADMIN_TOKEN to enable them")
+    if x_admin_token != settings.ADMIN_TOKEN:
+        raise HTTPException(401, "Invalid admin token")
+    if settings.WORKERS > 1:
+        # a load, promote or traffic change would only reach the worker that got the request
+        raise HTTPException(409, f"Model routing is per worker process and {settings.WORKERS} workers are configured; "
+                                 f"run a single worker (WEB_CONCURRENCY=1) to hot-load or A/B test versions")
+    models = getattr(request.app.state, "models", None)
+    if models is None:
+        raise HTTPException(503, "Model not loaded")
+    return models
+
+@app.get("/admin/models")
+def model_status(models: ModelRouter = Depends(_admin)):
+    return models.status()
+
+@app.post("/admin/models", status_code=202)
+def load_model(payload: LoadModelRequest, models: ModelRouter = Depends(_admin)):
+    """Load and warm a model version in the background while the current one keeps serving;
+    it replaces the active version, or with candidate_percent gets that share of the traffic"""
+    try:
+        models.load(payload.model_path, payload.backend, payload.candidate_percent)
+    except RuntimeError as e:
+        raise HTTPException(409, str(e))
+    return models.status()
+
+@app.post("/admin/models/promote")
+def promote_candidate(models: ModelRouter = Depends(_admin)):
+    try:
+        models.promote()
+    except LookupError as e:
+        raise HTTPException(404, str(e))
+    return models.status()
+
+@app.put("/admin/models/candidate")
+def set_candidate_traffic(percent: float, models: ModelRouter = Depends(_admin)):
+    if not 0 <= percent <= 100:
+        raise HTTPException(400, "percent must be between 0 and 100")
+    try:
+        models.set_share(percent)
+    except LookupError as e:
+        raise HTTPException(404, str(e))
+    return models.status()
 
-    return BulkResponse(results=results)
\ No newline at end of file
+@app.delete("/admin/models/candidate")
+def drop_candidate(models: ModelRouter = Depends(_admin)):
+    if models.drop_candidate() is None:
+        raise HTTPException(404, "No candidate loaded")
+    return models.status()
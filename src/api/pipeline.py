@@ -0,0 +1,131 @@
+from collections import Counter, defaultdict
+from typing import Awaitable, Callable, Dict, List
+import asyncio
+import time
+
+from .deadline import DeadlineExceeded, RequestCancelled
+
+# cumulative per-stage totals across requests, for /health
+_stage_totals: Dict[str, Counter] = defaultdict(Counter)
+
+class Stage:
+    """One pipeline step: `fn(jobs)` updates a list of job dicts in place.
+
+    `workers` copies of the stage run concurrently; each takes up to `batch_size` jobs that are
+    already queued, so batching only happens when the stage is behind.
+    """
+
+    def __init__(self, name: str, fn: Callable[[List[Dict]], None], workers: int = 1, batch_size: int = 1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+
+class StagedPipeline:
+    """Jobs flow through the stages over bounded queues, so stage k works on job n+1 while
+    stage k+1 still has job n.
+
+    A job with "error" or "done" set skips the remaining stages. `runner(stage, fn, jobs)`
+    executes a stage call (typically RequestGuard.run_now); DeadlineExceeded and
+    RequestCancelled stop the whole pipeline, anything else fails only the jobs of that call.
+    run() returns only once every stage call it started has finished, so a caller's slot is
+    never released while stage threads are still busy.
+    """
+
+    def __init__(self, stages: List[Stage], runner: Callable[..., Awaitable], queue_size: int = 2):
+        self.stages = stages
+        self.runner = runner
+        self.queue_size = queue_size
+        self.busy = Counter()
+        self.jobs = Counter()
+        self.wall_s = 0.0
+        self._calls = set()
+
+    async def _work(self, stage: Stage, inbox: asyncio.Queue, outbox: asyncio.Queue):
+        while True:
+            batch = [await inbox.get()]
+            while len(batch) < stage.batch_size and not inbox.empty():
+                batch.append(inbox.get_nowait())
+            stop = next((item for item in batch if isinstance(item, BaseException)), None)
+            if stop is not None:
+                # a stop raised upstream travels down the queues to run()
+                await outbox.put(stop)
+                return
+            active = [job for job in batch if job.get("error") is None and not job.get("done")]
+            if active:
+                start = time.perf_counter()
+                # cancelling the worker must not abandon a call whose thread is already running
+                call = asyncio.ensure_future(self.runner(stage.name, stage.fn, active))
+                self._calls.add(call)
+                call.add_done_callback(self._calls.discard)
+                try:
+                    await asyncio.shield(call)
+                except (DeadlineExceeded, RequestCancelled) as e:
+                    await outbox.put(e)
+                    return
+                except Exception as e:
+                    for job in active:
+                        job["error"] = str(e)
+                finally:
+                    self.busy[stage.name] += time.perf_counter() - start
+                    self.jobs[stage.name] += len(active)
+            for job in batch:
+                await outbox.put(job)
+
+    async def run(self, jobs: List[Dict], on_done: Callable[[Dict], None]):
+        """Push all jobs through, calling on_done(job) as each one leaves the last stage"""
+        queues = [asyncio.Queue(max(self.queue_size, stage.batch_size)) for stage in self.stages]
+        # unbounded so a failing worker can always report; on_done drains it as jobs finish
+        finished = asyncio.Queue()
+
+        async def feed():
+            for job in jobs:
+                await queues[0].put(job)
+
+        tasks = [asyncio.create_task(feed())]
+        for k, stage in enumerate(self.stages):
+            outbox = queues[k + 1] if k + 1 < len(queues) else finished
+            tasks.extend(asyncio.create_task(self._work(stage, queues[k], outbox)) for _ in range(stage.workers))
+
+        start = time.perf_counter()
+        try:
+            for _ in range(len(jobs)):
+                job = await finished.get()
+                if isinstance(job, BaseException):
+                    raise job
+                on_done(job)
+        finally:
+            self.wall_s = time.perf_counter() - start
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self._calls:
+                await asyncio.gather(*self._calls, return_exceptions=True)
+            self._record()
+
+    def utilisation(self) -> Dict[str, Dict]:
+        """Share of each stage's worker time spent busy during the last run"""
+        report = {}
+        for stage in self.stages:
+            capacity = self.wall_s * stage.workers
+            report[stage.name] = {
+                "workers": stage.workers,
+                "jobs": self.jobs[stage.name],
+                "busy_s": round(self.busy[stage.name], 3),
+                "utilisation": round(self.busy[stage.name] / capacity, 3) if capacity else None,
+            }
+        return report
+
+    def _record(self):
+        for stage in self.stages:
+            totals = _stage_totals[stage.name]
+            totals["jobs"] += self.jobs[stage.name]
+            totals["busy_s"] += self.busy[stage.name]
+            totals["capacity_s"] += self.wall_s * stage.workers
+
+def pipeline_stats() -> Dict[str, Dict]:
+    return {
+        name: {"jobs": totals["jobs"], "busy_s": round(totals["busy_s"], 3),
+               "utilisation": round(totals["busy_s"] / totals["capacity_s"], 3) if totals["capacity_s"] else None}
+        for name, totals in _stage_totals.items()
+    }
@@ -0,0 +1,70 @@
+from fastapi import HTTPException, Query
+from fastapi.responses import JSONResponse
+from typing import Any, Dict, List, Optional
+
+from src.ocr.preprocessing_text import FIELDS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# optional blocks of a prediction; ocr_meta and quality are sent unless the client narrows `include`
+INCLUDE_OPTIONS = ("ocr_meta", "quality", "raw_entities", "boxes")
+DEFAULT_INCLUDE = ("ocr_meta", "quality")
+
+class FastJSONResponse(JSONResponse):
+    """Renders with orjson when it is installed (numpy values included), stdlib json otherwise"""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+def _parse_list(value: Optional[str], allowed, name: str) -> List[str]:
+    items = [item.strip() for item in (value or "").split(",") if item.strip()]
+    unknown = [item for item in items if item not in allowed]
+    if unknown:
+        raise HTTPException(400, f"Unknown {name}: {unknown}, allowed: {list(allowed)}")
+    return items
+
+class ResponseOptions:
+    """Query parameters choosing which structured fields and optional blocks a response carries"""
+
+    def __init__(
+        self,
+        fields: Optional[str] = Query(None, description=f"Comma-separated subset of {FIELDS}"),
+        include: Optional[str] = Query(None, description=f"Comma-separated subset of {list(INCLUDE_OPTIONS)}, "
+                                                          f"default {','.join(DEFAULT_INCLUDE)}"),
+    ):
+        self.fields = _parse_list(fields, FIELDS, "fields") or None
+        self.include = set(_parse_list(include, INCLUDE_OPTIONS, "include")) if include is not None else set(DEFAULT_INCLUDE)
+
+    def wants(self, block: str) -> bool:
+        return block in self.include
+
+    def select(self, structured: Dict) -> Dict:
+        if self.fields is None:
+            return structured
+        return {field: structured[field] for field in self.fields if field in structured}
+
+    def bulk_result(self, filename: str, structured: Optional[Dict] = None, ocr_meta: Optional[Dict] = None,
+                    quality: Optional[Dict] = None, raw_entities: Optional[List] = None, boxes: Optional[List] = None,
+                    error: Optional[str] = None, timed_out: bool = False, model_version: Optional[str] = None) -> Dict:
+        """A BulkResult as a plain dict, with only the requested blocks"""
+        result = {"filename": filename, "structured": self.select(structured or {})}
+        if model_version is not None:
+            result["model_version"] = model_version
+        if self.wants("ocr_meta") and ocr_meta is not None:
+            result["ocr_meta"] = ocr_meta
+        if self.wants("quality") and quality is not None:
+            result["quality"] = quality
+        if self.wants("raw_entities") and raw_entities is not None:
+            result["raw_entities"] = raw_entities
+        if self.wants("boxes") and boxes is not None:
+            result["boxes"] = boxes
+        if error is not None:
+            result["error"] = error
+        if timed_out:
+            result["timed_out"] = True
+        return result
@@ -5,10 +5,22 @@ class HealthResponse(BaseModel):
     status: str = "ok"
     model_loaded: bool = True
     ocr_enabled: bool = True
+    model_version: Optional[str] = None
+    model_backend: Optional[str] = None
+    cpu_plan: Optional[Dict[str, Any]] = None
+    extraction_stats: Optional[Dict[str, Any]] = None
+    request_stats: Optional[Dict[str, Any]] = None
+    models: Optional[Dict[str, Any]] = None
 
 class PredictTextRequest(BaseModel):
     text: str = Field(..., description="teks hasil OCR / input manual")
 
+class LoadModelRequest(BaseModel):
+    model_path: str = Field(..., description="model directory, serving bundle or hub id")
+    backend: str = "auto"
+    candidate_percent: Optional[float] = Field(None, ge=0, le=100, description="route this share of requests to the "
+                                                                            "new version instead of replacing the active one")
+
 class EntitySpan(BaseModel):
     entity_group: str
     word: str
@@ -17,9 +29,10 @@ class EntitySpan(BaseModel):
     score: float
 
 class PredictResponse(BaseModel):
-    raw_entities: List[EntitySpan]
+    raw_entities: Optional[List[EntitySpan]] = None
     structured: Dict[str, Any]
     meta: Dict[str, Any]
+    boxes: Optional[List[Dict[str, Any]]] = None
 
 class OCRResponse(BaseModel):
     text: str
@@ -28,8 +41,16 @@ class OCRResponse(BaseModel):
 class BulkResult(BaseModel):
     filename: str
     structured: Dict[str, Any] = {}
+    # version that produced `structured`; a reused duplicate keeps the one it was extracted with
+    model_version: Optional[str] = None
     ocr_meta: Optional[Dict[str, Any]] = None
+    quality: Optional[Dict[str, Any]] = None
+    raw_entities: Optional[List[EntitySpan]] = None
+    boxes: Optional[List[Dict[str, Any]]] = None
     error: Optional[str] = None
+    timed_out: bool = False
 
 class BulkResponse(BaseModel):
-    results: List[BulkResult]
\ No newline at end of file
+    results: List[BulkResult]
+    timed_out: bool = False
+    model_version: Optional[str] = None
\ No newline at end of file
@@ -0,0 +1,97 @@
+from src.ocr.preprocessing_text import FIELDS
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from itertools import chain, islice
+import json
+import csv
+import io
+import os
+import sys
+
+FORMATS = ("jsonl", "csv")
+MEDIA_TYPES = {"jsonl": "application/x-ndjson", "csv": "text/csv"}
+# same columns InvoiceDataAutoAnnotator reads from the OCR'd CSV exports
+CSV_TEXT_COLUMN = "OCRed Text"
+CSV_ID_COLUMN = "File Name"
+
+csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+
+def detect_format(filename: Optional[str], default: str = "jsonl") -> str:
+    ext = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if ext in ("jsonl", "ndjson", "json"):
+        return "jsonl"
+    return "csv" if ext == "csv" else default
+
+def iter_texts(fileobj: BinaryIO, fmt: str, text_field: Optional[str] = None) -> Iterator[Tuple]:
+    """Stream (id, text, error) records from a JSONL or CSV byte stream, one line/row at a time.
+
+    JSONL reads `text_field` (default "text"), falling back to the dataset's "tokens" list;
+    CSV reads `text_field` (default "OCRed Text") and takes ids from "File Name" or "id".
+    """
+    stream = io.TextIOWrapper(fileobj, encoding="utf-8", newline="")
+    try:
+        if fmt == "csv":
+            column = text_field or CSV_TEXT_COLUMN
+            for n, row in enumerate(csv.DictReader(stream)):
+                record_id = row.get(CSV_ID_COLUMN) or row.get("id") or n
+                if column not in row:
+                    yield record_id, None, f"Missing column {column!r}"
+                else:
+                    yield record_id, row[column] or "", None
+            return
+
+        for n, line in enumerate(stream):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield n, None, f"Invalid JSON on line {n + 1}: {e}"
+                continue
+            text = record.get(text_field or "text")
+            if text is None and "tokens" in record:
+                text = " ".join(record["tokens"])
+            yield record.get("id", n), text or "", None
+    finally:
+        # leave the underlying upload / file for its owner to close
+        stream.detach()
+
+def _chunks(iterable: Iterable, size: int) -> Iterator[List]:
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+def extract_records(extract_batch: Callable[[List[str]], List[Dict]], records: Iterable[Tuple],
+                    chunk_size: int = 64) -> Iterator[Dict]:
+    """Run batched extraction over streamed records, holding at most one chunk in memory"""
+    for chunk in _chunks(records, chunk_size):
+        todo = [i for i, (_, text, error) in enumerate(chunk) if error is None and text.strip()]
+        outputs, batch_error = {}, None
+        if todo:
+            try:
+                outputs = dict(zip(todo, extract_batch([chunk[i][1] for i in todo])))
+            except Exception as e:
+                batch_error = str(e)
+
+        for i, (record_id, text, error) in enumerate(chunk):
+            if error is None and i not in outputs:
+                error = batch_error or "Empty text"
+            yield {"id": record_id, "structured": outputs.get(i, {}), "error": error}
+
+def serialize(results: Iterable[Dict], fmt: str, fields: Optional[List[str]] = None) -> Iterator[str]:
+    """JSONL lines or CSV rows (header first, one column per field) for extraction results"""
+    fields = fields or FIELDS
+    if fmt == "jsonl":
+        for result in results:
+            structured = {f: result["structured"][f] for f in fields if f in result["structured"]}
+            yield json.dumps(dict(result, structured=structured), ensure_ascii=False) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    rows = ([result["id"], *(result["structured"].get(f, "") for f in fields), result["error"] or ""]
+            for result in results)
+    for row in chain([["id", *fields, "error"]], rows):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
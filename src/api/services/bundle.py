@@ -0,0 +1,57 @@
+from transformers import AutoModelForTokenClassification
+from src.utils.logger import default_logger as Logger
+from typing import Dict, Optional
+import json
+import os
+
+MANIFEST_NAME = "manifest.json"
+BACKENDS = ("pytorch", "pytorch_int8", "onnx")
+
+def read_manifest(model_path: str) -> Optional[Dict]:
+    """Manifest of a serving bundle produced by src/export_model.py, None for plain model dirs / hub ids"""
+    manifest_path = os.path.join(model_path, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+def resolve_backend(manifest: Optional[Dict], requested: str = "auto") -> str:
+    if manifest is None:
+        if requested not in ("auto", "pytorch"):
+            Logger.warning(f"MODEL_BACKEND={requested} needs a serving bundle, falling back to pytorch")
+        return "pytorch"
+    available = manifest.get("backends", {})
+    if requested == "auto":
+        return manifest.get("recommended_backend", "pytorch")
+    if requested not in available:
+        raise ValueError(f"Backend {requested!r} not in bundle, available: {sorted(available)}")
+    return requested
+
+def require_pytorch_weights(model_path: str, manifest: Optional[Dict]):
+    """Raise unless model_path has the full-precision weights that scoring and fine-tuning need;
+    plain model dirs and hub ids are left to from_pretrained"""
+    if manifest is None:
+        return
+    missing = [name for name in manifest.get("sha256", {}) if not os.path.isfile(os.path.join(model_path, name))]
+    if missing or not manifest.get("sha256"):
+        raise ValueError(f"Bundle {model_path} lacks the full-precision weights {missing or ['model.safetensors']} "
+                         f"that scoring and fine-tuning need; point at the bundle's source model instead")
+
+def load_token_classifier(model_path: str, backend: str = "pytorch", manifest: Optional[Dict] = None):
+    """Load the token-classification model for a backend variant without any conversion work"""
+    if backend == "onnx":
+        try:
+            from optimum.onnxruntime import ORTModelForTokenClassification
+        except ImportError as e:
+            raise ImportError("The onnx backend requires `optimum[onnxruntime]`") from e
+        onnx_dir = os.path.join(model_path, manifest["backends"]["onnx"]["path"])
+        return ORTModelForTokenClassification.from_pretrained(onnx_dir)
+
+    model = AutoModelForTokenClassification.from_pretrained(model_path)
+    if backend == "pytorch_int8":
+        import torch
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        weights = os.path.join(model_path, manifest["backends"]["pytorch_int8"]["path"])
+        model.load_state_dict(torch.load(weights, map_location="cpu", weights_only=True))
+    model.eval()
+    return model
@@ -0,0 +1,187 @@
+from ..config import settings
+from .ocr import ImageTooLargeError
+from collections import Counter, OrderedDict
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple, Union
+import numpy as np
+import hashlib
+import threading
+import io
+
+# thumbnail kept per entry to narrow down hash matches in DEDUP_NEAR mode; invoices sharing a
+# template hash alike and even their thumbnails can't tell one digit from another, so a
+# similar-looking upload is only a candidate until its OCR text matches too
+THUMB_SIZE = (96, 128)
+BLOCK = 8
+READ_CHUNK = 1024 * 1024
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+def content_digest(image: Union[bytes, BinaryIO]) -> bytes:
+    """blake2b of the upload bytes; file objects are read in chunks and rewound"""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return hashlib.blake2b(image, digest_size=16).digest()
+    digest = hashlib.blake2b(digest_size=16)
+    image.seek(0)
+    for chunk in iter(lambda: image.read(READ_CHUNK), b""):
+        digest.update(chunk)
+    image.seek(0)
+    return digest.digest()
+
+def perceptual_hash(image: Union[bytes, BinaryIO]) -> Tuple[int, np.ndarray]:
+    """64-bit difference hash plus a small greyscale thumbnail, from a downscaled decode.
+
+    JPEGs are decoded at reduced scale via PIL's draft mode. File objects are rewound afterwards.
+    """
+    from PIL import Image
+
+    fp = io.BytesIO(image) if isinstance(image, (bytes, bytearray, memoryview)) else image
+    fp.seek(0)
+    with Image.open(fp) as img:
+        width, height = img.size
+        if width * height > settings.MAX_IMAGE_PIXELS:
+            raise ImageTooLargeError(f"Image is {width}x{height} pixels, limit is {settings.MAX_IMAGE_PIXELS}")
+        img.draft("L", (THUMB_SIZE[0] * 2, THUMB_SIZE[1] * 2))
+        grey = img.convert("L").resize(THUMB_SIZE, Image.BILINEAR)
+    fp.seek(0)
+
+    small = np.asarray(grey.resize((9, 8), Image.BOX), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    thumb = np.asarray(grey, dtype=np.uint8)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big"), thumb
+
+def image_fingerprint(image: Union[bytes, BinaryIO], near: bool = False) -> Tuple[bytes, Optional[int], Optional[np.ndarray]]:
+    """(content digest, perceptual hash, thumbnail); the image is only decoded with near=True"""
+    digest = content_digest(image)
+    if not near:
+        return digest, None, None
+    return (digest, *perceptual_hash(image))
+
+def thumbs_match(a: np.ndarray, b: np.ndarray, tolerance: float) -> bool:
+    """True when no BLOCK x BLOCK region differs by more than `tolerance` grey levels on average.
+
+    Brightness is levelled first, so re-scans and re-compression pass. At thumbnail scale a
+    different invoice number or total from the same template passes as well.
+    """
+    diff = np.abs((a - a.mean(dtype=np.float32)) - (b - b.mean(dtype=np.float32)))
+    h, w = diff.shape
+    blocks = diff[:h - h % BLOCK, :w - w % BLOCK].reshape(h // BLOCK, BLOCK, w // BLOCK, BLOCK).mean(axis=(1, 3))
+    return float(blocks.max()) <= tolerance
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes under Hamming distance"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, key: int, value):
+        node = (key, value, {})
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(key, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, key: int, max_distance: int) -> Iterator[Tuple[int, object]]:
+        if self.root is None:
+            return
+        stack = [self.root]
+        while stack:
+            node_key, value, children = stack.pop()
+            distance = hamming(key, node_key)
+            if distance <= max_distance:
+                yield distance, value
+            stack.extend(child for d, child in children.items()
+                         if distance - max_distance <= d <= distance + max_distance)
+
+class DuplicateIndex:
+    """Recently processed uploads and their extraction results.
+
+    lookup() only trusts byte-identical uploads. lookup_similar() finds a perceptually close
+    upload (hash within max_distance and thumbnails alike); its result may only be reused once
+    the new upload's OCR text has been checked against the cached one. Holds at most `capacity`
+    entries (least recently matched evicted first). The BK-tree has no delete, so evicted ids
+    stay in it until it is rebuilt at twice the capacity.
+    """
+
+    def __init__(self, capacity: int = None, max_distance: int = None, tolerance: float = None):
+        self.capacity = capacity or settings.DEDUP_CAPACITY
+        self.max_distance = settings.DEDUP_MAX_DISTANCE if max_distance is None else max_distance
+        self.tolerance = settings.DEDUP_BLOCK_TOL if tolerance is None else tolerance
+        self.entries = OrderedDict()
+        self.by_digest: Dict[bytes, int] = {}
+        self.tree = BKTree()
+        self.stats = Counter()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, fingerprint: Tuple) -> Optional[Dict]:
+        """Cached result of a byte-identical earlier upload, or None"""
+        with self._lock:
+            entry_id = self.by_digest.get(fingerprint[0])
+            if entry_id is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(entry_id)
+            self.stats["hits"] += 1
+            return self.entries[entry_id][3]
+
+    def lookup_similar(self, fingerprint: Tuple) -> Optional[Tuple[int, Dict]]:
+        """(hash distance, cached result) of the closest similar-looking upload, or None"""
+        _, image_hash, thumb = fingerprint
+        if image_hash is None:
+            return None
+        with self._lock:
+            for distance, entry_id in sorted(self.tree.search(image_hash, self.max_distance), key=lambda x: x[0]):
+                entry = self.entries.get(entry_id)
+                if entry is None:
+                    continue
+                if thumbs_match(thumb, entry[2], self.tolerance):
+                    self.stats["near_candidates"] += 1
+                    return distance, entry[3]
+            return None
+
+    def confirm(self, similar: Tuple[int, Dict], text: str) -> Optional[Dict]:
+        """The cached result from lookup_similar() if its OCR text is identical to `text`, else None"""
+        cached = similar[1]
+        with self._lock:
+            if cached.get("text") != text:
+                self.stats["near_rejected"] += 1
+                return None
+            self.stats["near_hits"] += 1
+            return cached
+
+    def add(self, fingerprint: Tuple, result: Dict):
+        digest, image_hash, thumb = fingerprint
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self.entries[entry_id] = (digest, image_hash, thumb, result)
+            self.by_digest[digest] = entry_id
+            if image_hash is not None:
+                self.tree.add(image_hash, entry_id)
+            while len(self.entries) > self.capacity:
+                old_digest = self.entries.popitem(last=False)[1][0]
+                if self.by_digest.get(old_digest) not in self.entries:
+                    del self.by_digest[old_digest]
+            if self.tree.size > 2 * self.capacity:
+                self.tree = BKTree()
+                for entry_id, (_, image_hash, _, _) in self.entries.items():
+                    if image_hash is not None:
+                        self.tree.add(image_hash, entry_id)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.by_digest.clear()
+            self.tree = BKTree()
+
+duplicate_index = DuplicateIndex()
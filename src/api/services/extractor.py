@@ -1,28 +1,110 @@
-from transformers import AutoTokenizer, AutoModelForTokenClassification 
-from transformers import pipeline
+from transformers import AutoTokenizer
 from ..config import settings
-from typing import Dict
-from src.ocr.preprocessing_text import TextProcessingNER
+from .bundle import read_manifest, resolve_backend, load_token_classifier
+from .ocr import OCRLayout, refine_regions
+from typing import Dict, List, Tuple
+from src.ocr.preprocessing_text import TextProcessingNER, parse_tier_policy
+from src.ocr.profiles import ProfileStore
 from src.utils.logger import default_logger as Logger
 import os
 
 class ExtractorService:
-    def __init__(self):
-        Logger.info(f"Loading NER model from: {settings.MODEL_PATH}")
-        self.tokenizer = AutoTokenizer.from_pretrained(settings.MODEL_PATH)
-        self.model = AutoModelForTokenClassification.from_pretrained(settings.MODEL_PATH)
-        self.text_processor = TextProcessingNER(self.model, self.tokenizer)
-
-        self.pipe = pipeline(
-            "ner",
-            model=self.model,
-            tokenizer=self.tokenizer,
-            aggregation_strategy=settings.AGGREGATION_STRATEGY,
-            device_map="auto"
+    def __init__(self, model_path: str = None, backend: str = None):
+        self.model_path = model_path or settings.MODEL_PATH
+        Logger.info(f"Loading NER model from: {self.model_path}")
+        self.manifest = read_manifest(self.model_path)
+        self.backend = resolve_backend(self.manifest, backend or settings.MODEL_BACKEND)
+        self.model_version = self.manifest["version"] if self.manifest else None
+        # names this version in routing and per-version metrics
+        self.label = f"{self.manifest['name']}-{self.model_version}" if self.manifest else self.model_path
+        if self.manifest:
+            Logger.info(f"Serving bundle {self.label} with backend {self.backend}")
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+        self.model = load_token_classifier(self.model_path, self.backend, self.manifest)
+        self.text_processor = TextProcessingNER(self.model, self.tokenizer, sessions=settings.NER_SESSIONS)
+        self.tier_policy = parse_tier_policy(settings.TIER_POLICY)
+        self.profiles = ProfileStore(settings.PROFILE_STORE, settings.PROFILE_CACHE_SIZE) if settings.PROFILE_STORE else None
+
+    def extract(self, text:str, return_entities: bool = False, return_spans: bool = False):
+        """Structured fields, plus the raw NER spans with return_entities=True and the offsets of the
+        NER entities behind each field with return_spans=True (in that order)"""
+        profile = self.profiles.match(text) if self.profiles else None
+        if profile is not None:
+            return self._extract_profiled(text, profile, return_entities, return_spans)
+        if settings.EXTRACTION_MODE == "tiered":
+            return self.text_processor.extract_entities_tiered(
+                text, policy=self.tier_policy, header_chars=settings.NER_HEADER_CHARS,
+                summary_chars=settings.NER_SUMMARY_CHARS, return_entities=return_entities, return_spans=return_spans
+            )
+        if settings.EXTRACTION_MODE == "windowed":
+            return self.text_processor.extract_entities_windowed(
+                text, header_chars=settings.NER_HEADER_CHARS or 600, summary_chars=settings.NER_SUMMARY_CHARS,
+                return_entities=return_entities, return_spans=return_spans
+            )
+        return self.text_processor.extract_entities(text, return_entities=return_entities, return_spans=return_spans)
+
+    def _extract_profiled(self, text: str, profile, return_entities: bool = False, return_spans: bool = False):
+        return self.text_processor.extract_entities_tiered(
+            text, header_chars=settings.NER_HEADER_CHARS, summary_chars=settings.NER_SUMMARY_CHARS,
+            return_entities=return_entities, profile=profile, return_spans=return_spans
         )
-        
-    def extract(self, text:str) -> Dict:
-        return self.text_processor.extract_entities(text)
+
+    def extract_batch(self, texts: List[str], return_entities: bool = False) -> List:
+        """extract() for many texts; in full mode the texts without a profile share batched NER passes,
+        everything else goes text by text"""
+        if settings.EXTRACTION_MODE != "full":
+            return [self.extract(text, return_entities) for text in texts]
+        profiles = [self.profiles.match(text) for text in texts] if self.profiles else [None] * len(texts)
+        outputs = [None] * len(texts)
+        unmatched = [i for i, profile in enumerate(profiles) if profile is None]
+        batched = self.text_processor.extract_entities_batch(
+            [texts[i] for i in unmatched], batch_size=settings.NER_BATCH_SIZE, return_entities=return_entities)
+        for i, output in zip(unmatched, batched):
+            outputs[i] = output
+        for i, profile in enumerate(profiles):
+            if profile is not None:
+                outputs[i] = self._extract_profiled(texts[i], profile, return_entities)
+        return outputs
+
+    def field_confidence(self, layout: OCRLayout, structured: Dict, ner_spans: Dict = None) -> Dict[str, float]:
+        """Lowest OCR confidence among the boxes each extracted field was read from"""
+        spans = self.text_processor.field_spans(layout.text, structured, ner_spans)
+        conf = {field: layout.span_conf(*span) for field, span in spans.items()}
+        return {field: round(c, 3) for field, c in conf.items() if c is not None}
+
+    def extract_ocr(self, layout: OCRLayout, deadline=None, return_entities: bool = False) -> Tuple:
+        """Extract from OCR output, re-reading only the regions behind low-confidence fields.
+
+        Returns (structured, quality), plus the raw NER spans with return_entities=True.
+        The re-read is skipped once the request deadline has passed.
+        """
+        def run():
+            return self.extract(layout.text, return_entities=True, return_spans=True)
+
+        structured, entities, ner_spans = run()
+        field_conf = self.field_confidence(layout, structured, ner_spans)
+        low = [f for f, c in field_conf.items() if c < settings.OCR_LOW_CONF]
+        refined = 0
+
+        if low and settings.OCR_REFINE and layout.image is not None and not (deadline and deadline.expired):
+            spans = self.text_processor.field_spans(layout.text, {f: structured[f] for f in low}, ner_spans)
+            indices = sorted({int(i) for span in spans.values() for i in layout.boxes_in_span(*span)
+                              if layout.conf[i] < settings.OCR_LOW_CONF})
+            refined = refine_regions(layout, indices)
+            if refined:
+                structured, entities, ner_spans = run()
+                field_conf = self.field_confidence(layout, structured, ner_spans)
+                low = [f for f, c in field_conf.items() if c < settings.OCR_LOW_CONF]
+        layout.image = None
+
+        quality = {"field_conf": field_conf, "low_conf_fields": low, "refined_boxes": refined}
+        return (structured, quality, entities) if return_entities else (structured, quality)
+
+    def stats(self) -> Dict:
+        stats = {"mode": settings.EXTRACTION_MODE, **self.text_processor.tier_stats}
+        if self.profiles:
+            stats.update(self.profiles.stats)
+        return stats
     
 extractor_service: ExtractorService | None = None
 
@@ -0,0 +1,202 @@
+from collections import Counter, deque
+from typing import Dict, List, Optional
+import json
+import random
+import threading
+import time
+
+import numpy as np
+
+from ..config import settings
+from .dedup import duplicate_index
+from .extractor import ExtractorService
+from src.ocr.preprocessing_text import FIELDS
+from src.utils.logger import default_logger as Logger
+
+# used when MODEL_WARMUP_DATA is unset, so every code path has run once before real traffic
+SAMPLE_INVOICE = (
+    "Invoice no: 84652373 Date of issue: 02/23/2021 Seller: Client: Nguyen-Roach Clark-Foster "
+    "247 David Highway 77477 Cliff Apt. 853 Lake John, WV 84178 Tax Id: 991-72-5826 Tax Id: 913-84-3021 "
+    "IBAN: GB44YXZN60233414925478 ITEMS No. Description Qty UM Net price Net worth VAT [%] Gross worth "
+    "1. Wireless keyboard 2,00 each 45,00 90,00 10% 99,00 SUMMARY VAT [%] Net worth VAT Gross worth "
+    "10% 90,00 9,00 99,00 Total $ 90,00 $ 9,00 $ 99,00"
+)
+
+def load_warmup_texts(path: str = "", limit: int = 8) -> List[str]:
+    """Texts from a JSONL file ("text" or "tokens" per line), the built-in sample invoice without one"""
+    if not path:
+        return [SAMPLE_INVOICE]
+    texts = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            texts.append(row["text"] if "text" in row else " ".join(row["tokens"]))
+            if len(texts) >= limit:
+                break
+    return texts or [SAMPLE_INVOICE]
+
+class VersionStats:
+    """Latency and output-quality counters of one served model version"""
+
+    def __init__(self, window: int = 1000):
+        self.counts = Counter()
+        self.latency_ms = deque(maxlen=window)
+
+    def record(self, seconds: float, structured: Optional[Dict], quality: Optional[Dict] = None):
+        self.counts["docs"] += 1
+        self.latency_ms.append(seconds * 1000)
+        if structured is None:
+            self.counts["errors"] += 1
+            return
+        self.counts["fields_found"] += sum(1 for field in FIELDS if structured.get(field))
+        if quality is not None:
+            self.counts["ocr_docs"] += 1
+            self.counts["low_conf_fields"] += len(quality.get("low_conf_fields", []))
+
+    def summary(self) -> Dict:
+        docs, latency = self.counts["docs"], np.asarray(self.latency_ms)
+        ok = docs - self.counts["errors"]
+        return {
+            "docs": docs,
+            "errors": self.counts["errors"],
+            "latency_ms": {
+                "p50": round(float(np.percentile(latency, 50)), 2),
+                "p95": round(float(np.percentile(latency, 95)), 2),
+                "mean": round(float(latency.mean()), 2),
+            } if len(latency) else None,
+            # share of the structured fields that came back non-empty
+            "fill_rate": round(self.counts["fields_found"] / (ok * len(FIELDS)), 4) if ok else None,
+            "low_conf_fields_per_doc": (round(self.counts["low_conf_fields"] / self.counts["ocr_docs"], 4)
+                                        if self.counts["ocr_docs"] else None),
+        }
+
+class ModelRouter:
+    """Serves the active ExtractorService from `state.extractor_service` and, optionally, a
+    candidate that receives `candidate_share` of the requests.
+
+    load() builds and warms a new version in a background thread while the current one keeps
+    serving, then either swaps it in (one attribute assignment, so requests already holding the
+    old service finish on it) or installs it as the candidate. Everything, stats included, is per
+    worker process, which is why the admin endpoints only run with a single worker.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.candidate: Optional[ExtractorService] = None
+        self.candidate_share = 0.0
+        self.stats: Dict[str, VersionStats] = {}
+        self.load_status: Dict = {"state": "idle"}
+        self._lock = threading.Lock()
+        self._loader: Optional[threading.Thread] = None
+
+    @property
+    def active(self) -> Optional[ExtractorService]:
+        return getattr(self.state, "extractor_service", None)
+
+    def pick(self, version: Optional[str] = None) -> Optional[ExtractorService]:
+        """Service for one request: the one named by `version` if it is loaded, else by traffic share"""
+        active, candidate = self.active, self.candidate
+        if version and candidate is not None and version == candidate.label:
+            return candidate
+        if version and active is not None and version == active.label:
+            return active
+        if candidate is not None and random.random() < self.candidate_share:
+            return candidate
+        return active
+
+    def is_active(self, service: ExtractorService) -> bool:
+        return service is self.active
+
+    def record(self, service: ExtractorService, seconds: float, structured: Optional[Dict], quality: Optional[Dict] = None):
+        stats = self.stats.get(service.label)
+        if stats is None:
+            with self._lock:
+                stats = self.stats.setdefault(service.label, VersionStats())
+        stats.record(seconds, structured, quality)
+
+    @property
+    def loading(self) -> bool:
+        return self._loader is not None and self._loader.is_alive()
+
+    def load(self, model_path: str, backend: str = "auto", candidate_percent: Optional[float] = None):
+        """Start loading a version in the background; None swaps it in, a percentage makes it the candidate"""
+        with self._lock:
+            if self.loading:
+                raise RuntimeError(f"Already loading {self.load_status.get('model_path')}")
+            self.load_status = {"state": "loading", "model_path": model_path, "backend": backend,
+                                "candidate_percent": candidate_percent, "started_at": time.time()}
+            self._loader = threading.Thread(target=self._load, args=(model_path, backend, candidate_percent),
+                                            name="model-loader", daemon=True)
+            self._loader.start()
+
+    def _load(self, model_path: str, backend: str, candidate_percent: Optional[float]):
+        try:
+            start = time.perf_counter()
+            service = ExtractorService(model_path, backend)
+            load_s = time.perf_counter() - start
+            warmup = self.warm_up(service, load_warmup_texts(settings.MODEL_WARMUP_DATA, settings.MODEL_WARMUP_SAMPLES))
+        except Exception as e:
+            Logger.error(f"Loading {model_path} failed, still serving {getattr(self.active, 'label', None)}: {e}")
+            self.load_status.update(state="failed", error=str(e), finished_at=time.time())
+            return
+
+        if candidate_percent is None:
+            self.activate(service)
+        else:
+            self.candidate, self.candidate_share = service, candidate_percent / 100
+            Logger.info(f"Routing {candidate_percent}% of requests to candidate {service.label}")
+        self.load_status.update(state="ready", version=service.label, load_s=round(load_s, 2),
+                                warmup=warmup, finished_at=time.time())
+
+    def warm_up(self, service: ExtractorService, texts: List[str]) -> Dict:
+        """Run the single and batched paths once so first requests don't pay for lazy initialisation,
+        and report how often the new version agrees with the active one on the same texts"""
+        start = time.perf_counter()
+        outputs = [service.extract(text) for text in texts]
+        service.extract_batch(texts)
+        report = {"samples": len(texts), "ms_per_doc": round((time.perf_counter() - start) * 1000 / (2 * len(texts)), 2)}
+        active = self.active
+        if active is not None and active is not service:
+            reference = [active.extract(text) for text in texts]
+            same = sum(out.get(field) == ref.get(field) for out, ref in zip(outputs, reference) for field in FIELDS)
+            report["field_agreement"] = round(same / (len(texts) * len(FIELDS)), 4)
+        return report
+
+    def activate(self, service: ExtractorService):
+        previous = self.active
+        self.state.extractor_service = service
+        if self.candidate is service:
+            self.candidate, self.candidate_share = None, 0.0
+        # cached results of near-duplicate uploads came from the previous version
+        duplicate_index.clear()
+        Logger.info(f"Now serving {service.label} (was {getattr(previous, 'label', None)})")
+
+    def promote(self) -> ExtractorService:
+        candidate = self.candidate
+        if candidate is None:
+            raise LookupError("No candidate loaded")
+        self.activate(candidate)
+        return candidate
+
+    def set_share(self, percent: float):
+        if self.candidate is None:
+            raise LookupError("No candidate loaded")
+        self.candidate_share = percent / 100
+
+    def drop_candidate(self) -> Optional[ExtractorService]:
+        candidate, self.candidate, self.candidate_share = self.candidate, None, 0.0
+        if candidate is not None:
+            Logger.info(f"Dropped candidate {candidate.label}")
+        return candidate
+
+    def status(self) -> Dict:
+        active, candidate = self.active, self.candidate
+        return {
+            "active": getattr(active, "label", None),
+            "candidate": getattr(candidate, "label", None),
+            "candidate_percent": round(self.candidate_share * 100, 2) if candidate is not None else None,
+            "load": self.load_status,
+            "versions": {label: stats.summary() for label, stats in list(self.stats.items())},
+        }
@@ -1,8 +1,15 @@
 from ..config import settings
 from src.utils.logger import default_logger as Logger
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+import numpy as np
+import math
+import os
 
 _reader = None
 
+class ImageTooLargeError(ValueError):
+    """Upload exceeds MAX_UPLOAD_BYTES or MAX_IMAGE_PIXELS"""
+
 def _get_reader():
     global _reader
     if _reader is None:
@@ -11,29 +18,202 @@ def _get_reader():
         _reader = easyocr.Reader(langs)
     return _reader
 
-def ocr_image_to_text(image_bytes: bytes):
-    if not settings.ENABLE_OCR:
-        return "", {"enabled": False}
+def upload_size(fileobj: BinaryIO) -> int:
+    pos = fileobj.tell()
+    size = fileobj.seek(0, os.SEEK_END)
+    fileobj.seek(pos)
+    return size
+
+def check_upload_size(size: int):
+    if size > settings.MAX_UPLOAD_BYTES:
+        raise ImageTooLargeError(f"Upload is {size} bytes, limit is {settings.MAX_UPLOAD_BYTES}")
+
+def decode_image(image: Union[bytes, BinaryIO]):
+    """Decode to an RGB numpy array, checking the pixel budget from the header before decoding"""
     from PIL import Image
-    import io, numpy as np
+    import io
 
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    arr = np.array(img)
-    reader = _get_reader()
-    result = reader.readtext(arr, detail=1, paragraph=False)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        check_upload_size(len(image))
+        fp = io.BytesIO(image)
+    else:
+        check_upload_size(upload_size(image))
+        image.seek(0)
+        fp = image
+
+    with Image.open(fp) as img:
+        width, height = img.size
+        if width * height > settings.MAX_IMAGE_PIXELS:
+            raise ImageTooLargeError(f"Image is {width}x{height} pixels, limit is {settings.MAX_IMAGE_PIXELS}")
+        rgb = img if img.mode == "RGB" else img.convert("RGB")
+        # wraps the decoded pixel buffer instead of copying it again
+        arr = np.asarray(rgb)
+    del rgb
+    return arr
+
+class OCRLayout:
+    """Per-box OCR output aligned to the joined text: char offsets, confidences and boxes.
+
+    Keeps the greyscale page so low-confidence regions can be re-read without re-running the whole image.
+    """
 
-    texts, confs = [], []
+    def __init__(self, result, image=None):
+        self.boxes = [item[0] for item in result]
+        self.texts = [item[1] for item in result]
+        self.conf = np.asarray([item[2] for item in result], dtype=np.float32)
+        self.image = image
+        self._reindex()
+
+    def _reindex(self):
+        self.text = " ".join(self.texts)
+        lengths = np.fromiter((len(t) for t in self.texts), dtype=np.int64, count=len(self.texts))
+        ends = np.cumsum(lengths + 1) - 1
+        self.offsets = np.stack([ends - lengths, ends], axis=1)
+
+    def boxes_in_span(self, start: int, end: int):
+        return np.nonzero((self.offsets[:, 0] < end) & (self.offsets[:, 1] > start))[0]
+
+    def span_conf(self, start: int, end: int) -> Optional[float]:
+        idx = self.boxes_in_span(start, end)
+        return float(self.conf[idx].min()) if len(idx) else None
+
+    def compact(self) -> Dict:
+        """Flat [start, end, ...] offsets and rounded confidences, one entry per OCR box"""
+        return {"offsets": self.offsets.ravel().tolist(), "conf": [round(float(c), 3) for c in self.conf]}
+
+    def box_list(self) -> List[Dict]:
+        """Axis-aligned [x0, y0, x1, y1] box, text and confidence of each OCR box"""
+        boxes = []
+        for box, text, conf in zip(self.boxes, self.texts, self.conf):
+            if box is not None:
+                pts = np.asarray(box, dtype=np.float32)
+                box = [int(v) for v in (*pts.min(axis=0), *pts.max(axis=0))]
+            boxes.append({"box": box, "text": text, "conf": round(float(conf), 3)})
+        return boxes
+
+def _normalize(result):
+    items = []
     for item in result:
         if len(item) == 3:   
-            _, text, conf = item
+            items.append(tuple(item))
         elif len(item) == 2: 
-            text, conf = item
+            items.append((None, item[0], item[1]))
         else:                
-            text, conf = str(item), 1.0
-        texts.append(text)
-        confs.append(conf)
-    return " ".join(texts), {
-        "n_boxes": len(result),
-        "avg_conf": float(sum(confs) / len(confs)) if confs else None,
+            items.append((None, str(item), 1.0))
+    return items
+
+def _summarize(result, image=None, return_layout=False):
+    layout = OCRLayout(_normalize(result), image)
+    meta = {
+        "n_boxes": len(layout.texts),
+        "avg_conf": float(layout.conf.mean()) if len(layout.conf) else None,
         "enabled": True
     }
+    if settings.OCR_RETURN_TOKENS:
+        meta["tokens"] = layout.compact()
+    if return_layout:
+        return layout.text, meta, layout
+    return layout.text, meta
+
+def _grey(arr):
+    import cv2
+    return cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY)
+
+def ocr_image_to_text(image: Union[bytes, BinaryIO], return_layout: bool = False):
+    if not settings.ENABLE_OCR:
+        return ("", {"enabled": False}, None) if return_layout else ("", {"enabled": False})
+
+    arr = decode_image(image)
+    reader = _get_reader()
+    result = reader.readtext(arr, detail=1, paragraph=False)
+    grey = _grey(arr) if return_layout and settings.OCR_REFINE else None
+    del arr
+    return _summarize(result, grey, return_layout)
+
+def refine_regions(layout: OCRLayout, indices, scale: float = None) -> int:
+    """Re-read the given boxes from a padded crop at higher magnification, keeping better reads.
+
+    Detection is re-run inside the crop with mag_ratio=scale, so merged or clipped boxes get a
+    second chance. Returns how many boxes changed; the layout text is rebuilt in place.
+    """
+    if layout.image is None:
+        return 0
+    reader = _get_reader()
+    scale = scale or settings.OCR_REFINE_SCALE
+    height, width = layout.image.shape[:2]
+    changed = 0
+    for i in indices:
+        if layout.boxes[i] is None:
+            continue
+        pts = np.asarray(layout.boxes[i], dtype=np.float32)
+        (x0, y0), (x1, y1) = pts.min(axis=0), pts.max(axis=0)
+        pad = 0.25 * (y1 - y0)
+        x0, y0 = max(0, int(x0 - pad)), max(0, int(y0 - pad))
+        x1, y1 = min(width, int(math.ceil(x1 + pad))), min(height, int(math.ceil(y1 + pad)))
+        if x1 <= x0 or y1 <= y0:
+            continue
+        result = reader.readtext(layout.image[y0:y1, x0:x1], detail=1, paragraph=False, mag_ratio=scale)
+        if not result:
+            continue
+        result.sort(key=lambda item: min(p[0] for p in item[0]))
+        conf = float(np.mean([item[2] for item in result]))
+        if conf > layout.conf[i]:
+            layout.texts[i] = " ".join(item[1] for item in result)
+            layout.conf[i] = conf
+            changed += 1
+    if changed:
+        layout._reindex()
+    return changed
+
+def ocr_images_to_text(arrays: List, batch_size: int = None, return_layout: bool = False) -> List[Tuple]:
+    """OCR several decoded images: detection per image, recognition pooled across the whole batch.
+
+    Mirrors readtext(detail=1, paragraph=False) per image, but instead of one recogniser call per
+    box, crops from all images are grouped by padded width and recognised in batches of
+    OCR_BATCH_SIZE, so each forward pass is larger without padding any crop further.
+    """
+    if not settings.ENABLE_OCR:
+        return [("", {"enabled": False}, None) if return_layout else ("", {"enabled": False}) for _ in arrays]
+
+    import easyocr.easyocr as easyocr_module
+    from easyocr.utils import get_image_list, reformat_input
+    from easyocr.recognition import get_text
+
+    reader = _get_reader()
+    batch_size = batch_size or settings.OCR_BATCH_SIZE
+    img_h = easyocr_module.imgH
+    ignore_char = "".join(set(reader.character) - set(reader.lang_char))
+
+    # (image index, crop) in readtext's per-image order: horizontal boxes first, then free-form
+    crops, greys = [], []
+    for idx, arr in enumerate(arrays):
+        img, img_cv_grey = reformat_input(arr)
+        horizontal_list, free_list = reader.detect(img)
+        greys.append(img_cv_grey if return_layout and settings.OCR_REFINE else None)
+        for bbox in horizontal_list[0]:
+            image_list, _ = get_image_list([bbox], [], img_cv_grey, model_height=img_h)
+            crops.extend((idx, item) for item in image_list)
+        for bbox in free_list[0]:
+            image_list, _ = get_image_list([], [bbox], img_cv_grey, model_height=img_h)
+            crops.extend((idx, item) for item in image_list)
+
+    # group crops by the padded width readtext would use for them alone, so batching adds no padding
+    buckets = {}
+    for i, (_, (_, crop)) in enumerate(crops):
+        img_w = math.ceil(max(crop.shape[1] / img_h, 1)) * img_h
+        buckets.setdefault(img_w, []).append(i)
+
+    recognized = [None] * len(crops)
+    for img_w, members in sorted(buckets.items()):
+        for start in range(0, len(members), batch_size):
+            chunk = members[start:start + batch_size]
+            result = get_text(reader.character, img_h, img_w, reader.recognizer, reader.converter,
+                              [crops[i][1] for i in chunk], ignore_char, "greedy", 5, len(chunk),
+                              0.1, 0.5, 0.003, 0, reader.device)
+            for i, item in zip(chunk, result):
+                recognized[i] = item
+
+    per_image = [[] for _ in arrays]
+    for (idx, _), item in zip(crops, recognized):
+        per_image[idx].append(item)
+    return [_summarize(result, grey, return_layout) for result, grey in zip(per_image, greys)]
@@ -0,0 +1,72 @@
+import os
+import json
+import time
+import argparse
+import multiprocessing as mp
+
+def load_texts(data_path, limit):
+    texts = []
+    with open(data_path, encoding="utf-8") as f:
+        for line in f:
+            texts.append(" ".join(json.loads(line)["tokens"]))
+            if len(texts) >= limit:
+                break
+    return texts
+
+def worker(worker_index, workers, cpu_plan, model_path, texts, duration, barrier, results):
+    # configure before anything imports torch, exactly as a uvicorn worker would
+    os.environ["CPU_PLAN"] = cpu_plan
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    os.environ["WORKER_INDEX"] = str(worker_index)
+    os.environ["MODEL_PATH"] = model_path
+
+    from src.api.cpu import cpu_manager
+    cpu_manager.apply_env()
+    from src.api.services.extractor import ExtractorService
+    cpu_manager.apply_torch()
+
+    service = ExtractorService()
+    service.extract(texts[0])
+
+    barrier.wait()
+    done = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        service.extract(texts[done % len(texts)])
+        done += 1
+    results.put((worker_index, done, time.perf_counter() - start))
+
+def run_config(workers, cpu_plan, args, texts):
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=worker, args=(i, workers, cpu_plan, args.model_path, texts, args.duration, barrier, results))
+        for i in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    collected = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return sum(done / elapsed for _, done, elapsed in collected)
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of N API workers with and without the CPU plan")
+    parser.add_argument('--data_path', type=str, default='./data/invoice_ner_dataset_testing.jsonl')
+    parser.add_argument('--model_path', type=str, default=os.getenv("MODEL_PATH", 'mikhaelkrns/invoice-ner-v1'))
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--n_texts', type=int, default=64)
+    args = parser.parse_args()
+
+    texts = load_texts(args.data_path, args.n_texts)
+
+    print(f"{'workers':>8} {'plan=off docs/s':>16} {'plan=auto docs/s':>17}")
+    for workers in args.workers:
+        oversubscribed = run_config(workers, "off", args, texts)
+        planned = run_config(workers, "auto", args, texts)
+        print(f"{workers:>8} {oversubscribed:>16.2f} {planned:>17.2f}")
+
+if __name__ == "__main__":
+    main()
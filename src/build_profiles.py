@@ -0,0 +1,123 @@
+import os
+import re
+import argparse
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from src.data_processing.data_annotate import InvoiceDataAutoAnnotator
+from src.evaluate_extraction import gold_fields, normalize
+from src.ocr.preprocessing_text import FIELDS, TextProcessingNER
+from src.ocr.profiles import ProfileStore, supplier_key, template_key
+from src.utils.logger import default_logger as logger
+
+AMOUNT = r'\d[\d ]*[.,]\d\d'
+DATE = r'\d{1,2}[/.-]\d{1,2}[/.-]\d{4}'
+
+# rules tried per layout template; the most accurate one is kept when it clears --min_accuracy
+RULE_CANDIDATES = {
+    'INVOICE_NUMBER': [
+        {'pattern': r'Invoice\s+no:?\s*(\d+)'},
+        {'pattern': r'Invoice\s+number:?\s*(\d+)'},
+        {'pattern': r'#\s*(\d+)'},
+    ],
+    'INVOICE_DATE': [
+        {'pattern': rf'Date\s+of\s+issue:?\s*({DATE})'},
+        {'pattern': rf'Date:?\s*({DATE})'},
+    ],
+    # n-th amount after the last "Total" label (net, VAT, gross on the usual summary line)
+    'TOTAL': [
+        {'pattern': rf'\bTotal\s+(?:\$?\s*{AMOUNT}\s+){{{n}}}\$?\s*({AMOUNT})\b', 'last': True} for n in range(3)
+    ] + [{'pattern': rf'Gross\s+worth\s+\$?\s*({AMOUNT})\b', 'last': True}],
+}
+
+def rule_accuracy(rule, samples):
+    pattern = re.compile(rule['pattern'], re.IGNORECASE if rule.get('ignore_case', True) else 0)
+    hits = total = 0
+    for text, gold in samples:
+        if gold is None:
+            continue
+        total += 1
+        matches = list(pattern.finditer(text))
+        if matches:
+            value = (matches[-1] if rule.get('last') else matches[0]).group(1).strip()
+            hits += normalize(value) == normalize(gold)
+    return hits / total if total else 0.0
+
+def header_chars(samples, fields, coverage, margin):
+    """Window length covering `coverage` of the gold values of the fields left to NER"""
+    ends = []
+    for text, gold in samples:
+        spans = TextProcessingNER.field_spans(text, {f: gold[f] for f in fields if gold.get(f)})
+        if spans:
+            ends.append(max(end for _, end in spans.values()))
+    if not ends:
+        return 0
+    return int(np.percentile(ends, coverage * 100)) + margin
+
+def build_profile(key, samples, candidates, args):
+    rules, accuracy = {}, {}
+    for field, field_candidates in candidates.items():
+        field_samples = [(text, gold[field]) for text, gold in samples]
+        scored = [(rule_accuracy(rule, field_samples), rule) for rule in field_candidates]
+        best_accuracy, best = max(scored, key=lambda x: x[0])
+        accuracy[field] = round(best_accuracy, 4)
+        if best_accuracy >= args.min_accuracy:
+            rules[field] = best
+
+    ner_fields = [f for f in FIELDS if f not in rules and f != 'TOTAL']
+    return {
+        'key': key,
+        'samples': len(samples),
+        'rules': rules,
+        'rules_only': list(rules),
+        'header_chars': header_chars(samples, ner_fields, args.header_coverage, args.header_margin),
+        'accuracy': accuracy,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Build supplier / template extraction profiles from the annotated dataset")
+    parser.add_argument('--data_path', type=str, default='./data/invoice_ner_dataset.jsonl')
+    parser.add_argument('--output', type=str, default='./models/profiles.jsonl')
+    parser.add_argument('--fingerprint_chars', type=int, default=400, help='Header prefix the store keys are computed from')
+    parser.add_argument('--min_samples', type=int, default=3)
+    parser.add_argument('--min_accuracy', type=float, default=0.95, help='Rule accuracy needed to skip NER for a field')
+    parser.add_argument('--header_coverage', type=float, default=0.99)
+    parser.add_argument('--header_margin', type=int, default=40)
+    args = parser.parse_args()
+
+    templates, suppliers = defaultdict(list), defaultdict(list)
+    for sample in InvoiceDataAutoAnnotator.iter_dataset(args.data_path):
+        text = " ".join(sample["tokens"])
+        gold = gold_fields(sample)
+        templates[template_key(text, args.fingerprint_chars)].append((text, gold))
+        suppliers[supplier_key(text, args.fingerprint_chars)].append((text, gold))
+
+    specs = []
+    for key, samples in templates.items():
+        if key and len(samples) >= args.min_samples:
+            specs.append(build_profile(f'template:{key}', samples, RULE_CANDIDATES, args))
+
+    for key, samples in suppliers.items():
+        if not key or len(samples) < args.min_samples:
+            continue
+        # a supplier always prints the same seller name, so it becomes a literal rule on top of the template
+        names = Counter(gold['SELLER_NAME'] for _, gold in samples if gold['SELLER_NAME'])
+        if not names:
+            continue
+        name = names.most_common(1)[0][0]
+        candidates = {'SELLER_NAME': [{'pattern': f'({re.escape(name)})', 'ignore_case': False}]}
+        spec = build_profile(f'supplier:{key}', samples, candidates, args)
+        spec['name'] = name
+        if spec['rules']:
+            specs.append(spec)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    ProfileStore.write(specs, args.output, args.fingerprint_chars)
+    for spec in specs:
+        logger.info(f"{spec['key']} ({spec['samples']} samples): rules_only={spec['rules_only']}, "
+                    f"header_chars={spec['header_chars']}, accuracy={spec['accuracy']}")
+    logger.info(f"Wrote {len(specs)} profiles to {args.output}")
+
+if __name__ == "__main__":
+    main()
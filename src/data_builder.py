@@ -1,8 +1,32 @@
 from src.data_processing.data_annotate import InvoiceDataAutoAnnotator
+from src.data_processing.jsonl_dataset import JsonlDataset
 from src.utils.logger import default_logger as logger
+import argparse
 import glob
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output_file', type=str, default='data/invoice_ner_dataset.jsonl')
+    parser.add_argument('--streaming', action='store_true', help='Annotate in chunks across a process pool and resume via manifest')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=1000)
+    parser.add_argument('--manifest', type=str, default=None)
+    parser.add_argument('--match_mode', type=str, default='index', choices=InvoiceDataAutoAnnotator.MATCH_MODES)
+    parser.add_argument('--verify_index', type=str, default=None, metavar='DATASET',
+                        help='Check index and scan match modes label DATASET identically, then exit')
+    args = parser.parse_args()
+
+    if args.verify_index:
+        result = InvoiceDataAutoAnnotator().verify_match_modes(args.verify_index)
+        if result["mismatches"]:
+            logger.error(f"Match modes disagree on samples: {result['mismatches'][:20]}")
+            raise SystemExit(1)
+        if result["gold_mismatches"]["index"]:
+            logger.warning(f"{len(result['gold_mismatches']['index'])} samples differ from their stored labels in both "
+                           f"modes ({result['label_mismatches']}), the rebuilt records miss values that never matched")
+        logger.info("Index and scan match modes produce identical labels.")
+        raise SystemExit(0)
+
     csv_files = []
 
     logger.info("Collecting CSV files from data/batch_1/")
@@ -16,14 +40,27 @@ if __name__ == "__main__":
         logger.info(f"Found CSV file: {file}")
 
     logger.info("Initializing InvoiceDataAutoAnnotator...")
-    annotator = InvoiceDataAutoAnnotator()
+    annotator = InvoiceDataAutoAnnotator(match_mode=args.match_mode)
+
+    if args.streaming:
+        summary = annotator.process_csv_files_streaming(
+            sorted(csv_files),
+            output_file=args.output_file,
+            manifest_file=args.manifest,
+            chunksize=args.chunksize,
+            n_workers=args.workers
+        )
+        logger.info(f"Streaming annotation summary: {summary}")
 
-    dataset = annotator.process_csv_files(csv_files)
+        with JsonlDataset(args.output_file) as dataset:
+            annotator.analyze_dataset(dataset)
+    else:
+        dataset = annotator.process_csv_files(csv_files)
 
-    logger.info(f"Processed dataset: {dataset}")
+        logger.info(f"Processed dataset: {dataset}")
 
-    annotator.save_dataset(output_file="data/invoice_ner_dataset.jsonl")
+        annotator.save_dataset(output_file=args.output_file)
 
-    annotator.analyze_dataset()
+        annotator.analyze_dataset()
 
-    logger.info("Data annotation and saving completed.")
\ No newline at end of file
+    logger.info("Data annotation and saving completed.")
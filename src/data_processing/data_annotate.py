@@ -1,12 +1,40 @@
 import pandas as pd
 import json
 import re
-from typing import List, Dict, Optional
-from collections import Counter
+import os
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Iterable
+from collections import Counter, defaultdict
+
+_worker_annotator = None
+
+def _init_worker(case_sensitive: bool, match_mode: str):
+    global _worker_annotator
+    _worker_annotator = InvoiceDataAutoAnnotator(case_sensitive=case_sensitive, match_mode=match_mode)
+
+def _annotate_row(row):
+    """Process-pool entry point: returns (annotation or None, error message or None)"""
+    ocr_text, json_raw, file_name = row
+    try:
+        json_data = json.loads(json_raw) if isinstance(json_raw, str) else json_raw
+        annotation = _worker_annotator.annotate_invoice(ocr_text, json_data)
+        if not _worker_annotator.validate_annotation(annotation):
+            return None, f"Invalid annotation in {file_name}"
+        annotation["file_name"] = file_name
+        return annotation, None
+    except Exception as e:
+        return None, f"Error at {file_name}: {e}"
 
 class InvoiceDataAutoAnnotator:
-    def __init__(self, case_sensitive: bool = False):
+    MATCH_MODES = ("index", "scan")
+
+    def __init__(self, case_sensitive: bool = False, match_mode: str = "index"):
+        if match_mode not in self.MATCH_MODES:
+            raise ValueError(f"match_mode must be one of {self.MATCH_MODES}, got {match_mode!r}")
         self.case_sensitive = case_sensitive
+        self.match_mode = match_mode
         self.dataset = []
         self.error_count = 0
         self.id_counter = 0
@@ -51,6 +79,32 @@ class InvoiceDataAutoAnnotator:
                     positions.append(i)
         return positions
     
+    def find_all_entities(self, tokens: List[str], entity_values: Dict[str, str]) -> Dict[str, List[int]]:
+        """Resolve every entity's candidate positions in a single pass over the tokens.
+
+        Returns the same positions, in the same order, as calling find_entity_in_tokens per entity.
+        """
+        keys = tokens if self.case_sensitive else [token.lower() for token in tokens]
+        patterns = defaultdict(list)
+        hits = {}
+        for label, entity_value in entity_values.items():
+            if not entity_value:
+                hits[label] = []
+                continue
+            formats = self.normalize_number_format(entity_value)
+            hits[label] = [[] for _ in formats]
+            for k, value in enumerate(formats):
+                value_keys = value.split() if self.case_sensitive else value.lower().split()
+                if value_keys:
+                    patterns[value_keys[0]].append((label, k, value_keys))
+
+        for i, key in enumerate(keys):
+            for label, k, value_keys in patterns.get(key, ()):
+                if keys[i:i + len(value_keys)] == value_keys:
+                    hits[label][k].append(i)
+
+        return {label: [pos for format_hits in per_format for pos in format_hits] for label, per_format in hits.items()}
+
     @staticmethod
     def calculate_net_worth(total_str: str, vat_str: str) -> str:
         try:
@@ -115,11 +169,15 @@ class InvoiceDataAutoAnnotator:
             entities[f"QUANTITY_{idx}"] = item.get("quantity")
             entities[f"PRICE_{idx}"] = item.get("total_price")
 
+        clean_values = {label: re.sub(r'\s+', ' ', str(value).strip()) for label, value in entities.items() if value}
+        if self.match_mode == "index":
+            all_positions = self.find_all_entities(tokens, clean_values)
+        else:
+            all_positions = {label: self.find_entity_in_tokens(tokens, value) for label, value in clean_values.items()}
+
         annotated_positions = set()
-        for label, value in entities.items():
-            if not value: continue
-            clean_value = re.sub(r'\s+', ' ', str(value).strip())
-            positions = self.find_entity_in_tokens(tokens, clean_value)
+        for label, clean_value in clean_values.items():
+            positions = all_positions[label]
             for pos in positions:
                 value_tokens = clean_value.split()
                 if any(pos + j in annotated_positions for j in range(len(value_tokens))):
@@ -172,27 +230,352 @@ class InvoiceDataAutoAnnotator:
         print(f"Processing complete! Total samples: {len(self.dataset)}, Errors: {self.error_count}")
         return self.dataset
 
+    @staticmethod
+    def file_fingerprint(file: str) -> str:
+        h = hashlib.sha1()
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    @staticmethod
+    def _load_manifest(manifest_file: str) -> Dict:
+        if os.path.exists(manifest_file):
+            with open(manifest_file, encoding="utf-8") as f:
+                return json.load(f)
+        return {"files": {}, "next_id": 0, "output_size": 0}
+
+    @staticmethod
+    def _save_manifest(manifest: Dict, manifest_file: str):
+        tmp_file = manifest_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_file, manifest_file)
+
+    def process_csv_files_streaming(self, csv_files: List[str], output_file: str,
+                                    manifest_file: Optional[str] = None, chunksize: int = 1000,
+                                    n_workers: Optional[int] = None) -> Dict:
+        """Annotate CSVs chunk by chunk across a process pool, appending to output_file.
+
+        Files already recorded in the manifest with the same content hash are skipped,
+        and output left behind by an interrupted run is truncated before resuming. A file whose
+        hash changed is annotated again and the samples of its previous version are dropped.
+        """
+        manifest_file = manifest_file or output_file + ".manifest.json"
+        manifest = self._load_manifest(manifest_file)
+        manifest.setdefault("superseded", [])
+        if os.path.exists(output_file) and os.path.getsize(output_file) > manifest["output_size"]:
+            with open(output_file, "r+b") as f:
+                f.truncate(manifest["output_size"])
+        self.id_counter = manifest["next_id"]
+        n_samples = 0
+
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(self.case_sensitive, self.match_mode)) as executor, \
+                open(output_file, "a", encoding="utf-8") as out:
+            for file in csv_files:
+                try:
+                    fingerprint = self.file_fingerprint(file)
+                except OSError as e:
+                    print(f"Error reading file {file}: {e}")
+                    self.error_count += 1
+                    continue
+                if manifest["files"].get(file, {}).get("sha1") == fingerprint:
+                    print(f"Skipping {file}, already annotated")
+                    continue
+
+                print(f"Processing {file}...")
+                file_samples, first_id = 0, self.id_counter
+                try:
+                    for chunk in pd.read_csv(file, chunksize=chunksize):
+                        names = chunk["File Name"] if "File Name" in chunk else [f"{file}_{idx}" for idx in chunk.index]
+                        rows = zip(chunk["OCRed Text"], chunk["Json Data"], names)
+                        for annotation, error in executor.map(_annotate_row, rows, chunksize=32):
+                            if error:
+                                print(error)
+                                self.error_count += 1
+                                continue
+                            annotation = {"tokens": annotation["tokens"], "ner_tags": annotation["ner_tags"],
+                                          "id": self.id_counter, "file_name": annotation["file_name"]}
+                            out.write(json.dumps(annotation, ensure_ascii=False) + "\n")
+                            self.id_counter += 1
+                            file_samples += 1
+                except Exception as e:
+                    print(f"Error reading file {file}: {e}")
+                    self.error_count += 1
+                    out.flush()
+                    out.truncate(manifest["output_size"])
+                    out.seek(manifest["output_size"])
+                    self.id_counter = manifest["next_id"]
+                    continue
+
+                out.flush()
+                previous = manifest["files"].get(file)
+                if previous is not None:
+                    if "ids" in previous:
+                        manifest["superseded"].append(previous["ids"])
+                    else:
+                        print(f"Warning: earlier samples of {file} predate id tracking and are kept")
+                manifest["files"][file] = {"sha1": fingerprint, "samples": file_samples, "ids": [first_id, self.id_counter]}
+                manifest["next_id"] = self.id_counter
+                manifest["output_size"] = out.tell()
+                self._save_manifest(manifest, manifest_file)
+                n_samples += file_samples
+
+        n_superseded = 0
+        if manifest["superseded"]:
+            superseded = {i for start, end in manifest["superseded"] for i in range(start, end)}
+            n_superseded = len(superseded)
+            manifest["output_size"] = self._drop_rows(output_file, superseded)
+            manifest["superseded"] = []
+            self._save_manifest(manifest, manifest_file)
+
+        total = sum(entry["samples"] for entry in manifest["files"].values())
+        print(f"Processing complete! New samples: {n_samples}, Replaced: {n_superseded}, Errors: {self.error_count}")
+        return {"new_samples": n_samples, "superseded": n_superseded, "errors": self.error_count, "total_samples": total}
+
+    @staticmethod
+    def row_fingerprint(ocr_text, json_raw) -> str:
+        json_text = json_raw if isinstance(json_raw, str) else json.dumps(json_raw, sort_keys=True)
+        return hashlib.sha1(f"{ocr_text}\0{json_text}".encode("utf-8")).hexdigest()
+
+    def _load_row_manifest(self, manifest_file: str, output_file: str) -> Dict:
+        if os.path.exists(manifest_file):
+            with open(manifest_file, encoding="utf-8") as f:
+                return json.load(f)
+        # adopt an existing dataset: its rows are taken as up to date the first time their source is seen
+        rows, next_id = {}, 0
+        if os.path.exists(output_file):
+            for sample in self.iter_dataset(output_file):
+                rows[sample["file_name"]] = {"sha1": None, "id": sample["id"],
+                                             "split_id": sample.get("split_id", sample["id"])}
+                next_id = max(next_id, sample["id"] + 1)
+        size = os.path.getsize(output_file) if os.path.exists(output_file) else 0
+        return {"files": {}, "rows": rows, "next_id": next_id, "output_size": size, "superseded": []}
+
+    @staticmethod
+    def _drop_rows(output_file: str, ids) -> int:
+        """Rewrite output_file without the samples whose id is in ids, streaming"""
+        ids = set(ids)
+        tmp_file = output_file + ".tmp"
+        with open(output_file, encoding="utf-8") as src, open(tmp_file, "w", encoding="utf-8") as dst:
+            for line in src:
+                if line.strip() and json.loads(line)["id"] not in ids:
+                    dst.write(line)
+        os.replace(tmp_file, output_file)
+        return os.path.getsize(output_file)
+
+    def process_csv_files_incremental(self, csv_files: List[str], output_file: str,
+                                      manifest_file: Optional[str] = None, chunksize: int = 1000,
+                                      n_workers: Optional[int] = None) -> Dict:
+        """Annotate only the CSV rows that are new or whose OCR text / Json Data changed.
+
+        Rows are keyed by "File Name" and tracked by content hash in the manifest. A changed row
+        replaces its old sample under a new id and carries the row's first id as "split_id";
+        id-based splits hash that, so an edited row stays in its split. Files whose hash did
+        not change are not read at all.
+        """
+        manifest_file = manifest_file or output_file + ".rows.json"
+        manifest = self._load_row_manifest(manifest_file, output_file)
+        if os.path.exists(output_file) and os.path.getsize(output_file) > manifest["output_size"]:
+            with open(output_file, "r+b") as f:
+                f.truncate(manifest["output_size"])
+        self.id_counter = manifest["next_id"]
+        summary = Counter()
+        new_ids, changed_ids = [], []
+
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(self.case_sensitive, self.match_mode)) as executor, \
+                open(output_file, "a", encoding="utf-8") as out:
+            for file in csv_files:
+                try:
+                    fingerprint = self.file_fingerprint(file)
+                except OSError as e:
+                    print(f"Error reading file {file}: {e}")
+                    self.error_count += 1
+                    continue
+                if manifest["files"].get(file) == fingerprint:
+                    continue
+
+                print(f"Processing {file}...")
+                try:
+                    for chunk in pd.read_csv(file, chunksize=chunksize):
+                        names = chunk["File Name"] if "File Name" in chunk else [f"{file}_{idx}" for idx in chunk.index]
+                        todo = []
+                        for ocr_text, json_raw, name in zip(chunk["OCRed Text"], chunk["Json Data"], names):
+                            row_hash = self.row_fingerprint(ocr_text, json_raw)
+                            known = manifest["rows"].get(name)
+                            if known is not None and known["sha1"] is None:
+                                known["sha1"] = row_hash
+                                summary["adopted"] += 1
+                            elif known is not None and known["sha1"] == row_hash:
+                                summary["unchanged"] += 1
+                            else:
+                                todo.append(((ocr_text, json_raw, name), row_hash))
+
+                        rows = [row for row, _ in todo]
+                        for (annotation, error), (_, row_hash) in zip(executor.map(_annotate_row, rows, chunksize=32), todo):
+                            if error:
+                                print(error)
+                                self.error_count += 1
+                                continue
+                            name = annotation["file_name"]
+                            known = manifest["rows"].get(name)
+                            sample = {"tokens": annotation["tokens"], "ner_tags": annotation["ner_tags"],
+                                      "id": self.id_counter}
+                            if known is not None:
+                                manifest["superseded"].append(known["id"])
+                                changed_ids.append(self.id_counter)
+                                sample["split_id"] = known.get("split_id", known["id"])
+                            else:
+                                new_ids.append(self.id_counter)
+                            sample["file_name"] = name
+                            out.write(json.dumps(sample, ensure_ascii=False) + "\n")
+                            manifest["rows"][name] = {"sha1": row_hash, "id": self.id_counter,
+                                                      "split_id": sample.get("split_id", self.id_counter)}
+                            self.id_counter += 1
+                except Exception as e:
+                    # keep what was written; rows not yet in the manifest are redone on the next run
+                    print(f"Error reading file {file}: {e}")
+                    self.error_count += 1
+                else:
+                    manifest["files"][file] = fingerprint
+
+                out.flush()
+                manifest["next_id"] = self.id_counter
+                manifest["output_size"] = out.tell()
+                self._save_manifest(manifest, manifest_file)
+
+        if manifest["superseded"]:
+            summary["superseded"] = len(manifest["superseded"])
+            manifest["output_size"] = self._drop_rows(output_file, manifest["superseded"])
+            manifest["superseded"] = []
+            self._save_manifest(manifest, manifest_file)
+
+        print(f"Incremental annotation: {len(new_ids)} new, {len(changed_ids)} changed, "
+              f"{summary['unchanged']} unchanged, {summary['adopted']} adopted, errors: {self.error_count}")
+        return {"new_ids": new_ids, "changed_ids": changed_ids, "unchanged": summary["unchanged"],
+                "adopted": summary["adopted"], "superseded": summary["superseded"], "errors": self.error_count,
+                "total_samples": len(manifest["rows"])}
+
+    @staticmethod
+    def iter_dataset(dataset_file: str) -> Iterable[Dict]:
+        with open(dataset_file, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    @staticmethod
+    def json_data_from_tags(tokens: List[str], ner_tags: List[str]) -> Dict:
+        """Rebuild a source-style Json Data record from an annotated sample's gold spans.
+
+        Every label annotate_invoice reads from Json Data gets its key back; NET_WORTH has none
+        and is derived again from TOTAL and VAT (or the OCR summary) as during annotation.
+        """
+        spans = defaultdict(list)
+        current = None
+        for token, tag in zip(tokens, ner_tags):
+            if tag.startswith("B-"):
+                current = tag[2:]
+                spans[current].append([token])
+            elif tag.startswith("I-") and current == tag[2:]:
+                spans[current][-1].append(token)
+            else:
+                current = None
+
+        def first(label):
+            return " ".join(spans[label][0]) if spans.get(label) else None
+
+        def nth(label, idx):
+            return " ".join(spans[label][idx]) if idx < len(spans.get(label, [])) else None
+
+        n_items = max(len(spans.get(label, [])) for label in ("ITEM_DESC", "QUANTITY", "PRICE"))
+        return {
+            "invoice": {
+                "invoice_number": first("INVOICE_NUMBER"),
+                "invoice_date": first("INVOICE_DATE"),
+                "client_name": first("CLIENT_NAME"),
+                "seller_name": first("SELLER_NAME"),
+                "client_address": first("CLIENT_ADDRESS"),
+                "seller_address": first("SELLER_ADDRESS"),
+                "tax_id": first("TAX_ID"),
+            },
+            "subtotal": {"tax": first("VAT"), "total": first("TOTAL")},
+            "items": [
+                {"description": nth("ITEM_DESC", i), "quantity": nth("QUANTITY", i), "total_price": nth("PRICE", i)}
+                for i in range(n_items)
+            ],
+        }
+
+    def verify_match_modes(self, dataset_file: str, limit: Optional[int] = None) -> Dict:
+        """Re-annotate an existing dataset from its gold spans with both match modes.
+
+        Both modes are compared with the stored ner_tags: `gold_mismatches` lists the samples each
+        mode labels differently and `label_mismatches` the entity types involved. Differences both
+        modes share come from the rebuilt record, e.g. a source value that never matched the text
+        is missing from it. `mismatches` lists the samples where the modes disagree with each other.
+        """
+        scan = InvoiceDataAutoAnnotator(self.case_sensitive, match_mode="scan")
+        index = InvoiceDataAutoAnnotator(self.case_sensitive, match_mode="index")
+        samples, mismatches = 0, []
+        gold_mismatches = {"scan": [], "index": []}
+        label_mismatches = Counter()
+        timings = {"scan": 0.0, "index": 0.0}
+        for sample in self.iter_dataset(dataset_file):
+            if limit is not None and samples >= limit:
+                break
+            ocr_text = " ".join(sample["tokens"])
+            json_data = self.json_data_from_tags(sample["tokens"], sample["ner_tags"])
+
+            t0 = time.perf_counter()
+            scan_tags = scan.annotate_invoice(ocr_text, json_data)["ner_tags"]
+            t1 = time.perf_counter()
+            index_tags = index.annotate_invoice(ocr_text, json_data)["ner_tags"]
+            t2 = time.perf_counter()
+            timings["scan"] += t1 - t0
+            timings["index"] += t2 - t1
+
+            sample_id = sample.get("id", samples)
+            gold = sample["ner_tags"]
+            for mode, tags in (("scan", scan_tags), ("index", index_tags)):
+                if tags != gold:
+                    gold_mismatches[mode].append(sample_id)
+            if scan_tags != index_tags:
+                mismatches.append(sample_id)
+            differing = set()
+            for tags in (scan_tags, index_tags):
+                for tag, gold_tag in zip(tags, gold):
+                    if tag != gold_tag:
+                        differing.update(t[2:] for t in (tag, gold_tag) if t != "O")
+            label_mismatches.update(differing)
+            samples += 1
+
+        print(f"Verified {samples} samples from {dataset_file} against their stored labels: "
+              f"scan {len(gold_mismatches['scan'])}, index {len(gold_mismatches['index'])} mismatches, "
+              f"{len(mismatches)} where the modes disagree")
+        if label_mismatches:
+            print(f"Mismatched entity types: {dict(label_mismatches)}")
+        print(f"scan: {timings['scan']:.3f}s, index: {timings['index']:.3f}s")
+        return {"samples": samples, "mismatches": mismatches, "gold_mismatches": gold_mismatches,
+                "label_mismatches": dict(label_mismatches), "timings": timings}
+
     def save_dataset(self, output_file: str = "invoice_ner_dataset_testing.jsonl"):
         with open(output_file, "w", encoding="utf-8") as f:
             for sample in self.dataset:
                 f.write(json.dumps(sample, ensure_ascii=False) + "\n")
         print(f"Dataset saved to {output_file}")
 
-    def analyze_dataset(self):
-        total_tokens = sum(len(sample["tokens"]) for sample in self.dataset)
-        all_tags = [tag for sample in self.dataset for tag in sample["ner_tags"]]
-        tag_distribution = Counter(all_tags)
-        entity_counts = Counter()
-        for tag, count in tag_distribution.items():
-            if tag.startswith("B-"):
-                entity_counts[tag[2:]] = count
+    def analyze_dataset(self, samples: Optional[Iterable[Dict]] = None):
+        from .jsonl_dataset import dataset_stats
+        stats = dataset_stats(self.dataset if samples is None else samples)
         print(f"DATASET ANALYSIS")
-        print(f"Total samples: {len(self.dataset)}")
-        print(f"Total tokens: {total_tokens}")
-        print(f"Average tokens per sample: {total_tokens / len(self.dataset):.1f}")
+        print(f"Total samples: {stats['samples']}")
+        print(f"Total tokens: {stats['tokens']}")
+        print(f"Average tokens per sample: {stats['tokens_per_sample']['mean']:.1f}")
         print(f"\nEntity distribution:")
-        for entity, count in entity_counts.most_common():
+        for entity, count in stats["entity_distribution"].items():
             print(f"  {entity}: {count}")
         print(f"\nTag distribution:")
-        for tag, count in tag_distribution.most_common():
-            print(f"  {tag}: {count}")
\ No newline at end of file
+        for tag, count in stats["tag_distribution"].items():
+            print(f"  {tag}: {count}")
+        return stats
\ No newline at end of file
@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import mmap
+import hashlib
+from collections import Counter
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+
+INDEX_VERSION = 2
+# an unescaped "id": can only be a key, and the annotator writes it after the token lists;
+# "split_id", present on re-annotated rows, follows it
+ID_PATTERN = re.compile(rb'"id":\s*(-?\d+|"(?:[^"\\]|\\.)*")')
+SPLIT_ID_PATTERN = re.compile(rb'"split_id":\s*(-?\d+|"(?:[^"\\]|\\.)*")')
+SCAN_CHUNK = 64 * 1024 * 1024
+
+def _split_bucket(row_id, seed: int) -> float:
+    """Stable position in [0, 1) for a row id, independent of file order and size"""
+    digest = hashlib.blake2b(f"{seed}:{row_id}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+def file_state(path: str) -> Tuple[int, int, int]:
+    """(index version, size, mtime_ns) of a file; anything derived from it is stale once this changes"""
+    stat = os.stat(path)
+    return INDEX_VERSION, stat.st_size, stat.st_mtime_ns
+
+def dataset_stats(samples: Iterable[Dict]) -> Dict:
+    """Sample / token counts and tag distribution in one streaming pass"""
+    n_samples = 0
+    tag_distribution = Counter()
+    lengths = []
+    for sample in samples:
+        n_samples += 1
+        lengths.append(len(sample["tokens"]))
+        tag_distribution.update(sample["ner_tags"])
+    lengths = np.asarray(lengths, dtype=np.int64)
+    return {
+        "samples": n_samples,
+        "tokens": int(lengths.sum()),
+        "tokens_per_sample": {
+            "mean": float(lengths.mean()) if n_samples else 0.0,
+            "min": int(lengths.min()) if n_samples else 0,
+            "p50": float(np.percentile(lengths, 50)) if n_samples else 0.0,
+            "p95": float(np.percentile(lengths, 95)) if n_samples else 0.0,
+            "max": int(lengths.max()) if n_samples else 0,
+        },
+        "entity_distribution": {tag[2:]: count for tag, count in tag_distribution.most_common() if tag.startswith("B-")},
+        "tag_distribution": dict(tag_distribution.most_common()),
+    }
+
+class JsonlDataset:
+    """Read-only, memory-mapped JSONL file with a byte-offset index of its rows.
+
+    Rows are parsed only when accessed, so random access, iteration and id-based splits
+    keep memory proportional to the index rather than the file. The index (row starts, ends,
+    "id" values and split keys) is cached next to the file and rebuilt when the file size or
+    mtime changes.
+    """
+
+    def __init__(self, path: str, index_path: Optional[str] = None):
+        self.path = path
+        self.index_path = index_path or path + ".idx.npz"
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.starts, self.ends, self.ids, self.split_keys = self._load_index()
+
+    def _file_state(self):
+        return np.array(file_state(self.path), dtype=np.int64)
+
+    def _load_index(self):
+        state = self._file_state()
+        if os.path.exists(self.index_path):
+            with np.load(self.index_path, allow_pickle=False) as cached:
+                if np.array_equal(cached["state"], state):
+                    return cached["starts"], cached["ends"], cached["ids"].tolist(), cached["split_keys"].tolist()
+        starts, ends, ids, split_keys = self._build_index()
+        try:
+            with open(self.index_path, "wb") as f:
+                np.savez(f, state=state, starts=starts, ends=ends, ids=np.asarray(ids, dtype=str),
+                         split_keys=np.asarray(split_keys, dtype=str))
+        except OSError:
+            pass
+        return starts, ends, ids, split_keys
+
+    def _build_index(self) -> Tuple[np.ndarray, np.ndarray, list, list]:
+        mm, size = self._mm, len(self._mm)
+        newlines = []
+        for offset in range(0, size, SCAN_CHUNK):
+            chunk = np.frombuffer(mm, dtype=np.uint8, count=min(SCAN_CHUNK, size - offset), offset=offset)
+            newlines.append(np.flatnonzero(chunk == ord("\n")) + offset)
+        ends = np.concatenate(newlines) if newlines else np.zeros(0, dtype=np.int64)
+        if size and (not len(ends) or ends[-1] != size - 1):
+            ends = np.append(ends, size)
+        starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64) if len(ends) else np.zeros(0, dtype=np.int64)
+        keep = ends > starts
+        # only short lines can be blank in practice; avoid copying every row to check
+        for row in np.flatnonzero(keep & (ends - starts < 8)):
+            keep[row] = bool(mm[starts[row]:ends[row]].strip())
+        starts, ends = starts[keep], ends[keep].astype(np.int64)
+
+        ids, split_keys = [], []
+        for row, (start, end) in enumerate(zip(starts, ends)):
+            at = mm.rfind(b'"id":', start, end)
+            match = ID_PATTERN.match(mm, at, end) if at >= 0 else None
+            row_id = str(json.loads(match.group(1)) if match else row)
+            ids.append(row_id)
+            at = mm.find(b'"split_id":', at, end) if at >= 0 else -1
+            match = SPLIT_ID_PATTERN.match(mm, at, end) if at >= 0 else None
+            split_keys.append(str(json.loads(match.group(1))) if match else row_id)
+        return starts, ends, ids, split_keys
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def raw(self, row: int) -> bytes:
+        return self._mm[self.starts[row]:self.ends[row]]
+
+    def __getitem__(self, row: int) -> Dict:
+        return json.loads(self.raw(row))
+
+    def __iter__(self) -> Iterator[Dict]:
+        for row in range(len(self)):
+            yield self[row]
+
+    def rows(self, rows: Sequence[int]) -> "JsonlSubset":
+        return JsonlSubset(self, rows)
+
+    def stats(self) -> Dict:
+        return dataset_stats(self)
+
+    def split_by_id(self, test_size: float = 0.2, seed: int = 42) -> Tuple["JsonlSubset", "JsonlSubset", "JsonlSubset"]:
+        """Train / validation / test by a hash of each row's split key, in DatasetLoader's proportions.
+
+        The key is "split_id" when a row has one, else its id, so a row keeps its split when
+        others are added, the file is reordered or the row is re-annotated under a new id.
+        """
+        buckets = np.array([_split_bucket(key, seed) for key in self.split_keys])
+        test = buckets < test_size
+        val = ~test & (buckets < test_size + (1 - test_size) * test_size)
+        train = ~test & ~val
+        return tuple(self.rows(np.flatnonzero(mask)) for mask in (train, val, test))
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class JsonlSubset:
+    """A selection of rows of a JsonlDataset, parsed lazily like the dataset itself"""
+
+    def __init__(self, dataset: JsonlDataset, rows: Sequence[int]):
+        self.dataset = dataset
+        self.row_ids = np.asarray(rows, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.row_ids)
+
+    def __getitem__(self, i: int) -> Dict:
+        return self.dataset[int(self.row_ids[i])]
+
+    def __iter__(self) -> Iterator[Dict]:
+        for row in self.row_ids:
+            yield self.dataset[int(row)]
+
+    @property
+    def ids(self):
+        return [self.dataset.ids[row] for row in self.row_ids]
+
+    def stats(self) -> Dict:
+        return dataset_stats(self)
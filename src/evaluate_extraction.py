@@ -0,0 +1,147 @@
+import os
+import re
+import json
+import time
+import argparse
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.data_processing.data_annotate import InvoiceDataAutoAnnotator
+from src.utils.logger import default_logger as logger
+
+FIELDS = ["INVOICE_NUMBER", "INVOICE_DATE", "SELLER_NAME", "CLIENT_NAME", "TOTAL"]
+
+_processor = None
+_extract_kwargs = {}
+
+def _init_worker(model_path, backend, threads, mode="full", tier_policy="", header_chars=0):
+    global _processor, _extract_kwargs
+    import torch
+    torch.set_num_threads(threads)
+    from transformers import AutoTokenizer
+    from src.api.services.bundle import read_manifest, resolve_backend, load_token_classifier
+    from src.ocr.preprocessing_text import TextProcessingNER, parse_tier_policy
+
+    manifest = read_manifest(model_path)
+    model = load_token_classifier(model_path, resolve_backend(manifest, backend), manifest)
+    _processor = TextProcessingNER(model, AutoTokenizer.from_pretrained(model_path))
+    if mode == "tiered":
+        _extract_kwargs = {"policy": parse_tier_policy(tier_policy), "header_chars": header_chars}
+
+def _extract(sample):
+    text = " ".join(sample["tokens"])
+    start = time.perf_counter()
+    if _extract_kwargs:
+        fields, sources = _processor.extract_entities_tiered(text, return_sources=True, **_extract_kwargs)
+    else:
+        fields, sources = _processor.extract_entities(text, return_sources=True)
+    latency_ms = (time.perf_counter() - start) * 1000
+    return sample.get("id"), fields, sources, latency_ms
+
+def gold_fields(sample):
+    """Gold values for the served fields, rebuilt from the first span of each tag"""
+    json_data = InvoiceDataAutoAnnotator.json_data_from_tags(sample["tokens"], sample["ner_tags"])
+    invoice, subtotal = json_data["invoice"], json_data["subtotal"]
+    return {
+        "INVOICE_NUMBER": invoice["invoice_number"],
+        "INVOICE_DATE": invoice["invoice_date"],
+        "SELLER_NAME": invoice["seller_name"],
+        "CLIENT_NAME": invoice["client_name"],
+        "TOTAL": subtotal["total"],
+    }
+
+def normalize(value, relaxed=False):
+    value = re.sub(r"\s+", " ", str(value)).strip()
+    if relaxed:
+        value = re.sub(r"[\s,.]", "", value).lower()
+    return value
+
+def load_split(data_path, split, split_by="random"):
+    if split == "all":
+        return list(InvoiceDataAutoAnnotator.iter_dataset(data_path))
+    from src.training.load_dataset import DatasetLoader
+    train, val, test = DatasetLoader(file_path=data_path, split_by=split_by).load_and_split_data()
+    return list({"train": train, "validation": val, "test": test}[split])
+
+def evaluate(samples, results):
+    counts = defaultdict(Counter)
+    latencies = []
+    for sample, (_, fields, sources, latency_ms) in zip(samples, results):
+        latencies.append(latency_ms)
+        gold = gold_fields(sample)
+        for field in FIELDS:
+            stats = counts[field]
+            predicted = fields.get(field)
+            if gold[field] is None:
+                continue
+            stats["gold"] += 1
+            if predicted is None:
+                stats["missing"] += 1
+                continue
+            stats[f"source_{sources[field]}"] += 1
+            stats["exact"] += normalize(predicted) == normalize(gold[field])
+            stats["relaxed"] += normalize(predicted, True) == normalize(gold[field], True)
+
+    report = {"documents": len(samples), "fields": {}}
+    for field in FIELDS:
+        stats = counts[field]
+        n_gold = max(stats["gold"], 1)
+        n_predicted = max(stats["source_ner"] + stats["source_regex"], 1)
+        report["fields"][field] = {
+            "gold": stats["gold"],
+            "exact_match": stats["exact"] / n_gold,
+            "relaxed_match": stats["relaxed"] / n_gold,
+            "missing_rate": stats["missing"] / n_gold,
+            "regex_fallback_rate": stats["source_regex"] / n_predicted,
+        }
+    report["latency_ms"] = {
+        "mean": float(np.mean(latencies)) if latencies else None,
+        "p50": float(np.percentile(latencies, 50)) if latencies else None,
+        "p95": float(np.percentile(latencies, 95)) if latencies else None,
+    }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Entity-level evaluation of the full post-processed extraction")
+    parser.add_argument('--data_path', type=str, default='./data/invoice_ner_dataset.jsonl')
+    parser.add_argument('--split', type=str, default='test', choices=['train', 'validation', 'test', 'all'])
+    parser.add_argument('--split_by', type=str, default='random', choices=['random', 'id'])
+    parser.add_argument('--model_path', type=str, default=os.getenv("MODEL_PATH", 'mikhaelkrns/invoice-ner-v1'))
+    parser.add_argument('--backend', type=str, default=os.getenv("MODEL_BACKEND", "auto"))
+    parser.add_argument('--mode', type=str, default='full', choices=['full', 'tiered'])
+    parser.add_argument('--tier_policy', type=str, default='', help='e.g. SELLER_NAME=regex,CLIENT_NAME=ner')
+    parser.add_argument('--header_chars', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--output', type=str, default=None, help='Optional path for the JSON report')
+    args = parser.parse_args()
+
+    samples = load_split(args.data_path, args.split, args.split_by)[:args.limit]
+    logger.info(f"Evaluating {len(samples)} documents from {args.data_path} ({args.split}) with {args.workers} workers")
+
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(args.model_path, args.backend, threads,
+                                       args.mode, args.tier_policy, args.header_chars)) as executor:
+        results = list(executor.map(_extract, samples, chunksize=8))
+    wall_time = time.perf_counter() - start
+
+    report = evaluate(samples, results)
+    report["wall_time_s"] = wall_time
+    report["docs_per_sec"] = len(samples) / wall_time if wall_time else None
+
+    print(f"{'field':<16} {'gold':>5} {'exact':>7} {'relaxed':>8} {'missing':>8} {'regex':>7}")
+    for field, scores in report["fields"].items():
+        print(f"{field:<16} {scores['gold']:>5} {scores['exact_match']:>7.3f} {scores['relaxed_match']:>8.3f} "
+              f"{scores['missing_rate']:>8.3f} {scores['regex_fallback_rate']:>7.3f}")
+    print(f"latency ms: {report['latency_ms']}, docs/sec: {report['docs_per_sec']:.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
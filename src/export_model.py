@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from datetime import datetime, timezone
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModelForTokenClassification
+
+from src.api.services.bundle import MANIFEST_NAME, BACKENDS
+from src.utils.logger import default_logger as logger
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def load_sample_texts(data_path, n_samples):
+    texts = []
+    with open(data_path, encoding="utf-8") as f:
+        for line in f:
+            texts.append(" ".join(json.loads(line)["tokens"]))
+            if len(texts) >= n_samples:
+                break
+    return texts
+
+def measure(run, encoded):
+    run(encoded[0])
+    timings = []
+    for inputs in encoded:
+        start = time.perf_counter()
+        run(inputs)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"latency_ms_mean": round(float(np.mean(timings)), 3), "latency_ms_p95": round(float(np.percentile(timings, 95)), 3)}
+
+def export_onnx(model, tokenizer, onnx_dir, max_length):
+    os.makedirs(onnx_dir, exist_ok=True)
+    dummy = tokenizer("Invoice no: 123", return_tensors="pt", truncation=True, max_length=max_length)
+    input_names = list(dummy.keys())
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch", 1: "sequence"}
+    torch.onnx.export(
+        model,
+        tuple(dummy[name] for name in input_names),
+        os.path.join(onnx_dir, "model.onnx"),
+        input_names=input_names,
+        output_names=["logits"],
+        dynamic_axes=dynamic_axes,
+        opset_version=14,
+        dynamo=False,
+    )
+    # optimum's ORTModel loads config + tokenizer from the same directory as the graph
+    model.config.save_pretrained(onnx_dir)
+    tokenizer.save_pretrained(onnx_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description="Package a trained NER model into a versioned serving bundle")
+    parser.add_argument('--model_dir', type=str, default='models/final_model_NER_best')
+    parser.add_argument('--output_root', type=str, default='models/bundles')
+    parser.add_argument('--name', type=str, default='invoice-ner')
+    parser.add_argument('--backends', type=str, nargs='+', default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument('--sample_data', type=str, default='./data/invoice_ner_dataset_testing.jsonl')
+    parser.add_argument('--n_samples', type=int, default=20)
+    args = parser.parse_args()
+
+    logger.info(f"Loading model from {args.model_dir}")
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir)
+    model = AutoModelForTokenClassification.from_pretrained(args.model_dir).eval()
+    max_length = min(tokenizer.model_max_length, model.config.max_position_embeddings)
+
+    staging_dir = os.path.join(args.output_root, f".staging-{os.getpid()}")
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    model.save_pretrained(staging_dir, safe_serialization=True)
+    tokenizer.save_pretrained(staging_dir)
+
+    weights_hash = sha256_file(os.path.join(staging_dir, "model.safetensors"))
+    version = f"{datetime.now(timezone.utc):%Y%m%d%H%M%S}-{weights_hash[:8]}"
+
+    texts = load_sample_texts(args.sample_data, args.n_samples)
+    encoded = [tokenizer(t, return_tensors="pt", truncation=True, max_length=max_length) for t in texts]
+    backends = {}
+
+    with torch.inference_mode():
+        if "pytorch" in args.backends:
+            backends["pytorch"] = {"path": "."}
+            backends["pytorch"].update(measure(lambda x: model(**x), encoded))
+
+        if "pytorch_int8" in args.backends:
+            quantized = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            os.makedirs(os.path.join(staging_dir, "quantized"), exist_ok=True)
+            torch.save(quantized.state_dict(), os.path.join(staging_dir, "quantized", "pytorch_int8.pt"))
+            backends["pytorch_int8"] = {"path": "quantized/pytorch_int8.pt"}
+            backends["pytorch_int8"].update(measure(lambda x: quantized(**x), encoded))
+
+    if "onnx" in args.backends:
+        onnx_dir = os.path.join(staging_dir, "onnx")
+        export_onnx(model, tokenizer, onnx_dir, max_length)
+        backends["onnx"] = {"path": "onnx"}
+        try:
+            import onnxruntime as ort
+            session = ort.InferenceSession(os.path.join(onnx_dir, "model.onnx"), providers=["CPUExecutionProvider"])
+            names = {i.name for i in session.get_inputs()}
+            backends["onnx"].update(measure(
+                lambda x: session.run(None, {k: v.numpy() for k, v in x.items() if k in names}), encoded))
+        except ImportError:
+            logger.warning("onnxruntime not installed, ONNX latency not measured")
+
+    # ONNX serving needs optimum at runtime, so it is opt-in via MODEL_BACKEND=onnx and never the default
+    measured = {name: b["latency_ms_mean"] for name, b in backends.items() if name != "onnx" and "latency_ms_mean" in b}
+    recommended = min(measured, key=measured.get) if measured else "pytorch"
+
+    manifest = {
+        "name": args.name,
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "source": os.path.abspath(args.model_dir),
+        "sha256": {"model.safetensors": weights_hash},
+        "labels": [model.config.id2label[i] for i in range(len(model.config.id2label))],
+        "max_length": max_length,
+        "backends": backends,
+        "recommended_backend": recommended,
+    }
+    with open(os.path.join(staging_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    bundle_dir = os.path.join(args.output_root, f"{args.name}-{version}")
+    os.replace(staging_dir, bundle_dir)
+    logger.info(f"Serving bundle written to {bundle_dir}")
+    print(json.dumps(manifest, indent=2))
+    print(f"Set MODEL_PATH={bundle_dir} to serve this bundle.")
+
+if __name__ == "__main__":
+    main()
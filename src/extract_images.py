@@ -0,0 +1,172 @@
+import os
+import csv
+import json
+import glob
+import time
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from src.api.cpu import THREAD_ENV_VARS, cpu_manager, detect_available_cores
+from src.ocr.preprocessing_text import FIELDS
+from src.utils.logger import default_logger as logger
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp")
+# the Streamlit table columns first, so the CSV can be loaded back into the UI
+CSV_COLUMNS = [*FIELDS, "file_name", "error"]
+
+def _limit_threads(threads):
+    """Size torch / cv2 pools for this process; the BLAS env vars only reach libraries not yet loaded"""
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    cpu_manager.enabled = False
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+    except ImportError:
+        pass
+
+def _init_ocr_worker(threads):
+    _limit_threads(threads)
+    from src.api.config import settings
+    from src.api.services.ocr import _get_reader
+    if settings.ENABLE_OCR:
+        _get_reader()
+
+def _ocr_file(path):
+    from src.api.services.ocr import ocr_image_to_text
+    try:
+        with open(path, "rb") as f:
+            text, meta = ocr_image_to_text(f)
+        return path, text, meta, None
+    except Exception as e:
+        return path, None, None, str(e)
+
+def find_images(inputs, extensions=IMAGE_EXTENSIONS):
+    paths = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(extensions))
+        else:
+            paths.extend(p for p in glob.glob(pattern, recursive=True) if p.lower().endswith(extensions))
+    return sorted(set(paths))
+
+def load_checkpoint(checkpoint_file):
+    if not os.path.exists(checkpoint_file):
+        return set()
+    with open(checkpoint_file, encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+class ResultWriter:
+    """Appends results as CSV or JSONL and records successful paths in the checkpoint after each flush.
+
+    Failed files are written with their error but not checkpointed, so a resumed run retries them.
+    """
+
+    def __init__(self, output_file, checkpoint_file, fmt):
+        self.fmt = fmt
+        new_file = not os.path.exists(output_file) or os.path.getsize(output_file) == 0
+        self.out = open(output_file, "a", encoding="utf-8", newline="")
+        self.checkpoint = open(checkpoint_file, "a", encoding="utf-8")
+        if fmt == "csv":
+            self.writer = csv.DictWriter(self.out, fieldnames=CSV_COLUMNS)
+            if new_file:
+                self.writer.writeheader()
+
+    def write(self, rows):
+        for path, structured, ocr_meta, error in rows:
+            if self.fmt == "csv":
+                self.writer.writerow({**{f: structured.get(f, "") for f in FIELDS}, "file_name": path, "error": error or ""})
+            else:
+                self.out.write(json.dumps({"file_name": path, "structured": structured, "ocr_meta": ocr_meta,
+                                           "error": error}, ensure_ascii=False) + "\n")
+        self.out.flush()
+        # a crash between the two flushes re-processes these files on resume rather than losing them
+        self.checkpoint.write("".join(path + "\n" for path, _, _, error in rows if error is None))
+        self.checkpoint.flush()
+
+    def close(self):
+        self.out.close()
+        self.checkpoint.close()
+
+def main():
+    available = detect_available_cores()[2]
+    parser = argparse.ArgumentParser(description="Offline OCR + NER extraction over directories of invoice images")
+    parser.add_argument('inputs', nargs='+', help='Directories (walked recursively) or glob patterns')
+    parser.add_argument('--output', type=str, default='extracted_invoices.csv', help='.csv or .jsonl, appended to')
+    parser.add_argument('--checkpoint', type=str, default=None, help='Finished paths, defaults to <output>.checkpoint')
+    parser.add_argument('--ocr_workers', type=int, default=max(1, available - 1))
+    parser.add_argument('--ocr_threads', type=int, default=1, help='Threads per OCR process')
+    parser.add_argument('--ner_threads', type=int, default=1)
+    parser.add_argument('--ner_batch', type=int, default=16, help='OCR texts per batched NER call')
+    parser.add_argument('--no_resume', action='store_true')
+    args = parser.parse_args()
+
+    fmt = "jsonl" if args.output.endswith((".jsonl", ".ndjson")) else "csv"
+    checkpoint_file = args.checkpoint or args.output + ".checkpoint"
+    if args.no_resume:
+        for path in (args.output, checkpoint_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    done = load_checkpoint(checkpoint_file)
+    paths = [p for p in find_images(args.inputs) if p not in done]
+    logger.info(f"{len(paths)} images to process ({len(done)} already done), "
+                f"{args.ocr_workers} OCR workers x {args.ocr_threads} threads, NER {args.ner_threads} threads")
+    if not paths:
+        return
+
+    _limit_threads(args.ner_threads)
+    from src.api.services.extractor import ExtractorService
+    extractor = ExtractorService()
+    writer = ResultWriter(args.output, checkpoint_file, fmt)
+
+    def flush(batch):
+        ok = [item for item in batch if item[3] is None and item[1].strip()]
+        structured = dict(zip((item[0] for item in ok), extractor.extract_batch([item[1] for item in ok]))) if ok else {}
+        rows = []
+        for path, text, meta, error in batch:
+            if error is None and path not in structured:
+                error = "OCR produced empty text"
+            rows.append((path, structured.get(path, {}), meta, error))
+        writer.write(rows)
+        return sum(r[3] is not None for r in rows)
+
+    start = time.perf_counter()
+    n_done = n_errors = 0
+    pending, batch = set(), []
+    todo = iter(paths)
+    try:
+        with ProcessPoolExecutor(max_workers=args.ocr_workers, mp_context=mp.get_context("spawn"),
+                                 initializer=_init_ocr_worker, initargs=(args.ocr_threads,)) as executor:
+            # keep a bounded number of images in flight so memory does not grow with the directory
+            while True:
+                for path in todo:
+                    pending.add(executor.submit(_ocr_file, path))
+                    if len(pending) >= 2 * args.ocr_workers:
+                        break
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                batch.extend(f.result() for f in finished)
+                if len(batch) >= args.ner_batch or not pending:
+                    # taken off `batch` first so a failing flush is not repeated by the finally below
+                    current, batch = batch, []
+                    n_errors += flush(current)
+                    n_done += len(current)
+                    elapsed = time.perf_counter() - start
+                    logger.info(f"{n_done}/{len(paths)} images, {n_errors} errors, {n_done / elapsed:.2f} images/s")
+    finally:
+        if batch:
+            current, batch = batch, []
+            n_errors += flush(current)
+            n_done += len(current)
+        writer.close()
+
+    logger.info(f"Done: {n_done} images ({n_errors} errors) in {time.perf_counter() - start:.1f}s -> {args.output}")
+
+if __name__ == "__main__":
+    main()
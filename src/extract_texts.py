@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+import argparse
+
+from src.api.config import settings
+from src.api.cpu import cpu_manager
+cpu_manager.apply_env()
+
+from src.api.services.bulk_text import FORMATS, detect_format, iter_texts, extract_records, serialize
+from src.utils.logger import default_logger as logger
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk extraction over already-OCR'd texts in JSONL or CSV, without the API")
+    parser.add_argument('--input', type=str, required=True, help='JSONL ("text" or "tokens") or CSV ("OCRed Text" column)')
+    parser.add_argument('--output', type=str, default='-', help='Output path, "-" for stdout')
+    parser.add_argument('--input_format', type=str, default=None, choices=FORMATS)
+    parser.add_argument('--output_format', type=str, default=None, choices=FORMATS)
+    parser.add_argument('--text_field', type=str, default=None)
+    parser.add_argument('--chunk_size', type=int, default=settings.TEXT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    input_format = args.input_format or detect_format(args.input)
+    output_format = args.output_format or (detect_format(args.output, input_format) if args.output != '-' else input_format)
+
+    from src.api.services.extractor import ExtractorService
+    cpu_manager.apply_torch()
+    extractor = ExtractorService()
+
+    start = time.perf_counter()
+    n_records = n_errors = 0
+    out = sys.stdout if args.output == '-' else open(args.output, "w", encoding="utf-8", newline="")
+    try:
+        with open(args.input, "rb") as f:
+            records = iter_texts(f, input_format, args.text_field)
+            results = extract_records(extractor.extract_batch, records, args.chunk_size)
+
+            def counted(results):
+                nonlocal n_records, n_errors
+                for result in results:
+                    n_records += 1
+                    n_errors += result["error"] is not None
+                    yield result
+
+            for chunk in serialize(counted(results), output_format):
+                out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Extracted {n_records} records ({n_errors} errors) in {elapsed:.1f}s "
+                f"({n_records / elapsed if elapsed else 0:.1f} texts/s) -> {args.output}")
+
+if __name__ == "__main__":
+    main()
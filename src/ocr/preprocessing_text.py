@@ -1,16 +1,83 @@
 import re 
 from transformers import pipeline
+from collections import Counter
+from contextlib import contextmanager
 import numpy as np 
+import threading
+import queue
+import copy
 import os
 
+FIELDS = ['INVOICE_NUMBER', 'INVOICE_DATE', 'SELLER_NAME', 'CLIENT_NAME', 'TOTAL']
+
+# "regex": a valid regex match is decisive and NER is only needed when it is missing
+# "ner": the field always needs the model
+DEFAULT_TIER_POLICY = {
+    'INVOICE_NUMBER': 'regex',
+    'INVOICE_DATE': 'regex',
+    'TOTAL': 'regex',
+    'SELLER_NAME': 'ner',
+    'CLIENT_NAME': 'ner',
+}
+
+# score / gap thresholds of combine_entities, overridable per extraction profile
+DEFAULT_THRESHOLDS = {
+    'invoice_number_score': 0.8,
+    'name_score': 0.8,
+    'client_gap': 50,
+    'merge_gap': 20,
+}
+
+def parse_tier_policy(spec):
+    """Parse "FIELD=mode,FIELD=mode" into a policy dict on top of the defaults"""
+    policy = dict(DEFAULT_TIER_POLICY)
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        field, mode = (x.strip() for x in item.split("=", 1))
+        if field not in FIELDS or mode not in ("regex", "ner"):
+            raise ValueError(f"Invalid tier policy entry: {item!r}")
+        policy[field] = mode
+    return policy
+
+class PipelinePool:
+    """NER pipelines sharing one model, each with its own tokenizer copy, handed to one thread at a time.
+
+    Pipelines and fast tokenizers keep per-call state and are not safe to share between threads;
+    the model weights are only read under inference_mode, so they are shared. Callable like a
+    pipeline, blocking while all sessions are busy.
+    """
+
+    def __init__(self, model, tokenizer, size=1, **kwargs):
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        for i in range(self.size):
+            session_tokenizer = tokenizer if i == 0 else copy.deepcopy(tokenizer)
+            self._idle.put(pipeline("ner", model=model, tokenizer=session_tokenizer, **kwargs))
+
+    @contextmanager
+    def acquire(self):
+        import torch
+        session = self._idle.get()
+        try:
+            with torch.inference_mode():
+                yield session
+        finally:
+            self._idle.put(session)
+
+    def __call__(self, inputs, **kwargs):
+        with self.acquire() as session:
+            return session(inputs, **kwargs)
+
 class TextProcessingNER:
-    def __init__(self, model, tokenizer):
-        self.ner_pipeline = pipeline(
-            "ner",
-            model=model,
-            tokenizer=tokenizer,
-            aggregation_strategy="max"
-        )
+    """Regex + NER field extraction. Safe to call from several threads: NER goes through a
+    PipelinePool of `sessions` pipelines and post-processing only touches the call's own data
+    (tier_stats is updated under a lock)."""
+
+    LABEL_WORDS = re.compile(r'\b(seller|client|tax|iban|invoice|date)\b', re.IGNORECASE)
+
+    def __init__(self, model, tokenizer, sessions=1):
+        self.ner_pipeline = PipelinePool(model, tokenizer, size=sessions, aggregation_strategy="max")
+        self.tier_stats = Counter()
+        self._stats_lock = threading.Lock()
         
     def merge_subword_tokens(self, entities):
         """Merge subword tokens (##) back together"""
@@ -62,17 +129,18 @@ class TextProcessingNER:
         nums = re.findall(r'(\d[\d\s.,]*\d)', line)
         return nums[-1].strip() if nums else None
 
+    def _find_summary_line(self, text: str):
+        """Last "total" (then "gross worth") line holding an amount, as a regex match"""
+        for pattern in (r'(?im)^.*total.*$', r'(?im)^.*gross\s*worth.*$'):
+            for match in reversed(list(re.finditer(pattern, text))):
+                if self._pick_rightmost_amount(match.group(0)):
+                    return match
+        return None
+
     def _extract_total_from_summary(self, text: str):
-        total_lines = re.findall(r'(?im)^.*total.*$', text)
-        for line in reversed(total_lines):
-            val = self._pick_rightmost_amount(line)
-            if val:
-                return val
-        gross_lines = re.findall(r'(?im)^.*gross\s*worth.*$', text)
-        for line in reversed(gross_lines):
-            val = self._pick_rightmost_amount(line)
-            if val:
-                return val
+        match = self._find_summary_line(text)
+        if match:
+            return self._pick_rightmost_amount(match.group(0))
         return self._pick_rightmost_amount(text)
     
     def regex_extraction(self, text):
@@ -168,8 +236,8 @@ class TextProcessingNER:
         
         return ' '.join(words)
     
-    def extract_entities(self, text):
-        """Main extraction method combining NER and regex"""
+    def run_ner(self, text):
+        """Run the NER pipeline and group merged entities by type"""
         try:
             ner_results = self.ner_pipeline(text)
             merged_results = self.merge_subword_tokens(ner_results)
@@ -184,10 +252,75 @@ class TextProcessingNER:
         except Exception as e:
             print(f"NER model failed: {e}")
             ner_entities = {}
+        return ner_entities
+
+    @staticmethod
+    def entity_spans(ner_entities):
+        """Flat, offset-sorted list of the merged NER spans with plain Python types"""
+        spans = [
+            {'entity_group': e['entity_group'], 'word': e['word'], 'start': int(e['start']),
+             'end': int(e['end']), 'score': round(float(e['score']), 4)}
+            for group in ner_entities.values() for e in group
+        ]
+        return sorted(spans, key=lambda e: e['start'])
 
+    def _result(self, final_entities, sources, offsets, ner_entities, return_sources, return_entities, return_spans):
+        result = (final_entities,)
+        if return_sources:
+            result += (sources,)
+        if return_entities:
+            result += (self.entity_spans(ner_entities),)
+        if return_spans:
+            result += (offsets,)
+        return result if len(result) > 1 else final_entities
+
+    def extract_entities(self, text, return_sources=False, return_entities=False, return_spans=False):
+        """Main extraction method combining NER and regex.
+
+        With return_sources=True also returns which stage ("ner" or "regex") produced each field,
+        with return_entities=True the raw NER spans (see entity_spans), with return_spans=True the
+        (start, end) of the NER entities each NER-sourced field was taken from.
+        """
+        ner_entities = self.run_ner(text)
         regex_entities = self.regex_extraction(text)
-        
+        final_entities, sources, offsets = self.combine_entities(text, ner_entities, regex_entities)
+        return self._result(final_entities, sources, offsets, ner_entities, return_sources, return_entities, return_spans)
+
+    def run_ner_batch(self, texts, batch_size=8):
+        """run_ner over many texts; sorted by length so each pipeline batch pads little"""
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        results = [{} for _ in texts]
+        if not texts:
+            return results
+        try:
+            outputs = self.ner_pipeline([texts[i] for i in order], batch_size=batch_size)
+        except Exception as e:
+            print(f"NER model failed: {e}")
+            return results
+        for i, entities in zip(order, outputs):
+            for entity in self.merge_subword_tokens(entities):
+                results[i].setdefault(entity['entity_group'], []).append(entity)
+        return results
+
+    def extract_entities_batch(self, texts, batch_size=8, return_sources=False, return_entities=False, return_spans=False):
+        """extract_entities for a list of texts with one batched NER pass"""
+        outputs = []
+        for text, ner_entities in zip(texts, self.run_ner_batch(texts, batch_size)):
+            final_entities, sources, offsets = self.combine_entities(text, ner_entities, self.regex_extraction(text))
+            outputs.append(self._result(final_entities, sources, offsets, ner_entities, return_sources, return_entities,
+                                        return_spans))
+        return outputs
+
+    def combine_entities(self, text, ner_entities, regex_entities, thresholds=None):
+        """Pick the final value of each field from NER candidates and regex fallbacks.
+
+        Returns (fields, sources, offsets); offsets holds the (start, end) in `text` of the NER
+        entities each NER-sourced field was built from.
+        """
+        thresholds = thresholds or DEFAULT_THRESHOLDS
         final_entities = {}
+        sources = {}
+        offsets = {}
         
         for entity_type in ['INVOICE_NUMBER', 'INVOICE_DATE', 'SELLER_NAME', 'CLIENT_NAME', 'TOTAL']:
             
@@ -201,34 +334,42 @@ class TextProcessingNER:
                         if not best_ner or candidate['score'] > best_ner['score']:
                             best_ner = candidate
                 
-                if best_ner and best_ner['score'] > 0.8:
+                if best_ner and best_ner['score'] > thresholds['invoice_number_score']:
                     final_entities[entity_type] = best_ner['word'].replace('##', '').replace(' ', '')
+                    offsets[entity_type] = (best_ner['start'], best_ner['end'])
                 elif regex_candidate:
                     final_entities[entity_type] = regex_candidate
+                    sources[entity_type] = "regex"
                     
             elif entity_type == 'INVOICE_DATE':
                 if regex_candidate and len(regex_candidate) >= 8:  
                     final_entities[entity_type] = regex_candidate
+                    sources[entity_type] = "regex"
                 elif ner_candidates:
                     date_parts = [c['word'] for c in ner_candidates]
                     reconstructed = ''.join(date_parts)
                     if len(reconstructed) >= 6:
                         final_entities[entity_type] = reconstructed
+                        offsets[entity_type] = (min(c['start'] for c in ner_candidates),
+                                                max(c['end'] for c in ner_candidates))
                         
             elif entity_type == 'TOTAL':
                 if regex_candidate:
                     final_entities[entity_type] = regex_candidate
+                    sources[entity_type] = "regex"
                 elif ner_candidates:
                     best_total = max(ner_candidates, key=lambda x: x['score'])
                     final_entities[entity_type] = best_total['word']
+                    offsets[entity_type] = (best_total['start'], best_total['end'])
                     
             else:  
                 if ner_candidates:
-                    good_candidates = [c for c in ner_candidates if c['score'] > 0.8]
+                    good_candidates = [c for c in ner_candidates if c['score'] > thresholds['name_score']]
                     
                     if good_candidates:
                         if len(good_candidates) == 1:
                             final_entities[entity_type] = good_candidates[0]['word']
+                            offsets[entity_type] = (good_candidates[0]['start'], good_candidates[0]['end'])
                         else:
                             good_candidates.sort(key=lambda x: x['start'])
                             
@@ -237,15 +378,16 @@ class TextProcessingNER:
                                 last_candidate = good_candidates[-1]
                                 gap = last_candidate['start'] - first_candidate['end']
                                 
-                                if gap > 50:  
+                                if gap > thresholds['client_gap']:
                                     final_entities[entity_type] = last_candidate['word']
+                                    offsets[entity_type] = (last_candidate['start'], last_candidate['end'])
                                 else:
                                     combined_name = first_candidate['word']
                                     last_end = first_candidate['end']
                                     
                                     for candidate in good_candidates[1:]:
                                         gap = candidate['start'] - last_end
-                                        if gap <= 20: 
+                                        if gap <= thresholds['merge_gap']:
                                             if gap > 1:
                                                 combined_name += " " + candidate['word']
                                             else:
@@ -255,13 +397,14 @@ class TextProcessingNER:
                                             break
                                     
                                     final_entities[entity_type] = combined_name.strip()
+                                    offsets[entity_type] = (first_candidate['start'], last_end)
                             else:
                                 combined_name = good_candidates[0]['word']
                                 last_end = good_candidates[0]['end']
                                 
                                 for candidate in good_candidates[1:]:
                                     gap = candidate['start'] - last_end
-                                    if gap <= 20:  
+                                    if gap <= thresholds['merge_gap']: 
                                         if gap > 1:
                                             combined_name += " " + candidate['word']
                                         else:
@@ -271,11 +414,14 @@ class TextProcessingNER:
                                         break
                                 
                                 final_entities[entity_type] = combined_name.strip()
+                                offsets[entity_type] = (good_candidates[0]['start'], last_end)
                                 
                     elif regex_candidate:
                         final_entities[entity_type] = regex_candidate
+                        sources[entity_type] = "regex"
                 elif regex_candidate:
                     final_entities[entity_type] = regex_candidate
+                    sources[entity_type] = "regex"
         
         for entity_type in ['SELLER_NAME', 'CLIENT_NAME']:
             if entity_type in final_entities:
@@ -291,9 +437,151 @@ class TextProcessingNER:
                         end_pos
                     )
         
-        return final_entities
-    
+        return final_entities, {k: sources.get(k, "ner") for k in final_entities}, {
+            k: (int(start), int(end)) for k, (start, end) in offsets.items()}
 
+    @staticmethod
+    def field_spans(text, entities, ner_spans=None):
+        """(start, end) of each extracted value in the text.
 
-    
+        Fields in ner_spans (the offsets from return_spans) use the occurrence NER read. Others
+        are searched for, tolerant of the spaces and commas the combine step drops or restores;
+        TOTAL is matched from the end like the summary regex, the rest from the start.
+        """
+        spans = {}
+        for entity_type, value in entities.items():
+            if ner_spans and entity_type in ner_spans:
+                spans[entity_type] = tuple(ner_spans[entity_type])
+                continue
+            chars = [re.escape(c) for c in str(value) if not c.isspace() and c != ',']
+            if not chars:
+                continue
+            matches = list(re.finditer(r'[\s,]*'.join(chars), text, re.IGNORECASE))
+            if matches:
+                spans[entity_type] = (matches[-1] if entity_type == 'TOTAL' else matches[0]).span()
+        return spans
+
+    def regex_is_decisive(self, entity_type, value):
+        """Cheap validity check deciding whether a regex match can be trusted without NER"""
+        if not value:
+            return False
+        if entity_type == 'INVOICE_NUMBER':
+            return value.isdigit() and len(value) >= 4
+        if entity_type == 'INVOICE_DATE':
+            return len(value) >= 8
+        if entity_type == 'TOTAL':
+            return bool(re.search(r'\d', value))
+        return len(value) >= 2 and not self.LABEL_WORDS.search(value)
+
+    @staticmethod
+    def header_window(text, max_chars):
+        """Prefix of the text cut at a word boundary; NER offsets stay valid for the full text"""
+        if not max_chars or len(text) <= max_chars:
+            return text
+        cut = text.rfind(' ', 0, max_chars)
+        return text[:cut if cut > 0 else max_chars]
+
+    def summary_window(self, text, max_chars):
+        """(start, end) of a window around the summary line _extract_total_from_summary reads.
+
+        OCR output is often a single line, so long lines are narrowed to the text around
+        their last "total" / "gross worth" keyword.
+        """
+        match = self._find_summary_line(text)
+        if not match:
+            return None
+        start, end = match.span()
+        if end - start > max_chars:
+            keywords = list(re.finditer(r'(?i)total|gross\s*worth', match.group(0)))
+            anchor = start + keywords[-1].start()
+            start = max(start, anchor - max_chars // 4)
+            end = min(end, start + max_chars)
+            space = text.rfind(' ', 0, start + 1)
+            start = space + 1 if space >= 0 else start
+        return start, end
+
+    def ner_windows(self, text, header_chars, summary_chars=0):
+        """Header window plus, optionally, the summary window, merged when they overlap"""
+        header_end = len(self.header_window(text, header_chars))
+        windows = [(0, header_end)]
+        summary = self.summary_window(text, summary_chars) if summary_chars else None
+        if summary:
+            if summary[0] <= header_end:
+                windows = [(0, max(header_end, summary[1]))]
+            else:
+                windows.append(summary)
+        return windows
+
+    def run_ner_windows(self, text, windows):
+        """Run NER over several windows of the text in one batched call, offsets mapped back to the text"""
+        chunks = [text[start:end] for start, end in windows]
+        try:
+            results = self.ner_pipeline(chunks, batch_size=len(chunks))
+        except Exception as e:
+            print(f"NER model failed: {e}")
+            return {}
+
+        ner_entities = {}
+        for (offset, _), window_results in zip(windows, results):
+            for entity in self.merge_subword_tokens(window_results):
+                entity = dict(entity, start=entity['start'] + offset, end=entity['end'] + offset)
+                ner_entities.setdefault(entity['entity_group'], []).append(entity)
+        return ner_entities
+
+    def extract_entities_windowed(self, text, header_chars, summary_chars, return_sources=False, return_entities=False,
+                                  return_spans=False):
+        """Full NER + regex extraction where NER only sees the header and summary windows"""
+        ner_entities = self.run_ner_windows(text, self.ner_windows(text, header_chars, summary_chars))
+        regex_entities = self.regex_extraction(text)
+        final_entities, sources, offsets = self.combine_entities(text, ner_entities, regex_entities)
+        return self._result(final_entities, sources, offsets, ner_entities, return_sources, return_entities, return_spans)
+
+    def extract_entities_tiered(self, text, policy=None, header_chars=0, return_sources=False, summary_chars=0,
+                                return_entities=False, profile=None, return_spans=False):
+        """Regex first, NER only for fields the regex stage could not settle.
+
+        With header_chars set, NER only sees the header window, plus the summary window when
+        TOTAL is still pending and summary_chars is set. A matched ExtractionProfile (see
+        profiles.py) replaces the policy: its rules settle its rules_only fields, and its
+        header_chars and thresholds apply.
+        """
+        policy = policy or DEFAULT_TIER_POLICY
+        regex_entities = self.regex_extraction(text)
+        thresholds = None
+        if profile is None:
+            decisive = {f for f, mode in policy.items()
+                        if mode == 'regex' and self.regex_is_decisive(f, regex_entities.get(f))}
+        else:
+            # only the profile's own matches settle a field; the generic patterns stay fallbacks
+            matched = profile.apply_rules(text)
+            decisive = {f for f in profile.rules_only if matched.get(f)}
+            regex_entities.update(matched)
+            header_chars = profile.header_chars or header_chars
+            thresholds = profile.thresholds
+        pending = [f for f in FIELDS if f not in decisive]
+
+        if not pending:
+            ner_entities = {}
+            stat = 'ner_skipped'
+        elif not header_chars or ('TOTAL' in pending and not summary_chars):
+            ner_entities = self.run_ner(text)
+            stat = 'ner_full'
+        else:
+            windows = self.ner_windows(text, header_chars, summary_chars if 'TOTAL' in pending else 0)
+            ner_entities = self.run_ner_windows(text, windows)
+            stat = 'ner_windows' if len(windows) > 1 else 'ner_header'
+
+        final_entities, sources, offsets = self.combine_entities(text, ner_entities, regex_entities, thresholds)
+        for entity_type in decisive:
+            final_entities[entity_type] = regex_entities[entity_type]
+            sources[entity_type] = "regex"
+            offsets.pop(entity_type, None)
+
+        with self._stats_lock:
+            self.tier_stats['documents'] += 1
+            self.tier_stats[stat] += 1
+            if profile is not None:
+                self.tier_stats['profiled'] += 1
+            self.tier_stats.update(f'regex_decisive_{f}' for f in decisive)
 
+        return self._result(final_entities, sources, offsets, ner_entities, return_sources, return_entities, return_spans)
@@ -0,0 +1,139 @@
+import re
+import json
+import hashlib
+import threading
+from collections import Counter
+from functools import lru_cache
+
+from src.ocr.preprocessing_text import DEFAULT_THRESHOLDS
+from src.utils.logger import default_logger as logger
+
+# label words whose order in the header identifies the layout template
+HEADER_LABELS = re.compile(
+    r'\b(invoice\s+no|invoice\s+number|date\s+of\s+issue|date|seller|client|tax\s*id|iban|items|vat\s*id|bill\s+to)\b',
+    re.IGNORECASE,
+)
+# the first Tax Id / IBAN in the header is the seller's; it identifies the supplier across invoices
+SUPPLIER_ID = re.compile(r'\b(?:tax\s*id|iban):?\s*([A-Z0-9][A-Z0-9/\-]{5,})', re.IGNORECASE)
+
+def _digest(value):
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=8).hexdigest()
+
+def template_key(text, header_chars):
+    """Hash of the sequence of label words in the header, independent of the values between them"""
+    labels = [re.sub(r'\s+', ' ', label.lower()) for label in HEADER_LABELS.findall(text[:header_chars])]
+    return _digest('|'.join(labels)) if labels else None
+
+def supplier_key(text, header_chars):
+    match = SUPPLIER_ID.search(text[:header_chars])
+    if not match:
+        return None
+    return _digest(re.sub(r'[^A-Z0-9]', '', match.group(1).upper()))
+
+def fingerprint(text, header_chars):
+    """Store keys of a document, most specific first"""
+    keys = []
+    supplier = supplier_key(text, header_chars)
+    if supplier:
+        keys.append(f'supplier:{supplier}')
+    template = template_key(text, header_chars)
+    if template:
+        keys.append(f'template:{template}')
+    return keys
+
+class ExtractionProfile:
+    """Precompiled extraction rules for one supplier or layout template.
+
+    `rules` maps a field to a regex whose first group is the value (the last match is used
+    with "last": true); `rules_only` lists the fields the rules settle without NER when they
+    match; `header_chars` bounds the NER window for the other fields.
+    """
+
+    def __init__(self, spec):
+        self.key = spec['key']
+        self.name = spec.get('name', self.key)
+        self.rules = {
+            field: (re.compile(rule['pattern'], re.IGNORECASE if rule.get('ignore_case', True) else 0),
+                    rule.get('last', False))
+            for field, rule in spec.get('rules', {}).items()
+        }
+        self.rules_only = tuple(spec.get('rules_only', ()))
+        self.header_chars = spec.get('header_chars', 0)
+        self.thresholds = {**DEFAULT_THRESHOLDS, **spec.get('thresholds', {})}
+
+    def apply_rules(self, text):
+        values = {}
+        for field, (pattern, last) in self.rules.items():
+            if last:
+                match = None
+                for match in pattern.finditer(text):
+                    pass
+            else:
+                match = pattern.search(text)
+            if match and match.group(1).strip():
+                values[field] = match.group(1).strip()
+        return values
+
+    def overlay(self, other):
+        """This profile with a more specific one's rules and settings on top"""
+        merged = object.__new__(ExtractionProfile)
+        merged.key = other.key
+        merged.name = other.name
+        merged.rules = {**self.rules, **other.rules}
+        merged.rules_only = tuple(dict.fromkeys(self.rules_only + other.rules_only))
+        merged.header_chars = other.header_chars or self.header_chars
+        merged.thresholds = {**self.thresholds, **other.thresholds}
+        return merged
+
+class ProfileStore:
+    """Profiles in a JSONL file, found through a key -> byte offset index.
+
+    Only the index is held in memory; a profile line is read and compiled on first use and
+    kept in an LRU cache, so lookups stay O(1) with thousands of suppliers.
+    """
+
+    def __init__(self, path, cache_size=1024):
+        self.path = path
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        with open(self.index_path(path), encoding='utf-8') as f:
+            index = json.load(f)
+        self.header_chars = index['header_chars']
+        self.offsets = index['offsets']
+        self._load = lru_cache(maxsize=cache_size)(self._read)
+        logger.info(f"Loaded profile index with {len(self.offsets)} profiles from {path}")
+
+    @staticmethod
+    def index_path(path):
+        return path + '.index.json'
+
+    def _read(self, offset):
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return ExtractionProfile(json.loads(f.readline()))
+
+    def get(self, key):
+        offset = self.offsets.get(key)
+        return self._load(offset) if offset is not None else None
+
+    def match(self, text):
+        """Supplier profile over its template profile, either alone, or None"""
+        profile = None
+        for key in reversed(fingerprint(text, self.header_chars)):
+            found = self.get(key)
+            if found is not None:
+                profile = profile.overlay(found) if profile else found
+        with self._lock:
+            self.stats['profile_hits' if profile else 'profile_misses'] += 1
+        return profile
+
+    @classmethod
+    def write(cls, specs, path, header_chars):
+        """Write profile specs (dicts with a unique "key") and their offset index"""
+        offsets = {}
+        with open(path, 'wb') as f:
+            for spec in specs:
+                offsets[spec['key']] = f.tell()
+                f.write(json.dumps(spec, ensure_ascii=False).encode('utf-8') + b'\n')
+        with open(cls.index_path(path), 'w', encoding='utf-8') as f:
+            json.dump({'header_chars': header_chars, 'offsets': offsets}, f)
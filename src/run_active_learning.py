@@ -0,0 +1,141 @@
+import os
+import glob
+import json
+import argparse
+
+from src.data_processing.data_annotate import InvoiceDataAutoAnnotator
+from src.data_processing.jsonl_dataset import JsonlDataset
+from src.utils.logger import default_logger as logger
+
+DEFAULT_CSVS = ["data/batch_1/*.csv", "data/batch_2/batch_2/*.csv"]
+
+def tokenized_rows(data_path, rows, tokenizer, label2id):
+    from src.training.load_dataset import rows_dataset
+    from src.training.tokenized_dataset import tokenize_and_align_labels
+
+    # the JSONL is compacted every run, so the same row numbers can point at different samples
+    raw = rows_dataset(data_path, rows)
+    return raw.map(tokenize_and_align_labels, batched=True, remove_columns=raw.column_names,
+                   fn_kwargs={"tokenizer": tokenizer, "label2id": label2id})
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental loop: annotate new / changed CSV rows, pick the ones the "
+                                                 "serving model is least sure about, warm-start fine-tune on them")
+    parser.add_argument('--csv', type=str, nargs='+', default=DEFAULT_CSVS, help='CSV files or glob patterns')
+    parser.add_argument('--data_path', type=str, default='./data/invoice_ner_dataset.jsonl')
+    parser.add_argument('--manifest', type=str, default=None, help='Row manifest, defaults to <data_path>.rows.json')
+    parser.add_argument('--match_mode', type=str, default='index', choices=InvoiceDataAutoAnnotator.MATCH_MODES)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=1000)
+    parser.add_argument('--model_path', type=str, default=os.getenv("MODEL_PATH", 'mikhaelkrns/invoice-ner-v1'),
+                        help='Serving model, or bundle with its full-precision weights, to score with and warm-start from')
+    parser.add_argument('--budget', type=int, default=200, help='Most uncertain new samples to train on')
+    parser.add_argument('--min_uncertainty', type=float, default=0.0)
+    parser.add_argument('--score_batch_size', type=int, default=16)
+    parser.add_argument('--replay', type=float, default=1.0, help='Already-trained samples mixed in, per selected sample')
+    parser.add_argument('--eval_limit', type=int, default=300, help='Validation samples used to evaluate the update')
+    parser.add_argument('--test_size', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--learning_rate', type=float, default=2e-5)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--eval_batch_size', type=int, default=64)
+    parser.add_argument('--num_epochs', type=int, default=2)
+    parser.add_argument('--output_dir', type=str, default='./active_learning')
+    parser.add_argument('--final_model_dir', type=str, default='models/final_model_NER_incremental')
+    parser.add_argument('--no_train', action='store_true', help='Only annotate, score and write the selection')
+    args = parser.parse_args()
+
+    os.environ['WANDB_DISABLED'] = 'true'
+
+    csv_files = sorted({path for pattern in args.csv for path in glob.glob(pattern)})
+    logger.info(f"Checking {len(csv_files)} CSV files for new or changed rows")
+    summary = InvoiceDataAutoAnnotator(match_mode=args.match_mode).process_csv_files_incremental(
+        csv_files, output_file=args.data_path, manifest_file=args.manifest,
+        chunksize=args.chunksize, n_workers=args.workers
+    )
+    candidates = {str(i) for i in summary["new_ids"] + summary["changed_ids"]}
+    if not candidates:
+        logger.info("No new or changed rows, nothing to train on")
+        return
+
+    from transformers import AutoTokenizer
+    from src.api.services.bundle import read_manifest, require_pytorch_weights, load_token_classifier
+    from src.training.active_learning import uncertainty_scores, select_samples, replay_samples
+
+    with JsonlDataset(args.data_path) as dataset:
+        train, val, _ = dataset.split_by_id(args.test_size, args.seed)
+        # candidates that fall in validation / test stay held out so the evaluation stays honest
+        candidate_rows = [int(row) for row, sample_id in zip(train.row_ids, train.ids) if sample_id in candidates]
+        held_out = [int(row) for row, sample_id in zip(val.row_ids, val.ids) if sample_id in candidates]
+        samples = [dataset[row] for row in candidate_rows]
+
+        # scoring and warm-starting both need the trainable full-precision weights, whatever the bundle serves
+        manifest = read_manifest(args.model_path)
+        try:
+            require_pytorch_weights(args.model_path, manifest)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        tokenizer = AutoTokenizer.from_pretrained(args.model_path)
+        model = load_token_classifier(args.model_path, "pytorch", manifest)
+        label_list = [model.config.id2label[i] for i in range(len(model.config.id2label))]
+        unknown = {tag for sample in samples for tag in sample["ner_tags"]} - set(label_list)
+        if unknown:
+            raise SystemExit(f"New labels {sorted(unknown)} are not in the serving model; run a full src/run_model.py training")
+
+        logger.info(f"Scoring {len(samples)} candidate samples with {args.model_path}")
+        scores = uncertainty_scores(model, tokenizer, samples, batch_size=args.score_batch_size)
+        del model
+        selected = select_samples(candidate_rows, scores, args.budget, args.min_uncertainty)
+        candidate_set = set(candidate_rows)
+        replay = replay_samples([int(r) for r in train.row_ids if int(r) not in candidate_set],
+                                int(len(selected) * args.replay), seed=args.seed)
+        held_out_set = set(held_out)
+        eval_rows = (held_out + [int(r) for r in val.row_ids if int(r) not in held_out_set])[:args.eval_limit]
+
+        os.makedirs(args.output_dir, exist_ok=True)
+        selected_set = set(selected)
+        selection = {
+            "annotation": {k: v for k, v in summary.items() if not k.endswith("_ids")},
+            "candidates": len(candidates),
+            "held_out": len(held_out),
+            "selected": [{"id": dataset.ids[row], "file_name": dataset[row]["file_name"], "uncertainty": round(score, 4)}
+                         for score, row in sorted(zip(scores, candidate_rows), key=lambda x: -x[0]) if row in selected_set],
+            "replay": len(replay),
+        }
+    with open(os.path.join(args.output_dir, "selection.json"), "w", encoding="utf-8") as f:
+        json.dump(selection, f, indent=2)
+    logger.info(f"Selected {len(selected)} of {len(candidate_rows)} trainable candidates "
+                f"(+{len(replay)} replay, {len(eval_rows)} eval) -> {args.output_dir}/selection.json")
+    if args.no_train or not selected:
+        return
+
+    from src.training.model_training import FinalModelTrainer
+
+    logger.info(f"Warm-starting from {args.model_path}")
+    trainer_wrapper = FinalModelTrainer(model_name=args.model_path, label_list=label_list)
+    tokenized_train = tokenized_rows(args.data_path, selected + replay, trainer_wrapper.tokenizer, trainer_wrapper.label2id)
+    tokenized_eval = tokenized_rows(args.data_path, eval_rows, trainer_wrapper.tokenizer, trainer_wrapper.label2id)
+    trainer = trainer_wrapper.train_with_best_params(
+        best_params={
+            "learning_rate": args.learning_rate,
+            "per_device_train_batch_size": args.batch_size,
+            "num_train_epochs": args.num_epochs,
+            "weight_decay": 0.01,
+            "warmup_ratio": 0.1,
+        },
+        tokenized_train=tokenized_train,
+        tokenized_test=tokenized_eval,
+        output_dir=os.path.join(args.output_dir, "checkpoints"),
+        eval_batch_size=args.eval_batch_size
+    )
+
+    eval_results = trainer.evaluate()
+    for key, value in eval_results.items():
+        print(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}")
+
+    trainer.save_model(args.final_model_dir)
+    trainer.tokenizer.save_pretrained(args.final_model_dir)
+    logger.info(f"Saved updated model to {args.final_model_dir}; package it with src/export_model.py --model_dir")
+
+if __name__ == "__main__":
+    main()
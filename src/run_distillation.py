@@ -0,0 +1,81 @@
+import os
+import json
+import argparse
+
+from src.training.load_dataset import DatasetLoader
+from src.training.tokenized_dataset import TokenizedDatasetBuilder
+from src.training.distillation import DistilledModelTrainer
+from src.utils.logger import default_logger as logger
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_path', type=str, default='./data/invoice_ner_dataset.jsonl')
+    parser.add_argument('--split_by', type=str, default='random', choices=['random', 'id'],
+                        help='"id" hashes row ids into stable splits without loading the file into memory')
+    parser.add_argument('--teacher_dir', type=str, default='models/final_model_NER_best')
+    parser.add_argument('--output_dir', type=str, default='./distilled_model')
+    parser.add_argument('--student_dir', type=str, default='models/final_model_NER_student')
+    parser.add_argument('--num_layers', type=int, default=4)
+    parser.add_argument('--hidden_size', type=int, default=None)
+    parser.add_argument('--learning_rate', type=float, default=5e-5)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--eval_batch_size', type=int, default=64)
+    parser.add_argument('--num_epochs', type=int, default=6)
+    parser.add_argument('--temperature', type=float, default=2.0)
+    parser.add_argument('--alpha', type=float, default=0.5, help='Weight of the hard-label loss vs. the distillation loss')
+    parser.add_argument('--cache_dir', type=str, default='data/cache/tokenized')
+    parser.add_argument('--num_proc', type=int, default=None)
+    parser.add_argument('--latency_device', type=str, default='cpu',
+                        help='Device the teacher / student latency is measured on, e.g. cpu or cuda')
+    args = parser.parse_args()
+
+    os.environ['WANDB_DISABLED'] = 'true'
+
+    logger.info("Loading Teacher Model")
+    distiller = DistilledModelTrainer(
+        teacher_dir=args.teacher_dir,
+        num_layers=args.num_layers,
+        hidden_size=args.hidden_size
+    )
+
+    logger.info("Loading and Splitting Dataset")
+    dataset_loader = DatasetLoader(file_path=args.data_path, split_by=args.split_by)
+    train_dataset, val_dataset, test_dataset = dataset_loader.load_and_split_data()
+
+    logger.info("Building Tokenized Dataset (cached)")
+    tokenized = TokenizedDatasetBuilder(
+        tokenizer=distiller.tokenizer,
+        label_list=distiller.label_list,
+        cache_dir=args.cache_dir,
+        num_proc=args.num_proc
+    ).build(
+        {"train": train_dataset, "validation": val_dataset, "test": test_dataset},
+        data_path=args.data_path,
+        split_info=dataset_loader.split_info
+    )
+
+    logger.info("Distilling Student Model")
+    trainer = distiller.train(
+        tokenized_train=tokenized["train"],
+        tokenized_test=tokenized["validation"],
+        output_dir=args.output_dir,
+        learning_rate=args.learning_rate,
+        batch_size=args.batch_size,
+        num_epochs=args.num_epochs,
+        temperature=args.temperature,
+        alpha=args.alpha,
+        eval_batch_size=args.eval_batch_size
+    )
+
+    logger.info("Comparing Student and Teacher on Test Set")
+    report = distiller.compare(trainer.model, tokenized["test"], latency_device=args.latency_device)
+    print(json.dumps(report, indent=2))
+
+    logger.info("Saving Student Model")
+    trainer.save_model(args.student_dir)
+    distiller.tokenizer.save_pretrained(args.student_dir)
+    with open(os.path.join(args.student_dir, "distillation_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -6,23 +6,33 @@ from datasets import DatasetDict
 from src.training.load_dataset import DatasetLoader
 from src.training.hptraining import HyperparameterTraining
 from src.training.model_training import FinalModelTrainer
+from src.training.tokenized_dataset import TokenizedDatasetBuilder
 from src.utils.metrics import build_compute_metrics
 from src.utils.logger import default_logger as logger
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--data_path', type=str, required=True, default='./data/invoice_ner_dataset.jsonl')
+    parser.add_argument('--split_by', type=str, default='random', choices=['random', 'id'],
+                        help='"id" hashes row ids into stable splits without loading the file into memory')
     parser.add_argument('--model_name', type=str, default='bert-base-cased')
     parser.add_argument('--n_trials', type=int, default=10)
     parser.add_argument('--output_dir', type=str, default='./final_model')
     parser.add_argument('--final_model_dir', type=str, default='models/final_model_NER_best')
     parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--pruner', type=str, default='median', choices=['median', 'asha', 'none'])
+    parser.add_argument('--n_jobs', type=int, default=1, help='Parallel Optuna trials in this process')
+    parser.add_argument('--storage', type=str, default=None, help='Optuna storage, e.g. sqlite:///optuna_study.db')
+    parser.add_argument('--study_name', type=str, default=None)
+    parser.add_argument('--eval_batch_size', type=int, default=64)
+    parser.add_argument('--cache_dir', type=str, default='data/cache/tokenized')
+    parser.add_argument('--num_proc', type=int, default=None, help='Processes used to tokenize the dataset')
     args = parser.parse_args()
 
     os.environ['WANDB_DISABLED'] = 'true'
 
     logger.info("Loading and Splitting Dataset")
-    dataset_loader = DatasetLoader(file_path=args.data_path)
+    dataset_loader = DatasetLoader(file_path=args.data_path, split_by=args.split_by)
     train_dataset, val_dataset, test_dataset = dataset_loader.load_and_split_data()
     label_list = dataset_loader.get_label_list()
 
@@ -34,20 +44,32 @@ def main():
         label_list=label_list
     )
 
-    logger.info("Tokenizing and Aligning Labels for Training Set")
-    tokenized_train = hptraining.tokenize_and_align_labels(hptraining.train_dataset)
-
-    logger.info("Tokenizing and Aligning Labels for Validation Set")
-    tokenized_val = hptraining.tokenize_and_align_labels(hptraining.val_dataset)
-
-    logger.info("Tokenizing and Aligning Labels for Test Set")
-    tokenized_test = hptraining.tokenize_and_align_labels(test_dataset)
+    logger.info("Building Tokenized Dataset (cached)")
+    dataset_builder = TokenizedDatasetBuilder(
+        tokenizer=hptraining.tokenizer,
+        label_list=label_list,
+        cache_dir=args.cache_dir,
+        num_proc=args.num_proc
+    )
+    tokenized = dataset_builder.build(
+        {"train": train_dataset, "validation": val_dataset, "test": test_dataset},
+        data_path=args.data_path,
+        split_info=dataset_loader.split_info
+    )
+    tokenized_train = tokenized["train"]
+    tokenized_val = tokenized["validation"]
+    tokenized_test = tokenized["test"]
 
     logger.info("Starting Hyperparameter Search")
     best_params, study = hptraining.hyperparameter_tuning_optuna(
         tokenized_train=tokenized_train,
         tokenized_test=tokenized_val,
-        n_trials=args.n_trials
+        n_trials=args.n_trials,
+        pruner=args.pruner,
+        n_jobs=args.n_jobs,
+        storage=args.storage,
+        study_name=args.study_name,
+        eval_batch_size=args.eval_batch_size
     )
 
     logger.info("Initialized Final Model")
@@ -61,7 +83,8 @@ def main():
         best_params=best_params,
         tokenized_train=tokenized_train,
         tokenized_test=tokenized_test,
-        output_dir=args.output_dir
+        output_dir=args.output_dir,
+        eval_batch_size=args.eval_batch_size
     )
 
     logger.info("Process Completed Successfully")
@@ -0,0 +1,81 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils.logger import default_logger as logger
+
+def load_texts(data_path, limit):
+    texts = []
+    with open(data_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                texts.append(" ".join(json.loads(line)["tokens"]))
+            if limit and len(texts) >= limit:
+                break
+    return texts
+
+def main():
+    parser = argparse.ArgumentParser(description="Run extraction from many threads over one TextProcessingNER and check "
+                                                 "every result equals the single-threaded one")
+    parser.add_argument('--data_path', type=str, default='./data/invoice_ner_dataset_testing.jsonl')
+    parser.add_argument('--model_path', type=str, default=os.getenv("MODEL_PATH", 'mikhaelkrns/invoice-ner-v1'))
+    parser.add_argument('--backend', type=str, default=os.getenv("MODEL_BACKEND", "auto"))
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--sessions', type=int, default=None, help='NER pipelines in the pool, defaults to --threads')
+    parser.add_argument('--torch_threads', type=int, default=1, help='Intra-op threads per forward pass')
+    parser.add_argument('--rounds', type=int, default=2, help='Passes over the dataset per thread')
+    parser.add_argument('--mode', type=str, default='full', choices=['full', 'tiered'])
+    parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args()
+
+    import torch
+    torch.set_num_threads(args.torch_threads)
+    from transformers import AutoTokenizer
+    from src.api.services.bundle import read_manifest, resolve_backend, load_token_classifier
+    from src.ocr.preprocessing_text import TextProcessingNER
+
+    manifest = read_manifest(args.model_path)
+    model = load_token_classifier(args.model_path, resolve_backend(manifest, args.backend), manifest)
+    processor = TextProcessingNER(model, AutoTokenizer.from_pretrained(args.model_path),
+                                  sessions=args.sessions or args.threads)
+    extract = processor.extract_entities_tiered if args.mode == 'tiered' else processor.extract_entities
+
+    def run(text):
+        return extract(text, return_sources=True, return_entities=True)
+
+    texts = load_texts(args.data_path, args.limit)
+    start = time.perf_counter()
+    reference = [run(text) for text in texts]
+    serial_rate = len(texts) / (time.perf_counter() - start)
+    logger.info(f"Reference pass: {len(texts)} texts, {serial_rate:.1f} texts/s on one thread")
+
+    def worker(index):
+        # every thread walks the dataset in its own order so different texts overlap in the pipelines
+        order = list(range(len(texts))) * args.rounds
+        random.Random(index).shuffle(order)
+        mismatches = []
+        for i in order:
+            if run(texts[i]) != reference[i]:
+                mismatches.append(i)
+        return len(order), mismatches
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(worker, range(args.threads)))
+    elapsed = time.perf_counter() - start
+
+    done = sum(n for n, _ in results)
+    mismatched = sorted({i for _, mismatches in results for i in mismatches})
+    logger.info(f"{args.threads} threads x {processor.ner_pipeline.size} sessions: {done} extractions, "
+                f"{done / elapsed:.1f} texts/s ({done / elapsed / serial_rate:.2f}x single thread), "
+                f"{len(mismatched)} texts with non-deterministic results")
+    if mismatched:
+        logger.error(f"Results differ from the reference for texts {mismatched[:20]}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+from typing import Dict, List, Sequence
+import random
+
+import numpy as np
+import torch
+
+def uncertainty_scores(model, tokenizer, samples: Sequence[Dict], batch_size: int = 16, top_k: int = 10) -> List[float]:
+    """Least-confidence score per sample: mean of (1 - max label probability) over its
+    top_k least confident words (first sub-token of each), from batched inference.
+
+    Samples are length-sorted so each batch pads little; scores come back in input order.
+    """
+    order = sorted(range(len(samples)), key=lambda i: len(samples[i]["tokens"]))
+    scores = [0.0] * len(samples)
+    model.eval()
+    with torch.inference_mode():
+        for start in range(0, len(order), batch_size):
+            batch = [order[i] for i in range(start, min(start + batch_size, len(order)))]
+            encoded = tokenizer([samples[i]["tokens"] for i in batch], is_split_into_words=True,
+                                truncation=True, padding=True, return_tensors="pt")
+            probs = torch.softmax(model(**encoded).logits, -1)
+            confidence = probs.max(-1).values.numpy()
+            for row, i in enumerate(batch):
+                word_ids = encoded.word_ids(batch_index=row)
+                first = [pos for pos, word in enumerate(word_ids)
+                         if word is not None and (pos == 0 or word_ids[pos - 1] != word)]
+                if not first:
+                    continue
+                least = np.sort(1.0 - confidence[row, first])[-top_k:]
+                scores[i] = float(least.mean())
+    return scores
+
+def select_samples(candidate_ids: Sequence, scores: Sequence[float], budget: int,
+                   min_score: float = 0.0) -> List:
+    """The `budget` most uncertain candidates scoring at least min_score, most uncertain first"""
+    ranked = sorted(zip(scores, candidate_ids), key=lambda x: -x[0])
+    return [sample_id for score, sample_id in ranked if score >= min_score][:budget]
+
+def replay_samples(pool_ids: Sequence, n: int, seed: int = 42) -> List:
+    """Random already-trained samples mixed into the update so the model keeps what it knew"""
+    pool_ids = list(pool_ids)
+    return random.Random(seed).sample(pool_ids, min(n, len(pool_ids)))
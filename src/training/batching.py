@@ -0,0 +1,67 @@
+from transformers import TrainerCallback
+from src.utils.logger import default_logger as logger
+import time
+
+class PaddingStatsCollator:
+    """Wraps a data collator and counts real vs padded tokens in every batch it builds"""
+
+    def __init__(self, collator):
+        self.collator = collator
+        self.real_tokens = 0
+        self.padded_tokens = 0
+
+    def __call__(self, features):
+        batch = self.collator(features)
+        mask = batch["attention_mask"]
+        self.real_tokens += int(mask.sum())
+        self.padded_tokens += int(mask.numel())
+        return batch
+
+class ThroughputCallback(TrainerCallback):
+    """Reports tokens/sec and padding ratio separately for training epochs and evaluation"""
+
+    def __init__(self, collator: PaddingStatsCollator):
+        self.collator = collator
+        self.stats = {phase: {"real_tokens": 0, "padded_tokens": 0, "seconds": 0.0} for phase in ("train", "eval")}
+        self._mark()
+
+    def _mark(self):
+        self._time = time.perf_counter()
+        self._real = self.collator.real_tokens
+        self._padded = self.collator.padded_tokens
+
+    def _accumulate(self, phase):
+        stats = self.stats[phase]
+        stats["real_tokens"] += self.collator.real_tokens - self._real
+        stats["padded_tokens"] += self.collator.padded_tokens - self._padded
+        stats["seconds"] += time.perf_counter() - self._time
+        self._mark()
+
+    def summary(self):
+        result = {}
+        for phase, stats in self.stats.items():
+            if not stats["padded_tokens"]:
+                continue
+            result[f"{phase}_tokens_per_sec"] = stats["real_tokens"] / max(stats["seconds"], 1e-9)
+            result[f"{phase}_padding_ratio"] = 1 - stats["real_tokens"] / stats["padded_tokens"]
+        return result
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self._mark()
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        # evaluation runs after on_epoch_end, so everything up to here belongs to training
+        self._accumulate("train")
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        self._accumulate("eval")
+
+    def on_train_end(self, args, state, control, **kwargs):
+        summary = self.summary()
+        logger.info("Throughput: " + ", ".join(f"{k}={v:.3f}" for k, v in summary.items()))
+
+def sort_by_length(dataset, length_column: str = "length"):
+    """Order an eval split by sequence length so each eval batch pads to a similar size"""
+    if dataset is not None and length_column in dataset.column_names:
+        return dataset.sort(length_column)
+    return dataset
@@ -0,0 +1,171 @@
+from transformers import DataCollatorForTokenClassification
+from transformers import TrainingArguments, Trainer
+from transformers import AutoTokenizer, AutoModelForTokenClassification
+import torch.nn.functional as F
+import numpy as np
+import evaluate
+import torch
+import time
+import copy
+import tempfile
+from src.utils.metrics import build_compute_metrics
+from src.training.batching import PaddingStatsCollator, ThroughputCallback, sort_by_length
+
+import os
+os.environ["WANDB_DISABLED"] = "true"
+
+def build_student(teacher, num_layers: int = 4, hidden_size: int = None):
+    """Shrink the teacher's architecture; keeps vocab and label maps so the tokenizer is shared.
+
+    With the teacher's hidden size, embeddings and evenly spaced encoder layers are copied
+    from the teacher as initialisation. A smaller hidden size starts from random weights and
+    keeps the teacher's attention head size, so it has to be a multiple of it.
+    """
+    config = copy.deepcopy(teacher.config)
+    config.num_hidden_layers = num_layers
+    if hidden_size and hidden_size != teacher.config.hidden_size:
+        head_size = teacher.config.hidden_size // teacher.config.num_attention_heads
+        if hidden_size < head_size or hidden_size % head_size:
+            raise ValueError(f"hidden_size must be a multiple of the teacher's attention head size {head_size}, "
+                             f"got {hidden_size}")
+        config.hidden_size = hidden_size
+        config.num_attention_heads = hidden_size // head_size
+        config.intermediate_size = hidden_size * 4
+    student = AutoModelForTokenClassification.from_config(config)
+
+    if config.hidden_size == teacher.config.hidden_size:
+        teacher_layers = teacher.config.num_hidden_layers
+        keep = np.linspace(0, teacher_layers - 1, num_layers).round().astype(int).tolist()
+        teacher_state = teacher.state_dict()
+        student_state = student.state_dict()
+        for name in student_state:
+            source = name
+            if ".layer." in name:
+                prefix, rest = name.split(".layer.", 1)
+                idx, suffix = rest.split(".", 1)
+                source = f"{prefix}.layer.{keep[int(idx)]}.{suffix}"
+            if source in teacher_state and teacher_state[source].shape == student_state[name].shape:
+                student_state[name] = teacher_state[source].clone()
+        student.load_state_dict(student_state)
+    return student
+
+class DistillationTrainer(Trainer):
+    """Trainer whose loss mixes hard-label cross entropy with KL to the teacher's softened logits"""
+
+    def __init__(self, *args, teacher=None, temperature: float = 2.0, alpha: float = 0.5, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.teacher = teacher.to(self.args.device).eval()
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        outputs = model(**inputs)
+        with torch.no_grad():
+            teacher_logits = self.teacher(**{k: v for k, v in inputs.items() if k != "labels"}).logits
+
+        mask = inputs["labels"] != -100
+        t = self.temperature
+        student_log_probs = F.log_softmax(outputs.logits[mask] / t, dim=-1)
+        teacher_probs = F.softmax(teacher_logits[mask] / t, dim=-1)
+        kd_loss = F.kl_div(student_log_probs, teacher_probs, reduction="batchmean") * (t * t)
+
+        loss = self.alpha * outputs.loss + (1 - self.alpha) * kd_loss
+        return (loss, outputs) if return_outputs else loss
+
+class DistilledModelTrainer:
+    """Trains a smaller student against a fine-tuned teacher and saves it in the serving format"""
+
+    def __init__(self, teacher_dir, num_layers=4, hidden_size=None):
+        self.teacher_dir = teacher_dir
+        self.tokenizer = AutoTokenizer.from_pretrained(teacher_dir)
+        self.teacher = AutoModelForTokenClassification.from_pretrained(teacher_dir)
+
+        self.id2label = {int(i): label for i, label in self.teacher.config.id2label.items()}
+        self.label_list = [self.id2label[i] for i in range(len(self.id2label))]
+        self.num_layers = num_layers
+        self.hidden_size = hidden_size
+
+        self.data_collator = DataCollatorForTokenClassification(tokenizer=self.tokenizer)
+        self.metric = evaluate.load("seqeval")
+        self.compute_metrics = build_compute_metrics(self.id2label, self.metric, per_entity=True)
+
+    def train(self, tokenized_train, tokenized_test, output_dir="./distilled_model", learning_rate=5e-5,
+              batch_size=16, num_epochs=6, temperature=2.0, alpha=0.5, eval_batch_size=64):
+        collator = PaddingStatsCollator(self.data_collator)
+        self.throughput = ThroughputCallback(collator)
+
+        training_args = TrainingArguments(
+            output_dir=output_dir,
+            eval_strategy="epoch",
+            save_strategy="epoch",
+            save_total_limit=1,
+            learning_rate=learning_rate,
+            per_device_train_batch_size=batch_size,
+            per_device_eval_batch_size=eval_batch_size,
+            group_by_length=True,
+            num_train_epochs=num_epochs,
+            load_best_model_at_end=True,
+            metric_for_best_model="f1",
+            report_to="none",
+        )
+
+        trainer = DistillationTrainer(
+            model=build_student(self.teacher, self.num_layers, self.hidden_size),
+            args=training_args,
+            train_dataset=tokenized_train,
+            eval_dataset=sort_by_length(tokenized_test),
+            tokenizer=self.tokenizer,
+            data_collator=collator,
+            compute_metrics=self.compute_metrics,
+            callbacks=[self.throughput],
+            teacher=self.teacher,
+            temperature=temperature,
+            alpha=alpha,
+        )
+        trainer.train()
+        return trainer
+
+    def evaluate_model(self, model, tokenized_test, eval_batch_size=64):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            trainer = Trainer(
+                model=model,
+                args=TrainingArguments(output_dir=tmp_dir, per_device_eval_batch_size=eval_batch_size, report_to="none"),
+                eval_dataset=sort_by_length(tokenized_test),
+                tokenizer=self.tokenizer,
+                data_collator=self.data_collator,
+                compute_metrics=self.compute_metrics,
+            )
+            return trainer.evaluate()
+
+    @staticmethod
+    def measure_latency(model, tokenized_test, n_samples=100, device="cpu"):
+        """Single-document forward latency in milliseconds on `device` (CPU by default, where the
+        student is served); the model is moved there for the measurement and back afterwards"""
+        original = next(model.parameters()).device
+        device = torch.device(device)
+        model.eval().to(device)
+        columns = [c for c in ("input_ids", "attention_mask", "token_type_ids") if c in tokenized_test.column_names]
+        timings = []
+        try:
+            with torch.inference_mode():
+                for row in tokenized_test.select(range(min(n_samples, len(tokenized_test)))):
+                    inputs = {c: torch.tensor([row[c]], device=device) for c in columns}
+                    start = time.perf_counter()
+                    model(**inputs)
+                    if device.type == "cuda":
+                        torch.cuda.synchronize(device)
+                    timings.append((time.perf_counter() - start) * 1000)
+        finally:
+            model.to(original)
+        return {"latency_ms_mean": float(np.mean(timings)), "latency_ms_p95": float(np.percentile(timings, 95)),
+                "latency_device": str(device)}
+
+    def compare(self, student, tokenized_test, n_latency_samples=100, latency_device="cpu"):
+        report = {}
+        for name, model in (("teacher", self.teacher), ("student", student)):
+            scores = self.evaluate_model(model, tokenized_test)
+            scores.update(self.measure_latency(model, tokenized_test, n_latency_samples, latency_device))
+            scores["parameters"] = sum(p.numel() for p in model.parameters())
+            report[name] = scores
+        report["speedup"] = report["teacher"]["latency_ms_mean"] / report["student"]["latency_ms_mean"]
+        return report
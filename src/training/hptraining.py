@@ -1,10 +1,15 @@
 from transformers import AutoTokenizer, AutoModelForTokenClassification
-from transformers import TrainingArguments, Trainer
+from transformers import TrainingArguments, Trainer, TrainerCallback
 import optuna
 from transformers import DataCollatorForTokenClassification
 import evaluate
 import os
+import copy
+import shutil
+import tempfile
 from src.utils.metrics import build_compute_metrics
+from src.training.tokenized_dataset import tokenize_and_align_labels
+from src.training.batching import PaddingStatsCollator, ThroughputCallback, sort_by_length
 
 
 os.environ["WANDB_DISABLED"] = "true"
@@ -33,33 +38,34 @@ class HyperparameterTraining:
         self.compute_metrics = build_compute_metrics(self.id2label, self.metric)
         
     def tokenize_and_align_labels(self, dataset):
-        tokenized_inputs = self.tokenizer(dataset['tokens'], truncation=True, is_split_into_words=True)
-        labels = []
-        for i, label in enumerate(dataset['ner_tags']):
-            word_ids = tokenized_inputs.word_ids(batch_index=i)
-            label_ids = []
-            previous_word_idx = None
-            for word_idx in word_ids:
-                if word_idx is None:
-                    label_ids.append(-100)  
-                elif word_idx != previous_word_idx:
-                    if word_idx < len(label):
-                        label_ids.append(self.label2id[label[word_idx]])
-                    else:
-                        label_ids.append(-100)
-                else:
-                    if word_idx < len(label):
-                        current_label = label[word_idx]
-                        label_ids.append(self.label2id[current_label] if current_label.startswith("I-") else -100)
-                    else:
-                        label_ids.append(-100)
-                previous_word_idx = word_idx
-            labels.append(label_ids)
-        tokenized_inputs["labels"] = labels
-        return tokenized_inputs
+        return tokenize_and_align_labels(dataset, self.tokenizer, self.label2id)
 
     
-    def hyperparameter_tuning_optuna(self, tokenized_train, tokenized_test, n_trials=20):
+    @staticmethod
+    def build_pruner(pruner):
+        if pruner == "median":
+            return optuna.pruners.MedianPruner(n_startup_trials=2, n_warmup_steps=0)
+        if pruner == "asha":
+            return optuna.pruners.SuccessiveHalvingPruner(min_resource=1, reduction_factor=3)
+        return optuna.pruners.NopPruner()
+
+    def hyperparameter_tuning_optuna(self, tokenized_train, tokenized_test, n_trials=20,
+                                     pruner="median", n_jobs=1, storage=None, study_name=None,
+                                     trials_dir="./tmp_trials", eval_batch_size=64):
+        """Optuna search over training hyperparameters.
+
+        Each trial reports eval F1 after every epoch so the pruner can stop bad trials early.
+        Trials never write checkpoints; only the best params are kept and the final model is
+        retrained by FinalModelTrainer. Pass a SQLite URL as storage to share the study between
+        several processes running this search in parallel; each process keeps its trial output
+        in its own directory under trials_dir and only removes that one.
+        """
+        # snapshot of the freshly initialised model, copied per trial instead of reloading from disk
+        base_state = {k: v.detach().clone() for k, v in self.model.state_dict().items()}
+        eval_dataset = sort_by_length(tokenized_test)
+        os.makedirs(trials_dir, exist_ok=True)
+        run_dir = tempfile.mkdtemp(prefix=f"{study_name or 'study'}-{os.getpid()}-", dir=trials_dir)
+
         def objective(trial):
             learning_rate = trial.suggest_float("learning_rate", 1e-5, 1e-3, log=True)
             batch_size = trial.suggest_categorical("per_device_train_batch_size", [8, 16, 32])
@@ -68,53 +74,90 @@ class HyperparameterTraining:
             warmup_ratio = trial.suggest_float("warmup_ratio", 0.0, 0.3)
             
             def model_init():
-                return AutoModelForTokenClassification.from_pretrained(
-                        self.model_name,
-                        num_labels=len(self.label_list),
-                        id2label=self.id2label,
-                        label2id=self.label2id,
-                        ignore_mismatched_sizes=True
-                )
-            
+                model = copy.deepcopy(self.model)
+                model.load_state_dict(base_state)
+                return model
+
+            output_dir = os.path.join(run_dir, f"trial_{trial.number}")
             training_args = TrainingArguments(
-                output_dir=f"./tmp_trial_{trial.number}",
+                output_dir=output_dir,
                 eval_strategy="epoch",
-                save_strategy="epoch",
-                save_total_limit=1,  
+                save_strategy="no",
                 learning_rate=learning_rate,
                 per_device_train_batch_size=batch_size,
-                per_device_eval_batch_size=batch_size,
+                per_device_eval_batch_size=eval_batch_size,
+                group_by_length=True,
                 num_train_epochs=num_epochs,
                 weight_decay=weight_decay,
                 warmup_ratio=warmup_ratio,
-                load_best_model_at_end=True,
-                metric_for_best_model="f1",
                 logging_dir=None,  
-                report_to=None,   
+                report_to="none",
                 dataloader_pin_memory=False  
             )
             
+            pruning_callback = OptunaPruningCallback(trial)
+            collator = PaddingStatsCollator(self.data_collator)
+            throughput = ThroughputCallback(collator)
             trainer = Trainer(
                 model_init=model_init,   
                 args=training_args,
                 train_dataset=tokenized_train,
-                eval_dataset=tokenized_test,
+                eval_dataset=eval_dataset,
                 tokenizer=self.tokenizer,
-                data_collator=self.data_collator,
+                data_collator=collator,
                 compute_metrics=self.compute_metrics,
+                callbacks=[throughput, pruning_callback],
             )
             
-            trainer.train()
-            eval_result = trainer.evaluate()
+            try:
+                trainer.train()
+            finally:
+                for key, value in throughput.summary().items():
+                    trial.set_user_attr(key, value)
+                shutil.rmtree(output_dir, ignore_errors=True)
             
-            return eval_result["eval_f1"]
+            return pruning_callback.best_f1
         
-        study = optuna.create_study(direction="maximize")
-        study.optimize(objective, n_trials=n_trials)
+        study = optuna.create_study(
+            direction="maximize",
+            pruner=self.build_pruner(pruner),
+            storage=storage,
+            study_name=study_name,
+            load_if_exists=storage is not None
+        )
+        try:
+            study.optimize(objective, n_trials=n_trials, n_jobs=n_jobs)
+        finally:
+            shutil.rmtree(run_dir, ignore_errors=True)
+            try:
+                # succeeds only once no other process is still using it
+                os.rmdir(trials_dir)
+            except OSError:
+                pass
         
+        n_pruned = len([t for t in study.trials if t.state == optuna.trial.TrialState.PRUNED])
         print("OPTUNA RESULTS")
+        print(f"Trials: {len(study.trials)}, pruned: {n_pruned}")
         print(f"Best trial: {study.best_trial.number}")
         print(f"Best F1 score: {study.best_value:.4f}")
         print(f"Best params: {study.best_params}")
         
         return study.best_params, study
+
+
+class OptunaPruningCallback(TrainerCallback):
+    """Reports per-epoch eval F1 to the trial and stops training when the pruner says so"""
+
+    def __init__(self, trial):
+        self.trial = trial
+        self.best_f1 = 0.0
+
+    def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+        f1 = (metrics or {}).get("eval_f1")
+        if f1 is None:
+            return
+        self.best_f1 = max(self.best_f1, f1)
+        step = int(round(state.epoch or 0))
+        self.trial.report(f1, step)
+        if self.trial.should_prune():
+            raise optuna.TrialPruned(f"Pruned at epoch {step} with eval_f1={f1:.4f}")
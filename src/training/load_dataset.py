@@ -1,27 +1,76 @@
-from datasets import load_dataset
+from datasets import Dataset, load_dataset
+from src.data_processing.jsonl_dataset import JsonlDataset, file_state
 from src.utils.logger import default_logger as logger
 
+SPLIT_MODES = ("random", "id")
+
+def jsonl_rows(file_path, rows, state=None):
+    with JsonlDataset(file_path) as dataset:
+        yield from dataset.rows(rows)
+
+def rows_dataset(file_path, rows) -> Dataset:
+    """Arrow dataset of the given JSONL rows, written to the datasets cache and memory-mapped from there.
+
+    The cache is keyed on the generator arguments, so the file's size and mtime go in with the
+    path and row numbers; otherwise a file rewritten in place would keep serving the old rows.
+    """
+    return Dataset.from_generator(jsonl_rows, gen_kwargs={"file_path": file_path, "rows": [int(r) for r in rows],
+                                                          "state": file_state(file_path)})
+
 class DatasetLoader:
-    def __init__(self, file_path: str):
+    """Train / validation / test splits of an annotated JSONL file.
+
+    split_by="random" shuffles with `seed` as before; split_by="id" assigns rows by a hash of
+    their id through JsonlDataset's offset index, so rows keep their split as the corpus grows
+    and the file is never loaded into memory as a whole.
+    """
+
+    def __init__(self, file_path: str, test_size: float = 0.2, seed: int = 42, split_by: str = "random"):
+        if split_by not in SPLIT_MODES:
+            raise ValueError(f"split_by must be one of {SPLIT_MODES}")
         self.dataset = None
         self.file_path = file_path
+        self.test_size = test_size
+        self.seed = seed
+        self.split_by = split_by
+
+    @property
+    def split_info(self):
+        info = {"test_size": self.test_size, "seed": self.seed}
+        if self.split_by != "random":
+            info["split_by"] = self.split_by
+        return info
 
     def load_and_split_data(self):
-        dataset = load_dataset("json", data_files=self.file_path)
+        if self.split_by == "id":
+            return self._split_by_id()
+
+        dataset = load_dataset("json", data_files=self.file_path)['train']
 
-        tmp = dataset.train_test_split(test_size=0.2, seed=42)
-        dataset_train = tmp['train'].train_test_split(test_size=0.2, seed=42)
+        tmp = dataset.train_test_split(test_size=self.test_size, seed=self.seed)
+        dataset_train = tmp['train'].train_test_split(test_size=self.test_size, seed=self.seed)
 
         self.train_dataset = dataset_train['train']
-        self.val_dataset = dataset_train['validation']
+        self.val_dataset = dataset_train['test']
         self.test_dataset = tmp['test']
 
         return self.train_dataset, self.val_dataset, self.test_dataset
 
+    def _split_by_id(self):
+        with JsonlDataset(self.file_path) as dataset:
+            subsets = dataset.split_by_id(self.test_size, self.seed)
+            row_lists = [subset.row_ids.tolist() for subset in subsets]
+        self.train_dataset, self.val_dataset, self.test_dataset = (rows_dataset(self.file_path, rows) for rows in row_lists)
+        logger.info(f"Split {self.file_path} by id: {len(self.train_dataset)} train, "
+                    f"{len(self.val_dataset)} validation, {len(self.test_dataset)} test")
+        return self.train_dataset, self.val_dataset, self.test_dataset
+
     def get_label_list(self):
         try:
             logger.info("Extracting Label List From Dataset")
-            unique_labels = set(label for row in self.train_dataset['ner_tags'] for label in row)
+            unique_labels = set()
+            for batch in self.train_dataset.select_columns(['ner_tags']).iter(batch_size=1000):
+                unique_labels.update(label for row in batch['ner_tags'] for label in row)
             label_list = sorted(list(unique_labels))
             return label_list
         except:
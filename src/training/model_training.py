@@ -3,6 +3,7 @@ from transformers import TrainingArguments, Trainer
 from transformers import AutoTokenizer, AutoModelForTokenClassification
 import evaluate
 from src.utils.metrics import build_compute_metrics
+from src.training.batching import PaddingStatsCollator, ThroughputCallback, sort_by_length
 
 import os 
 os.environ["WANDB_DISABLED"] = "true"
@@ -28,8 +29,11 @@ class FinalModelTrainer:
         self.metric = evaluate.load("seqeval")
         self.compute_metrics = build_compute_metrics(self.id2label, self.metric)
 
-    def train_with_best_params(self,best_params, tokenized_train, tokenized_test,output_dir="./final_model" ):
+    def train_with_best_params(self,best_params, tokenized_train, tokenized_test,output_dir="./final_model", eval_batch_size=64):
         
+        collator = PaddingStatsCollator(self.data_collator)
+        self.throughput = ThroughputCallback(collator)
+
         training_args = TrainingArguments(
             output_dir=output_dir,
             evaluation_strategy="epoch",
@@ -37,6 +41,8 @@ class FinalModelTrainer:
             save_total_limit=1,
             learning_rate=best_params["learning_rate"],
             per_device_train_batch_size=best_params["per_device_train_batch_size"],
+            per_device_eval_batch_size=eval_batch_size,
+            group_by_length=True,
             num_train_epochs=best_params["num_train_epochs"],
             weight_decay=best_params["weight_decay"],
             warmup_ratio=best_params["warmup_ratio"],
@@ -54,10 +60,11 @@ class FinalModelTrainer:
             ),
             args=training_args,
             train_dataset=tokenized_train,
-            eval_dataset=tokenized_test,
+            eval_dataset=sort_by_length(tokenized_test),
             tokenizer=self.tokenizer,
-            data_collator=self.data_collator,
-            compute_metrics=self.compute_metrics
+            data_collator=collator,
+            compute_metrics=self.compute_metrics,
+            callbacks=[self.throughput]
         )
 
         trainer.train()
@@ -0,0 +1,97 @@
+from datasets import DatasetDict, load_from_disk
+from src.utils.logger import default_logger as logger
+from typing import Dict, List, Optional
+import hashlib
+import json
+import os
+import shutil
+
+def tokenize_and_align_labels(batch, tokenizer, label2id: Dict[str, int]):
+    """Tokenise a batch of pre-split words and align word-level tags to sub-tokens"""
+    tokenized_inputs = tokenizer(batch['tokens'], truncation=True, is_split_into_words=True)
+    labels = []
+    for i, label in enumerate(batch['ner_tags']):
+        word_ids = tokenized_inputs.word_ids(batch_index=i)
+        label_ids = []
+        previous_word_idx = None
+        for word_idx in word_ids:
+            if word_idx is None or word_idx >= len(label):
+                label_ids.append(-100)
+            elif word_idx != previous_word_idx:
+                label_ids.append(label2id[label[word_idx]])
+            else:
+                current_label = label[word_idx]
+                label_ids.append(label2id[current_label] if current_label.startswith("I-") else -100)
+            previous_word_idx = word_idx
+        labels.append(label_ids)
+    tokenized_inputs["labels"] = labels
+    tokenized_inputs["length"] = [len(ids) for ids in tokenized_inputs["input_ids"]]
+    return tokenized_inputs
+
+def file_hash(file_path: str) -> str:
+    h = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class TokenizedDatasetBuilder:
+    """Tokenises train/val/test splits once and caches them as memory-mapped Arrow files.
+
+    The cache key covers the tokenizer, the source data hash, the label list and the split
+    settings, so any of those changing triggers a rebuild.
+    """
+
+    def __init__(self, tokenizer, label_list: List[str], cache_dir: str = "data/cache/tokenized",
+                 num_proc: Optional[int] = None, batch_size: int = 1000):
+        self.tokenizer = tokenizer
+        self.label_list = label_list
+        self.label2id = {label: i for i, label in enumerate(label_list)}
+        self.cache_dir = cache_dir
+        self.num_proc = num_proc
+        self.batch_size = batch_size
+
+    def cache_key(self, data_path: str, split_info: Optional[Dict] = None) -> str:
+        key = {
+            # 3: caches are published atomically; older ones may be half-written
+            "version": 3,
+            "tokenizer": self.tokenizer.name_or_path,
+            "tokenizer_class": type(self.tokenizer).__name__,
+            "model_max_length": self.tokenizer.model_max_length,
+            "data": file_hash(data_path),
+            "labels": self.label_list,
+            "split": split_info or {},
+        }
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def build(self, splits: Dict, data_path: str, split_info: Optional[Dict] = None) -> DatasetDict:
+        cache_path = os.path.join(self.cache_dir, self.cache_key(data_path, split_info))
+        if os.path.exists(os.path.join(cache_path, "dataset_dict.json")):
+            logger.info(f"Loading tokenized dataset from cache: {cache_path}")
+            return load_from_disk(cache_path)
+
+        logger.info(f"Tokenizing dataset with num_proc={self.num_proc}, caching to {cache_path}")
+        raw = DatasetDict(splits)
+        tokenized = raw.map(
+            tokenize_and_align_labels,
+            batched=True,
+            batch_size=self.batch_size,
+            num_proc=self.num_proc,
+            remove_columns=raw["train"].column_names,
+            fn_kwargs={"tokenizer": self.tokenizer, "label2id": self.label2id},
+            desc="Tokenizing and aligning labels",
+        )
+        # save_to_disk writes dataset_dict.json before the splits, so an interrupted save would look
+        # complete; build next to the cache and move it into place only once everything is on disk
+        tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tokenized.save_to_disk(tmp_path)
+        try:
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # another process published the same cache first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.exists(os.path.join(cache_path, "dataset_dict.json")):
+                raise
+        # reload so every split is backed by the memory-mapped cache files
+        return load_from_disk(cache_path)
@@ -48,7 +48,8 @@ if run_btn:
             files = [("files", (f.name, f.getvalue(), f.type or "application/octet-stream")) for f in files_sel]
         
         with st.spinner("Memproses di server..."):
-            resp = requests.post(f"{API_URL}{endpoint}", files=files, timeout=500)
+            # tell the server when we stop waiting so it can drop the work instead of finishing it
+            resp = requests.post(f"{API_URL}{endpoint}", files=files, timeout=500, headers={"X-Request-Timeout": "500"})
 
         if not resp.ok:
             st.error(f"API error: {resp.status_code}\n{resp.text}")
@@ -78,6 +79,10 @@ if run_btn:
                 st.warning(f"⚠️ {item.get('filename')}: {err}")
                 continue
 
+            ocr_meta = item.get("ocr_meta") or (item.get("meta") or {}).get("ocr") or {}
+            if ocr_meta.get("duplicate_of"):
+                st.warning(f"⚠️ {item.get('filename')}: gambar ini sama dengan {ocr_meta['duplicate_of']} yang sudah pernah diproses.")
+
             structured = item.get("structured", {}) or {}
             if not structured:
                 st.info(f"{item.get('filename')}: Tidak ada field terdeteksi.")
@@ -1,18 +1,30 @@
-def build_compute_metrics(id2label, metric):
+import numpy as np
+
+def build_compute_metrics(id2label, metric, per_entity=False):
+    label_names = np.array([id2label[i] for i in range(len(id2label))], dtype=object)
+
     def compute_metrics(p):
         predictions, labels = p
-        predictions = predictions.argmax(axis=-1)
+        predictions = np.asarray(predictions).argmax(axis=-1)
+        labels = np.asarray(labels)
 
-        true_labels = [[id2label[l] for l in label if l != -100] for label in labels]
-        true_preds = [[id2label[p] for (p, l) in zip(pred, label) if l != -100]
-                    for pred, label in zip(predictions, labels)]
+        # mask -100 once in numpy, then split the flat tag arrays back into sequences
+        mask = labels != -100
+        boundaries = np.cumsum(mask.sum(axis=1))[:-1]
+        true_labels = [seq.tolist() for seq in np.split(label_names[labels[mask]], boundaries)]
+        true_preds = [seq.tolist() for seq in np.split(label_names[predictions[mask]], boundaries)]
 
         results = metric.compute(predictions=true_preds, references=true_labels)
 
-        return {
+        scores = {
             "precision": results["overall_precision"],
             "recall": results["overall_recall"],
             "f1": results["overall_f1"],
             "accuracy": results["overall_accuracy"],
         }
+        if per_entity:
+            for entity, entity_scores in results.items():
+                if isinstance(entity_scores, dict):
+                    scores[f"f1_{entity}"] = entity_scores["f1"]
+        return scores
     return compute_metrics
@@ -0,0 +1,35 @@
+import pytest
+
+LABELS = ["O", "B-INVOICE_NUMBER", "I-INVOICE_NUMBER", "B-INVOICE_DATE", "I-INVOICE_DATE",
+          "B-CLIENT_NAME", "I-CLIENT_NAME", "B-SELLER_NAME", "I-SELLER_NAME", "B-TOTAL", "I-TOTAL"]
+
+INVOICE_TEXTS = [
+    "Invoice no: 84652373 Date of issue: 02/23/2021 Seller: Nguyen-Roach Client: Clark-Foster Total $ 99,00",
+    "Invoice no: 51109 Date of issue: 11/02/2019 Seller: Acme Ltd Client: Bar Inc SUMMARY 10% 90,00 9,00 99,00",
+    "Invoice no: 7741 Date: 01/05/2020 Client: Smith and Sons Total 1 204,50",
+    "Seller: Foo GmbH Invoice no: 300 Gross worth 45,00 Total $ 45,00",
+]
+
+@pytest.fixture(scope="session")
+def invoice_texts():
+    return list(INVOICE_TEXTS)
+
+@pytest.fixture(scope="session")
+def tiny_model(tmp_path_factory):
+    """Randomly initialised two-layer BERT token classifier with a character-level vocabulary"""
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+
+    path = tmp_path_factory.mktemp("tiny-model")
+    chars = sorted({c.lower() for text in INVOICE_TEXTS for c in text if not c.isspace()})
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + chars + [f"##{c}" for c in chars]
+    (path / "vocab.txt").write_text("\n".join(vocab) + "\n", encoding="utf-8")
+    tokenizer = transformers.BertTokenizerFast(str(path / "vocab.txt"), do_lower_case=True)
+
+    torch.manual_seed(0)
+    config = transformers.BertConfig(
+        vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2, num_attention_heads=2, intermediate_size=64,
+        max_position_embeddings=512, id2label=dict(enumerate(LABELS)), label2id={l: i for i, l in enumerate(LABELS)},
+    )
+    model = transformers.BertForTokenClassification(config).eval()
+    return model, tokenizer
@@ -0,0 +1,48 @@
+import io
+
+import pytest
+
+from src.api.services.dedup import DuplicateIndex, image_fingerprint
+
+Image = pytest.importorskip("PIL.Image")
+ImageDraw = pytest.importorskip("PIL.ImageDraw")
+
+def render_invoice(number: str, total: str) -> bytes:
+    """A page of the same invoice template with its own number and total"""
+    page = Image.new("L", (800, 1100), 255)
+    draw = ImageDraw.Draw(page)
+    draw.rectangle((40, 40, 760, 140), outline=0, width=3)
+    draw.text((60, 70), f"Invoice no: {number}", fill=0)
+    draw.text((60, 100), "Date of issue: 02/23/2021", fill=0)
+    for row in range(8):
+        y = 200 + row * 40
+        draw.line((40, y, 760, y), fill=0)
+        draw.text((60, y + 12), f"{row + 1}. Wireless keyboard 2,00 each 45,00", fill=0)
+    draw.text((560, 1000), f"Total $ {total}", fill=0)
+    out = io.BytesIO()
+    page.save(out, format="PNG")
+    return out.getvalue()
+
+@pytest.fixture
+def invoices():
+    return render_invoice("84652373", "99,00"), render_invoice("84652374", "18,50")
+
+def test_same_template_is_not_an_exact_duplicate(invoices):
+    first, second = invoices
+    index = DuplicateIndex(capacity=10)
+    index.add(image_fingerprint(first), {"structured": {"INVOICE_NUMBER": "84652373"}})
+
+    assert index.lookup(image_fingerprint(second)) is None
+    assert index.lookup(image_fingerprint(first))["structured"]["INVOICE_NUMBER"] == "84652373"
+
+def test_near_match_needs_identical_text(invoices):
+    first, second = invoices
+    index = DuplicateIndex(capacity=10)
+    index.add(image_fingerprint(first, near=True), {"text": "Invoice no: 84652373 Total $ 99,00"})
+
+    similar = index.lookup_similar(image_fingerprint(second, near=True))
+    # the template makes the pages look alike, only the OCR text tells them apart
+    assert similar is not None
+    assert index.confirm(similar, "Invoice no: 84652374 Total $ 18,50") is None
+    assert index.stats["near_rejected"] == 1
+    assert index.confirm(similar, "Invoice no: 84652373 Total $ 99,00") is not None
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from src.data_processing.jsonl_dataset import JsonlDataset
+from src.training.load_dataset import DatasetLoader
+
+datasets = pytest.importorskip("datasets")
+
+def write_rows(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+def make_rows(label, n=40):
+    return [{"tokens": ["Invoice", "no:", str(1000 + i)], "ner_tags": ["O", "O", label], "id": i,
+             "file_name": f"invoice_{i}.png"} for i in range(n)]
+
+@pytest.fixture(autouse=True)
+def datasets_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(datasets.config, "HF_DATASETS_CACHE", str(tmp_path / "hf-cache"))
+
+def all_tags(splits):
+    return {tag for split in splits for row in split["ner_tags"] for tag in row}
+
+def test_split_by_id_sees_in_place_relabel(tmp_path):
+    path = tmp_path / "dataset.jsonl"
+    write_rows(path, make_rows("B-X"))
+    assert all_tags(DatasetLoader(str(path), split_by="id").load_and_split_data()) == {"O", "B-X"}
+
+    # same size, same row numbers, only the labels change
+    write_rows(path, make_rows("B-Y"))
+    assert all_tags(DatasetLoader(str(path), split_by="id").load_and_split_data()) == {"O", "B-Y"}
+
+def test_split_id_keeps_a_reannotated_row_in_its_split(tmp_path):
+    path = tmp_path / "dataset.jsonl"
+    rows = make_rows("B-X")
+    write_rows(path, rows)
+    with JsonlDataset(str(path)) as dataset:
+        before = [set(subset.ids) for subset in dataset.split_by_id()]
+
+    # the annotator replaces an edited row with one under a new id that carries the old id as split_id
+    edited = [{"tokens": row["tokens"], "ner_tags": row["ner_tags"], "id": 100 + row["id"], "split_id": row["id"],
+               "file_name": row["file_name"]} for row in rows[:10]]
+    write_rows(path, rows[10:] + edited)
+    with JsonlDataset(str(path)) as dataset:
+        after = [set(subset.ids) for subset in dataset.split_by_id()]
+
+    for old, new in zip(before, after):
+        assert {str(int(i) - 100) if int(i) >= 100 else i for i in new} == old
@@ -0,0 +1,36 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.ocr.preprocessing_text import PipelinePool, TextProcessingNER
+
+def test_sessions_are_not_shared(tiny_model):
+    pool = PipelinePool(*tiny_model, size=2, aggregation_strategy="max")
+    with pool.acquire() as first, pool.acquire() as second:
+        assert first is not second
+        assert first.tokenizer is not second.tokenizer
+
+        acquired = threading.Event()
+
+        def borrow():
+            with pool.acquire():
+                acquired.set()
+
+        waiter = threading.Thread(target=borrow)
+        waiter.start()
+        # both sessions are out, so a third caller has to wait
+        assert not acquired.wait(0.2)
+    assert acquired.wait(5)
+    waiter.join()
+
+def test_concurrent_extraction_matches_sequential(tiny_model, invoice_texts):
+    processor = TextProcessingNER(*tiny_model, sessions=3)
+    reference = [processor.extract_entities(text, return_sources=True, return_entities=True)
+                 for text in invoice_texts]
+    assert any(entities for _, _, entities in reference)
+
+    jobs = invoice_texts * 6
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(executor.map(
+            lambda text: processor.extract_entities(text, return_sources=True, return_entities=True), jobs))
+
+    assert results == reference * 6
@@ -0,0 +1,32 @@
+from src.ocr.preprocessing_text import TextProcessingNER
+from src.ocr.profiles import ExtractionProfile
+
+TEXT = "Invoice no: 51109 Date of issue: 11/02/2019 Seller: Acme Ltd Client: Bar Inc Total $ 99,00"
+
+def seller_entity(text, word):
+    start = text.index(word)
+    return {"entity_group": "SELLER_NAME", "word": word, "score": 0.99, "start": start, "end": start + len(word)}
+
+def make_profile(pattern):
+    return ExtractionProfile({"key": "supplier:test", "rules": {"SELLER_NAME": {"pattern": pattern}},
+                              "rules_only": ["SELLER_NAME"]})
+
+def test_ner_wins_when_profile_rule_misses(tiny_model, monkeypatch):
+    processor = TextProcessingNER(*tiny_model)
+    monkeypatch.setattr(processor, "run_ner", lambda text: {"SELLER_NAME": [seller_entity(text, "Acme Ltd")]})
+
+    # the generic Seller: regex matches this text, the profile's own rule does not
+    fields, sources = processor.extract_entities_tiered(TEXT, profile=make_profile(r"Vendor:\s*(\w+)"),
+                                                        return_sources=True)
+    assert fields["SELLER_NAME"] == "Acme Ltd"
+    assert sources["SELLER_NAME"] == "ner"
+    assert processor.tier_stats["regex_decisive_SELLER_NAME"] == 0
+
+def test_matching_profile_rule_settles_field(tiny_model, monkeypatch):
+    processor = TextProcessingNER(*tiny_model)
+    monkeypatch.setattr(processor, "run_ner", lambda text: {"SELLER_NAME": [seller_entity(text, "Bar Inc")]})
+
+    fields, sources = processor.extract_entities_tiered(TEXT, profile=make_profile(r"Seller:\s*(\w+ \w+)"),
+                                                        return_sources=True)
+    assert fields["SELLER_NAME"] == "Acme Ltd"
+    assert sources["SELLER_NAME"] == "regex"